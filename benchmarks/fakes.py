@@ -0,0 +1,445 @@
+"""
+In-memory stand-ins for the Sheets, Gmail and Gemini backends, so every
+stage can run offline (see benchmarks/throughput.py).
+
+Each fake answers the subset of its real client's API the bot uses, with
+the same call shapes (`service.users().messages().send(...).execute()`,
+`worksheet.batch_update(...)`, `model.generate_content(...)`). Every call
+sleeps for the backend's latency and fails with the backend's real quota
+error (HTTP 429 / ResourceExhausted) at its error rate, and is counted.
+
+    backends = FakeBackends(sheet_rows, inboxes, gmail=BackendProfile(latency=0.05))
+    backends.install() # before any stage runs
+"""
+import base64
+import json
+import random
+import threading
+import time
+from collections import Counter
+
+class BackendProfile:
+    """How one fake backend behaves: seconds per call (± jitter) and the share of calls that hit a quota error."""
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+
+class CallLog:
+    """Thread-safe call counter shared by all fakes ({'gmail.messages.send': 3, ...})."""
+    def __init__(self):
+        self.counts = Counter()
+        self.lock = threading.Lock()
+
+    def add(self, name, n=1):
+        with self.lock:
+            self.counts[name] += n
+
+    def snapshot(self):
+        with self.lock:
+            return Counter(self.counts)
+
+class _Backend:
+    def __init__(self, name, profile, log, seed):
+        self.name = name
+        self.profile = profile
+        self.log = log
+        self.rng = random.Random(seed)
+        self.rng_lock = threading.Lock()
+
+    def call(self, method, quota_error):
+        """Counts the call, waits out the latency and maybe raises quota_error()."""
+        self.log.add(f"{self.name}.{method}")
+        with self.rng_lock:
+            delay = self.profile.latency + self.rng.uniform(-self.profile.jitter, self.profile.jitter)
+            failed = self.rng.random() < self.profile.error_rate
+        if delay > 0:
+            time.sleep(delay)
+        if failed:
+            self.log.add(f"{self.name}.quota_errors")
+            raise quota_error()
+
+def b64(data):
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    return base64.urlsafe_b64encode(data).decode('ascii')
+
+# --- Sheets (gspread) ---
+
+def _sheets_error(code, status, message):
+    import requests
+    from gspread.exceptions import APIError
+    response = requests.Response()
+    response.status_code = code
+    response._content = json.dumps({'error': {'code': code, 'status': status, 'message': message}}).encode()
+    return APIError(response)
+
+def _sheets_quota_error():
+    return _sheets_error(429, 'RESOURCE_EXHAUSTED', "Quota exceeded for quota metric 'Write requests'")
+
+class FakeWorksheet:
+    title = 'Sheet1'
+
+    def __init__(self, backend, rows):
+        self.backend = backend
+        self.rows = [list(r) for r in rows]
+        self.lock = threading.Lock()
+
+    def get_all_values(self):
+        self.backend.call('get_all_values', _sheets_quota_error)
+        with self.lock:
+            return [list(r) for r in self.rows]
+
+    def _set(self, row, col, value):
+        while len(self.rows) < row:
+            self.rows.append([])
+        cells = self.rows[row - 1]
+        if len(cells) < col:
+            cells.extend([''] * (col - len(cells)))
+        cells[col - 1] = value
+
+    def update_cell(self, row, col, value):
+        self.backend.call('update_cell', _sheets_quota_error)
+        with self.lock:
+            self._set(row, col, value)
+
+    def batch_update(self, data, **kwargs):
+        from gspread.utils import a1_range_to_grid_range
+        # Like gspread 6: each 'range' is rewritten in place before the request goes out
+        for item in data:
+            item['range'] = f"'{self.title}'!{item['range']}"
+        self.backend.call('batch_update', _sheets_quota_error)
+        if any(item['range'].count('!') > 1 for item in data):
+            raise _sheets_error(400, 'INVALID_ARGUMENT', f"Unable to parse range: {data[0]['range']}")
+        with self.lock:
+            for item in data:
+                grid = a1_range_to_grid_range(item['range'].partition('!')[2])
+                for dr, values in enumerate(item['values']):
+                    for dc, value in enumerate(values):
+                        self._set(grid['startRowIndex'] + dr + 1, grid['startColumnIndex'] + dc + 1, value)
+
+class FakeSpreadsheet:
+    def __init__(self, worksheet):
+        self.sheet1 = worksheet
+
+class FakeGspreadClient:
+    def __init__(self, worksheet):
+        self.worksheet = worksheet
+
+    def open_by_key(self, key):
+        return FakeSpreadsheet(self.worksheet)
+
+# --- Gmail (googleapiclient) ---
+
+def _gmail_quota_error():
+    import httplib2
+    from googleapiclient.errors import HttpError
+    content = json.dumps({'error': {'code': 429, 'message': 'User-rate limit exceeded',
+                                    'errors': [{'reason': 'rateLimitExceeded', 'domain': 'usageLimits'}]}})
+    return HttpError(httplib2.Response({'status': 429}), content.encode())
+
+class _Request:
+    """What the API methods return: nothing happens until execute()."""
+    def __init__(self, backend, method, fn, account=None):
+        self.backend = backend
+        self.method = method
+        self.fn = fn
+        # Same attributes as the requests modules.retry.gmail_request_builder makes
+        self.methodId = f"gmail.users.{method}"
+        self.account = account
+
+    def execute(self, **kwargs):
+        # Retried and recorded like a real built request
+        from modules import retry
+        return retry.call(self._execute, 'gmail', self.method, self.account,
+                          idempotent=self.method not in retry.NOT_IDEMPOTENT)
+
+    def _execute(self):
+        self.backend.call(self.method, _gmail_quota_error)
+        return self.fn()
+
+class _BatchRequest:
+    """new_batch_http_request(): one round trip, a callback (and possibly a quota error) per request."""
+    def __init__(self, mailbox, callback):
+        self.mailbox = mailbox
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request, callback=None, request_id=None):
+        self.requests.append((request, callback or self.callback, request_id or str(len(self.requests) + 1)))
+
+    def execute(self, **kwargs):
+        self.mailbox.backend.call('batch', _gmail_quota_error)
+        for request, callback, request_id in self.requests:
+            try:
+                self.mailbox.backend.log.add(f"gmail.{request.method}")
+                with self.mailbox.backend.rng_lock:
+                    failed = self.mailbox.backend.rng.random() < self.mailbox.backend.profile.error_rate
+                if failed:
+                    self.mailbox.backend.log.add("gmail.quota_errors")
+                    raise _gmail_quota_error()
+                response = request.fn()
+            except Exception as e:
+                callback(request_id, None, e)
+            else:
+                callback(request_id, response, None)
+
+class FakeMailbox:
+    """
+    One account's mailbox, shaped like a built Gmail service.
+    Messages are {'id', 'threadId', 'labelIds', 'payload', 'historyId', 'internalDate'}.
+    """
+    def __init__(self, backend, email, messages=()):
+        self.backend = backend
+        self.email = email
+        self.messages_by_id = {}
+        self.attachments_by_id = {}
+        self.sent = []
+        self.history_id = 1000
+        self.lock = threading.Lock()
+        for message in messages:
+            self.deliver(message)
+
+    def deliver(self, message, attachments=None):
+        """Adds an incoming message (attachments: {attachment_id: bytes})."""
+        with self.lock:
+            self.history_id += 1
+            message = dict(message, historyId=str(self.history_id))
+            message.setdefault('internalDate', str(self.history_id * 1000)) # delivery order, like Gmail's ms timestamp
+            self.messages_by_id[message['id']] = message
+            for att_id, data in (attachments or {}).items():
+                self.attachments_by_id[(message['id'], att_id)] = data
+
+    def users(self):
+        return self
+
+    def messages(self):
+        return _Messages(self)
+
+    def threads(self):
+        return _Threads(self)
+
+    def history(self):
+        return _History(self)
+
+    def attachments(self):
+        return _Attachments(self)
+
+    def getProfile(self, userId):
+        return _Request(self.backend, 'getProfile', lambda: {'emailAddress': self.email, 'historyId': str(self.history_id)}, self.email)
+
+    def new_batch_http_request(self, callback=None):
+        return _BatchRequest(self, callback)
+
+    def _relabel(self, msg_id, body):
+        message = self.messages_by_id[msg_id]
+        labels = [l for l in message['labelIds'] if l not in body.get('removeLabelIds', [])]
+        message['labelIds'] = labels + [l for l in body.get('addLabelIds', []) if l not in labels]
+
+class _Messages:
+    def __init__(self, mailbox):
+        self.mailbox = mailbox
+
+    def list(self, userId, labelIds=None, q=None, pageToken=None, maxResults=100, **kwargs):
+        def run():
+            with self.mailbox.lock:
+                wanted = set(labelIds or [])
+                found = [{'id': m['id'], 'threadId': m['threadId']} for m in self.mailbox.messages_by_id.values()
+                         if wanted.issubset(m['labelIds'])]
+            start = int(pageToken or 0)
+            page = found[start:start + maxResults]
+            response = {'messages': page, 'resultSizeEstimate': len(page)} if page else {'resultSizeEstimate': 0}
+            if start + maxResults < len(found):
+                response['nextPageToken'] = str(start + maxResults)
+            return response
+        return _Request(self.mailbox.backend, 'messages.list', run, self.mailbox.email)
+
+    def get(self, userId, id, format='full', metadataHeaders=None):
+        def run():
+            with self.mailbox.lock:
+                message = self.mailbox.messages_by_id[id]
+                payload = message['payload']
+                if format == 'metadata':
+                    headers = [h for h in payload.get('headers', [])
+                               if metadataHeaders is None or h['name'] in metadataHeaders]
+                    payload = {'mimeType': payload.get('mimeType'), 'headers': headers}
+                return dict(message, payload=payload)
+        return _Request(self.mailbox.backend, 'messages.get', run, self.mailbox.email)
+
+    def send(self, userId, body):
+        def run():
+            with self.mailbox.lock:
+                self.mailbox.sent.append(body)
+                self.mailbox.history_id += 1
+                return {'id': f"sent-{len(self.mailbox.sent)}", 'threadId': body.get('threadId') or f"sent-{len(self.mailbox.sent)}",
+                        'labelIds': ['SENT']}
+        return _Request(self.mailbox.backend, 'messages.send', run, self.mailbox.email)
+
+    def modify(self, userId, id, body):
+        def run():
+            with self.mailbox.lock:
+                self.mailbox._relabel(id, body)
+                return {'id': id}
+        return _Request(self.mailbox.backend, 'messages.modify', run, self.mailbox.email)
+
+    def batchModify(self, userId, body):
+        def run():
+            with self.mailbox.lock:
+                for msg_id in body.get('ids', []):
+                    self.mailbox._relabel(msg_id, body)
+            return ''
+        return _Request(self.mailbox.backend, 'messages.batchModify', run, self.mailbox.email)
+
+    def attachments(self):
+        return _Attachments(self.mailbox)
+
+class _Attachments:
+    def __init__(self, mailbox):
+        self.mailbox = mailbox
+
+    def get(self, userId, messageId, id):
+        def run():
+            data = self.mailbox.attachments_by_id[(messageId, id)]
+            return {'attachmentId': id, 'size': len(data), 'data': b64(data)}
+        return _Request(self.mailbox.backend, 'messages.attachments.get', run, self.mailbox.email)
+
+class _Threads:
+    def __init__(self, mailbox):
+        self.mailbox = mailbox
+
+    def get(self, userId, id, format='full', metadataHeaders=None):
+        def run():
+            with self.mailbox.lock:
+                messages = [{'id': m['id'], 'threadId': id, 'labelIds': m['labelIds'], 'payload': m['payload']}
+                            for m in self.mailbox.messages_by_id.values() if m['threadId'] == id]
+            return {'id': id, 'messages': messages}
+        return _Request(self.mailbox.backend, 'threads.get', run, self.mailbox.email)
+
+class _History:
+    def __init__(self, mailbox):
+        self.mailbox = mailbox
+
+    def list(self, userId, startHistoryId, historyTypes=None, labelId=None, pageToken=None, maxResults=100, **kwargs):
+        def run():
+            start = int(startHistoryId)
+            with self.mailbox.lock:
+                records = [{'id': m['historyId'],
+                            'messagesAdded': [{'message': {'id': m['id'], 'threadId': m['threadId'], 'labelIds': m['labelIds']}}]}
+                           for m in self.mailbox.messages_by_id.values()
+                           if int(m['historyId']) > start and (labelId is None or labelId in m['labelIds'])]
+                return {'history': records, 'historyId': str(self.mailbox.history_id)}
+        return _Request(self.mailbox.backend, 'history.list', run, self.mailbox.email)
+
+class FakeAccountSession:
+    """Stands in for services.AccountSession: a mailbox that verifies as its own address."""
+    def __init__(self, mailbox):
+        self.email = mailbox.email
+        self.service = mailbox
+        self.verified = None
+
+    def refresh_if_needed(self):
+        pass
+
+    def verify_identity(self):
+        if self.verified is None:
+            try:
+                self.verified = self.service.users().getProfile(userId='me').execute()['emailAddress'] == self.email
+            except Exception:
+                return False
+        return self.verified
+
+# --- Gemini (google.generativeai) ---
+
+def _gemini_quota_error():
+    from google.api_core.exceptions import ResourceExhausted
+    return ResourceExhausted("Resource has been exhausted (e.g. check quota).")
+
+class FakeUsage:
+    def __init__(self, prompt_tokens, output_tokens):
+        self.prompt_token_count = prompt_tokens
+        self.candidates_token_count = output_tokens
+        self.total_token_count = prompt_tokens + output_tokens
+
+class FakeResponse:
+    def __init__(self, text, usage):
+        self.text = text
+        self.usage_metadata = usage
+
+class FakeGenerativeModel:
+    """
+    Replaces genai.GenerativeModel. Payment checks (a prompt with an image)
+    answer YES; anything else gets a short sales reply.
+    """
+    backend = None # set by FakeBackends.install()
+
+    def __init__(self, model_name=None, **kwargs):
+        self.model_name = model_name
+        self._client = None
+
+    def generate_content(self, contents, **kwargs):
+        self.backend.call('generate_content', _gemini_quota_error)
+        parts = contents if isinstance(contents, (list, tuple)) else [contents]
+        prompt_tokens = sum(len(p) // 4 + 1 if isinstance(p, str) else 258 for p in parts)
+        if any(not isinstance(p, str) for p in parts):
+            text = "YES"
+        else:
+            text = "Thanks for getting back to me! The special price is still open this week. Shall we go ahead?\n\nBest regards"
+        return FakeResponse(text, FakeUsage(prompt_tokens, len(text) // 4 + 1))
+
+class FakeBackends:
+    """
+    The three fakes together. `install()` points modules.services (and every
+    stage module that imported from it) and google.generativeai at them.
+    """
+    def __init__(self, sheet_rows, inboxes=None, sheets=None, gmail=None, gemini=None, seed=0):
+        self.log = CallLog()
+        self.sheets = _Backend('sheets', sheets or BackendProfile(), self.log, seed)
+        self.gmail = _Backend('gmail', gmail or BackendProfile(), self.log, seed + 1)
+        self.gemini = _Backend('gemini', gemini or BackendProfile(), self.log, seed + 2)
+        self.worksheet = FakeWorksheet(self.sheets, sheet_rows)
+        self.gspread_client = FakeGspreadClient(self.worksheet)
+        self.mailboxes = {}
+        for email, (messages, attachments) in (inboxes or {}).items():
+            mailbox = self.mailbox(email)
+            for message in messages:
+                mailbox.deliver(message, attachments.get(message['id']))
+        self.default_mailbox = FakeMailbox(self.gmail, 'bot@bench.local')
+        self.sessions = {}
+        self.lock = threading.Lock()
+
+    def mailbox(self, email):
+        email = email.strip().lower()
+        if email not in self.mailboxes:
+            self.mailboxes[email] = FakeMailbox(self.gmail, email)
+        return self.mailboxes[email]
+
+    def get_session(self, email):
+        email = email.strip().lower()
+        with self.lock:
+            if email not in self.sessions:
+                self.sessions[email] = FakeAccountSession(self.mailbox(email))
+            return self.sessions[email]
+
+    def install(self):
+        import sys
+        import google.generativeai as genai
+        from modules import services
+
+        FakeGenerativeModel.backend = self.gemini
+        genai.GenerativeModel = FakeGenerativeModel
+        replacements = {
+            'get_session': self.get_session,
+            'get_gmail_service': lambda: self.default_mailbox,
+            'get_gspread_client': lambda: self.gspread_client,
+        }
+        for name, fn in replacements.items():
+            setattr(services, name, fn)
+        # Stage modules bind these names at import time (from modules.services import ...)
+        for module_name, module in list(sys.modules.items()):
+            if module_name.startswith('modules.') and module is not services:
+                for name, fn in replacements.items():
+                    if hasattr(module, name):
+                        setattr(module, name, fn)
+
+    def sent_count(self):
+        return sum(len(m.sent) for m in self.mailboxes.values()) + len(self.default_mailbox.sent)
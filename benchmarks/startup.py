@@ -0,0 +1,101 @@
+"""
+Startup-time benchmark: how long each entry point takes just to import.
+
+Runs `python -X importtime -c "import <module>"` in a fresh interpreter a
+few times per entry point and reports the median import time (minus what a
+bare interpreter already spends at startup, e.g. site/.pth hooks), so a
+change that drags a heavy library back onto the import path shows up here.
+The heavy libraries themselves are measured too, for reference: they are
+now loaded only when a stage actually needs them.
+
+Usage (from the repository root):
+    python benchmarks/startup.py
+    python benchmarks/startup.py --repeat 9 --top 10
+    python benchmarks/startup.py --budget-ms 150   # exit 1 if an entry point is over budget
+"""
+import os
+import sys
+import argparse
+import statistics
+import subprocess
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# What main.py imports before the first stage runs, then each stage module
+ENTRY_POINTS = {
+    'main (startup)': 'modules.sheet, modules.services',
+    'outreach': 'modules.outreach',
+    'followup': 'modules.followup',
+    'replier': 'modules.replier',
+    'delivery': 'modules.delivery',
+}
+# Loaded lazily, when a stage first needs them
+HEAVY_LIBRARIES = {
+    'google.generativeai': 'google.generativeai',
+    'googleapiclient.discovery': 'googleapiclient.discovery',
+    'gspread': 'gspread',
+    'PIL.Image': 'PIL.Image',
+}
+
+def import_profile(modules):
+    """One fresh interpreter: [(module, self_us, cumulative_us, depth), ...] from -X importtime."""
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {modules}' if modules else 'pass'],
+        cwd=REPO_ROOT, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"import {modules} failed:\n{result.stderr.strip()[-2000:]}")
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip())) // 2
+        rows.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return rows
+
+def total_ms(rows):
+    # Top-level entries' cumulative times add up to the whole import
+    return sum(cumulative for _, _, cumulative, depth in rows if depth == 0) / 1000
+
+def measure(modules, repeat):
+    runs = [import_profile(modules) for _ in range(repeat)]
+    totals = [total_ms(rows) for rows in runs]
+    return statistics.median(totals), runs[-1]
+
+def heaviest(rows, top, skip=()):
+    """The `top` imports with the largest cumulative time (ms), ignoring `skip`."""
+    return sorted(((cumulative / 1000, name) for name, _, cumulative, _ in rows if name not in skip), reverse=True)[:top]
+
+def main():
+    parser = argparse.ArgumentParser(description="Import-time benchmark for the bot's entry points.")
+    parser.add_argument('--repeat', type=int, default=5, help="fresh interpreters per entry point (median is reported)")
+    parser.add_argument('--top', type=int, default=0, help="also list the N heaviest imports of each entry point")
+    parser.add_argument('--budget-ms', type=float, default=None, help="fail if an entry point takes longer than this")
+    args = parser.parse_args()
+
+    # Warm the bytecode cache once so every measured run sees the same state
+    import_profile(', '.join(ENTRY_POINTS.values()))
+
+    baseline, baseline_rows = measure('', args.repeat)
+    startup_modules = {name for name, _, _, _ in baseline_rows}
+    print(f"Import time, median of {args.repeat} runs ({sys.executable})")
+    print(f"Interpreter startup ({baseline:.1f} ms) is subtracted.\n")
+    over_budget = []
+    for title, table in (("Entry points", ENTRY_POINTS), ("Lazily loaded libraries", HEAVY_LIBRARIES)):
+        print(title)
+        for label, modules in table.items():
+            median, rows = measure(modules, args.repeat)
+            median = max(0.0, median - baseline)
+            print(f"  {label:<28} {median:8.1f} ms")
+            for ms, name in heaviest(rows, args.top, startup_modules):
+                print(f"      {ms:8.1f} ms  {name}")
+            if table is ENTRY_POINTS and args.budget_ms is not None and median > args.budget_ms:
+                over_budget.append(label)
+        print()
+
+    if over_budget:
+        print(f"❌ Over the {args.budget_ms:g} ms budget: {', '.join(over_budget)}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
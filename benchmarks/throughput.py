@@ -0,0 +1,258 @@
+"""
+End-to-end throughput benchmark: every stage against in-memory backends.
+
+Generates a synthetic lead sheet (rows spread over N Gmail accounts, in
+every status a stage acts on) and unread inboxes, plugs in the fakes from
+benchmarks/fakes.py with the given latency and quota-error rates, then
+runs the stages in main.py's order on one sheet snapshot. For each stage
+it reports wall time, emails sent, API calls per backend, Gmail quota
+units and peak Python memory (tracemalloc). Send pacing is turned off: the windows are seconds
+of deliberate idle time, not work.
+
+Usage (from the repository root):
+    python benchmarks/throughput.py
+    python benchmarks/throughput.py --rows 100000 --accounts 50 --unread 2000
+    python benchmarks/throughput.py --gmail-latency 0.1 --gemini-errors 0.05 --stages replier
+    python benchmarks/throughput.py --json > result.json
+"""
+import os
+import sys
+import io
+import json
+import time
+import random
+import argparse
+import tempfile
+import tracemalloc
+import contextlib
+from datetime import datetime, timedelta
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from benchmarks.fakes import FakeBackends, BackendProfile, b64
+
+HEADERS = ['Date', 'Gmail Account', 'Client Name', 'Email', 'Selected Skill', 'First Price', 'Offer Price',
+           'Final Price', 'Free Gift', 'Portfolio Link', 'Status', 'Final Drive Link', 'Payment Status',
+           'Delivery Status', 'Delivery Date']
+
+# (status, payment status, share of rows); new leads are dated today, the rest 5 days ago
+LEAD_MIX = [
+    ('', '', 0.20), # outreach
+    ('Sent', '', 0.30), # follow-up
+    ('Followed Up', '', 0.10),
+    ('Negotiating', '', 0.20),
+    ('Design Ready', '', 0.05), # payment request
+    ('Design Ready', 'Payment Pending', 0.05), # payment screenshot
+    ('Done', '', 0.05), # delivery
+    ('Delivered', '', 0.03),
+    ('Opt-out', '', 0.02),
+]
+# Leads whose mail the replier answers
+CONVERSING = {'Sent', 'Followed Up', 'Negotiating', 'Design Ready'}
+
+REPLY_TEXTS = [
+    "How much exactly would the premium logo cost?",
+    "Can you do it for less? My budget is tight.",
+    "Okay, agreed. Send me the details.",
+    "Brand name is Northwind, colours navy and gold.",
+    "What does the free gift include?",
+    "Yes please, send me the link.", # settled locally (see modules.classifier)
+    "Thanks!",
+    "I am currently out of the office with limited access to email.",
+]
+OPT_OUT_TEXT = "Please stop emailing me."
+STRANGER_TEXT = "Limited offer just for you!"
+
+STAGES = {
+    'outreach': ('modules.outreach', 'send_outreach_emails'),
+    'followup': ('modules.followup', 'run_followup'),
+    'replier': ('modules.replier', 'process_replies'),
+    'delivery': ('modules.delivery', 'run_delivery'),
+}
+
+def make_sheet(rows, accounts, rng):
+    """Header plus `rows` leads spread round-robin over `accounts`."""
+    today = datetime.now().strftime("%d/%m/%Y") # outreach compares against the IST date; close enough off midnight
+    old = (datetime.now() - timedelta(days=5)).strftime("%d/%m/%Y")
+    statuses = [(status, payment) for status, payment, _ in LEAD_MIX]
+    weights = [share for _, _, share in LEAD_MIX]
+    sheet = [list(HEADERS)]
+    for i in range(rows):
+        status, payment = rng.choices(statuses, weights)[0]
+        final_link = f"https://drive.example.com/final/{i}" if status in ('Design Ready', 'Done', 'Delivered') else ''
+        sheet.append([today if not status else old, accounts[i % len(accounts)], f"Client {i}", f"client{i}@leads.example.com",
+                      'Logo Design', '$500', '$279', '', 'Brand Kit', 'https://portfolio.example.com',
+                      status, final_link, payment, '', ''])
+    return sheet
+
+def screenshot_png(rng):
+    """A small noisy PNG (distinct per call, so the verdict cache can't short-circuit it)."""
+    from PIL import Image
+    image = Image.effect_noise((320, 640), 60 + rng.random() * 40).convert('RGB')
+    buffer = io.BytesIO()
+    image.save(buffer, format='PNG')
+    return buffer.getvalue()
+
+def make_message(msg_id, thread_id, sender, text, attachment_id=None):
+    parts = [{'mimeType': 'text/plain', 'body': {'data': b64(text), 'size': len(text)}}]
+    if attachment_id:
+        parts.append({'mimeType': 'image/png', 'filename': 'payment.png', 'body': {'attachmentId': attachment_id, 'size': 40000}})
+    return {'id': msg_id, 'threadId': thread_id, 'labelIds': ['UNREAD', 'INBOX'],
+            'payload': {'mimeType': 'multipart/mixed',
+                        'headers': [{'name': 'From', 'value': f"Client <{sender}>"},
+                                    {'name': 'Subject', 'value': 'Re: Premium logo offer'}],
+                        'parts': parts}}
+
+def make_inboxes(sheet, count, rng, stranger_share=0.15, opt_out_share=0.03, same_thread_share=0.10):
+    """
+    `count` unread messages over the accounts' inboxes: mostly from leads the
+    replier talks to, some strangers, a few opt-outs, some second messages
+    in an already unread thread, and a screenshot from payment-pending leads.
+    Returns {account: ([message], {msg_id: {attachment_id: bytes}})}.
+    """
+    header = sheet[0]
+    col = {name: header.index(name) for name in ('Gmail Account', 'Email', 'Status', 'Payment Status')}
+    conversing = [row for row in sheet[1:] if row[col['Status']] in CONVERSING]
+    inboxes = {}
+    last_thread = {} # {sender: thread_id}
+    for n in range(count):
+        msg_id = f"msg{n:07d}"
+        if not conversing or rng.random() < stranger_share:
+            account = sheet[1 + rng.randrange(len(sheet) - 1)][col['Gmail Account']]
+            sender, text, thread_id, attachment = f"promo{n}@spam.example.com", STRANGER_TEXT, f"thr{n:07d}", None
+        else:
+            row = rng.choice(conversing)
+            account, sender = row[col['Gmail Account']], row[col['Email']]
+            text = OPT_OUT_TEXT if rng.random() < opt_out_share else rng.choice(REPLY_TEXTS)
+            thread_id = last_thread.get(sender) if sender in last_thread and rng.random() < same_thread_share else f"thr{n:07d}"
+            last_thread[sender] = thread_id
+            attachment = 'att1' if row[col['Payment Status']] == 'Payment Pending' else None
+        messages, attachments = inboxes.setdefault(account, ([], {}))
+        messages.append(make_message(msg_id, thread_id, sender, text, attachment))
+        if attachment:
+            attachments[msg_id] = {attachment: screenshot_png(rng)}
+    return inboxes
+
+def disable_pacing(modules):
+    from modules.pacing import SendPacer
+    for module in modules:
+        for value in vars(module).values():
+            if isinstance(value, SendPacer):
+                value.min_gap = value.max_gap = 0
+
+def by_backend(calls):
+    """{'gmail': {'messages.send': 3, ...}, ...}"""
+    grouped = {}
+    for name, count in sorted(calls.items()):
+        backend, method = name.split('.', 1)
+        grouped.setdefault(backend, {})[method] = count
+    return grouped
+
+def run_stage(fn, sheet, backends, trace_memory, verbose):
+    before_calls = backends.log.snapshot()
+    before_sent = backends.sent_count()
+    if trace_memory:
+        tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+    error = None
+    with contextlib.ExitStack() as stack:
+        if not verbose:
+            stack.enter_context(contextlib.redirect_stdout(stack.enter_context(open(os.devnull, 'w'))))
+        try:
+            fn(sheet)
+            if sheet is not None:
+                sheet.flush()
+        except Exception as e:
+            error = f"{e.__class__.__name__}: {e}"
+    wall = time.perf_counter() - start
+    peak = (tracemalloc.get_traced_memory()[1] - base) if trace_memory else None
+    calls = backends.log.snapshot()
+    calls.subtract(before_calls)
+    from modules.metrics import GMAIL_QUOTA_UNITS
+    gmail_units = sum(n * GMAIL_QUOTA_UNITS.get(name[len('gmail.'):], 0) for name, n in calls.items() if name.startswith('gmail.'))
+    return {'wall_s': round(wall, 3), 'sent': backends.sent_count() - before_sent, 'gmail_units': gmail_units,
+            'calls': by_backend(+calls), 'peak_mb': None if peak is None else round(peak / 2**20, 2), 'error': error}
+
+def print_report(config, load, results):
+    print(f"Synthetic run: {config['rows']} rows, {config['accounts']} accounts, {config['unread']} unread messages "
+          f"(latency s: gmail {config['gmail_latency']}, sheets {config['sheets_latency']}, gemini {config['gemini_latency']}; "
+          f"quota errors: gmail {config['gmail_errors']:.0%}, sheets {config['sheets_errors']:.0%}, gemini {config['gemini_errors']:.0%})")
+    peak = '' if load['peak_mb'] is None else f", peak {load['peak_mb']} MB"
+    print(f"Sheet load: {load['wall_s']:.2f} s{peak}\n")
+    print(f"{'stage':<10} {'wall s':>8} {'sent':>6} {'units':>8} {'peak MB':>8}  API calls")
+    for stage, result in results.items():
+        calls = '; '.join(f"{backend}: " + ', '.join(f"{method} {count}" for method, count in methods.items())
+                          for backend, methods in result['calls'].items()) or '-'
+        peak = '-' if result['peak_mb'] is None else f"{result['peak_mb']:.2f}"
+        print(f"{stage:<10} {result['wall_s']:8.2f} {result['sent']:6d} {result['gmail_units']:8d} {peak:>8}  {calls}")
+        if result['error']:
+            print(f"{'':<10} ❌ {result['error']}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline end-to-end benchmark of the bot's stages.")
+    parser.add_argument('--rows', type=int, default=1000, help="leads on the synthetic sheet")
+    parser.add_argument('--accounts', type=int, default=5, help="Gmail accounts the leads are spread over")
+    parser.add_argument('--unread', type=int, default=200, help="unread messages across all inboxes")
+    parser.add_argument('--stages', default=','.join(STAGES), help="comma-separated, run in this order")
+    parser.add_argument('--seed', type=int, default=1)
+    for backend, latency in (('gmail', 0.05), ('sheets', 0.3), ('gemini', 1.0)):
+        parser.add_argument(f'--{backend}-latency', type=float, default=latency, help=f"seconds per {backend} call")
+        parser.add_argument(f'--{backend}-errors', type=float, default=0.0, help=f"share of {backend} calls that hit a quota error")
+    parser.add_argument('--gemini-keys', type=int, default=2, help="fake API keys in the pool")
+    parser.add_argument('--no-memory', action='store_true', help="skip tracemalloc (it slows Python code down)")
+    parser.add_argument('--verbose', action='store_true', help="show the stages' own output")
+    parser.add_argument('--json', action='store_true', help="print the results as JSON")
+    args = parser.parse_args()
+
+    stages = [s.strip() for s in args.stages.split(',') if s.strip()]
+    unknown = [s for s in stages if s not in STAGES]
+    if unknown:
+        parser.error(f"unknown stage(s): {', '.join(unknown)}")
+
+    # Read by the modules at import time: fresh local state, no real keys. Per-key caps are
+    # left at the bot's own defaults (GEMINI_KEY_RPM/TPM in the environment still apply).
+    os.environ['BOT_STATE_DIR'] = tempfile.mkdtemp(prefix='bot-bench-')
+    os.environ['GEMINI_API_KEY'] = ','.join(f"bench-key-{i}" for i in range(1, args.gemini_keys + 1))
+    os.environ.setdefault('GEMINI_KEY_COOLDOWN', '1')
+
+    import importlib
+    modules = {name: importlib.import_module(module) for name, (module, _) in STAGES.items()}
+    from modules.sheet import load_sheet_snapshot
+    disable_pacing(modules.values())
+
+    rng = random.Random(args.seed)
+    accounts = [f"sender{i:02d}@bench.example.com" for i in range(1, args.accounts + 1)]
+    sheet_rows = make_sheet(args.rows, accounts, rng)
+    inboxes = make_inboxes(sheet_rows, args.unread, rng)
+    backends = FakeBackends(
+        sheet_rows, inboxes, seed=args.seed,
+        sheets=BackendProfile(args.sheets_latency, args.sheets_latency / 4, args.sheets_errors),
+        gmail=BackendProfile(args.gmail_latency, args.gmail_latency / 4, args.gmail_errors),
+        gemini=BackendProfile(args.gemini_latency, args.gemini_latency / 4, args.gemini_errors))
+    backends.install()
+
+    trace_memory = not args.no_memory
+    if trace_memory:
+        tracemalloc.start()
+    holder = {}
+    load = run_stage(lambda _: holder.setdefault('sheet', load_sheet_snapshot()), None, backends, trace_memory, args.verbose)
+    sheet = holder.get('sheet')
+    if sheet is None:
+        print(f"❌ Could not load the synthetic sheet: {load['error']}")
+        sys.exit(1)
+
+    results = {}
+    for stage in stages:
+        module, function = STAGES[stage]
+        results[stage] = run_stage(getattr(modules[stage], function), sheet, backends, trace_memory, args.verbose)
+
+    config = vars(args)
+    if args.json:
+        print(json.dumps({'config': config, 'load': load, 'stages': results}, indent=2))
+    else:
+        print_report(config, load, results)
+
+if __name__ == "__main__":
+    main()
@@ -1,30 +1,65 @@
 import sys
-from modules.outreach import send_outreach_emails
-from modules.replier import process_replies
+from modules.sheet import load_sheet_snapshot
+from modules.services import warm_sessions
+from modules import metrics
+
+if '--daemon' in sys.argv:
+    # Long-running mode: stages on their own intervals, everything kept warm
+    from modules.daemon import run_daemon
+    sys.exit(run_daemon())
 
 print('🟢 BOT STARTING: One-Time Execution Mode')
+metrics.start_live_report()
+
+# One sheet read for the whole run; every stage works on (and writes through) this snapshot.
+sheet = load_sheet_snapshot()
+
+if sheet is None:
+    # Each stage would only try (and fail) to read it again
+    print('❌ Sheet could not be read. Skipping all stages.')
+else:
+    # Load, refresh and verify every account's Gmail session up front, in parallel.
+    try:
+        warm_sessions(sheet.account_emails())
+    except Exception as e:
+        print(f'❌ Session warm-up Error: {e}')
+
+    try:
+        print('--- Step 1: Outreach ---')
+        from modules.outreach import send_outreach_emails
+        with metrics.stage('outreach'):
+            send_outreach_emails(sheet)
+        print('✅ Outreach Finished')
+    except Exception as e:
+        print(f'❌ Outreach Error: {e}')
+
+    try:
+        print('--- Step 2: Follow-up Bot ---')
+        from modules.followup import run_followup
+        with metrics.stage('followup'):
+            run_followup(sheet)
+        print('✅ Follow-up Finished')
+    except Exception as e:
+        print(f'❌ Follow-up Error: {e}')
+
+    try:
+        print('--- Step 3: Replier ---')
+        from modules.replier import process_replies
+        with metrics.stage('replier'):
+            process_replies(sheet)
+        print('✅ Replier Finished')
+    except Exception as e:
+        print(f'❌ Replier Error: {e}')
 
-try:
-    print('--- Step 1: Outreach ---')
-    send_outreach_emails()
-    print('✅ Outreach Finished')
-except Exception as e:
-    print(f'❌ Outreach Error: {e}')
-
-try:
-    print('--- Step 2: Follow-up Bot ---')
-    from modules.followup import run_followup
-    run_followup()
-    print('✅ Follow-up Finished')
-except Exception as e:
-    print(f'❌ Follow-up Error: {e}')
-
-try:
-    print('--- Step 2: Replier ---')
-    process_replies()
-    print('✅ Replier Finished')
-except Exception as e:
-    print(f'❌ Replier Error: {e}')
+    try:
+        print('--- Step 4: Delivery ---')
+        from modules.delivery import run_delivery
+        with metrics.stage('delivery'):
+            run_delivery(sheet)
+        print('✅ Delivery Finished')
+    except Exception as e:
+        print(f'❌ Delivery Error: {e}')
 
+metrics.write_summary()
 print('🔴 ALL TASKS DONE. EXITING.')
 sys.exit(0)
@@ -0,0 +1,127 @@
+"""
+Local pre-classifier for inbound replies: settles the obvious cases
+without a Gemini call.
+
+    OPT_OUT     "unsubscribe", "remove me", "stop emailing", ... anywhere; a short
+                "no thanks, not interested" or a bare "STOP" ("remove the background"
+                or "don't stop" are not opt-outs)
+    AUTO_REPLY  out-of-office / auto-responder mail: headers or subject, else a body
+                that is nothing but the out-of-office notice
+    AGREEMENT   a short yes ("Okay", "Yes please, send the link") -> the fixed closing reply
+    THANKS      a bare "thanks" / "got it" -> nothing to answer
+    LLM         everything else
+
+Every pattern is compiled once, into one alternation per category, so a
+message is scanned once per category rather than once per keyword.
+Only short messages made of nothing but those phrases (and filler like
+"please") are read as AGREEMENT or THANKS; anything with more to say,
+or a question, goes to the model.
+"""
+import re
+from modules.email_text import strip_quoted
+
+OPT_OUT = 'opt_out'
+AUTO_REPLY = 'auto_reply'
+AGREEMENT = 'agreement'
+THANKS = 'thanks'
+LLM = 'llm'
+
+# Phrases are matched on normalized text (lower case, no apostrophes or punctuation)
+OPT_OUT_PHRASES = [
+    "unsubscribe", "opt out", "remove me", "remove my email", "remove my address", "take me off",
+    "stop emailing", "stop sending", "stop contacting", "stop messaging", "stop mailing", "stop spamming",
+    "dont email", "do not email", "dont contact", "do not contact", "dont message", "do not message",
+    "leave me alone", "this is spam",
+]
+# Only an opt-out in a short message without a question ("Sorry, not interested")
+DECLINE_PHRASES = ["not interested", "no thanks", "no thank you"]
+AUTO_REPLY_PHRASES = [
+    "out of office", "out of the office", "automatic reply", "auto reply", "auto-reply", "autoreply",
+    "auto response", "auto-response", "away from my desk", "away from the office", "on vacation",
+    "on annual leave", "on leave until", "currently unavailable", "limited access to email",
+]
+AGREEMENT_PHRASES = [
+    "yes", "yeah", "yep", "yup", "ok", "okay", "sure", "agreed", "i agree", "deal", "done deal",
+    "go ahead", "lets go", "lets do it", "lets proceed", "proceed", "sounds good", "sounds great",
+    "send the link", "send me the link", "send link", "i am in", "im in", "count me in",
+]
+THANKS_PHRASES = ["thanks", "thank you", "thx", "ty", "ok thanks", "okay thanks", "ok thank you",
+                  "okay thank you", "got it", "noted", "received", "thanks a lot", "many thanks"]
+# Filler allowed around a short AGREEMENT/THANKS ("Yes please, thanks!")
+FILLER = ["please", "thanks", "thank you", "so much", "a lot", "sir", "maam", "bro", "great", "perfect",
+          "cool", "then", "fine"]
+MAX_SHORT_WORDS = 8
+
+def _alternation(phrases):
+    # Longest first, so "no thanks" wins over "no"; spaces match any run of whitespace
+    return '|'.join(re.escape(p).replace(r'\ ', r'\s+') for p in sorted(phrases, key=len, reverse=True))
+
+OPT_OUT_RE = re.compile(rf"\b(?:{_alternation(OPT_OUT_PHRASES)})\b")
+DECLINE_RE = re.compile(rf"\b(?:{_alternation(DECLINE_PHRASES)})\b")
+AUTO_REPLY_RE = re.compile(rf"\b(?:{_alternation(AUTO_REPLY_PHRASES)})\b", re.IGNORECASE)
+# How an auto-responder's text opens ("I am currently out of the office ...", "This is an automatic reply")
+AUTO_REPLY_OPENING_RE = re.compile(
+    r"^(?:this\s+is\s+an?\s+)?(?:automatic|auto[- ]?)\s*(?:reply|response)"
+    r"|^(?:i\s+am|i'?m|im)\s+(?:currently\s+)?(?:out\s+of\s+(?:the\s+)?office|away\s+from|on\s+(?:vacation|holiday|leave|annual\s+leave))",
+    re.IGNORECASE)
+# What else an auto-responder says after its opening ("I will reply when I'm back", "For urgent matters ...")
+AUTO_REPLY_FOLLOW_RE = re.compile(
+    r"\b(?:will\s+(?:reply|respond|get\s+back|be\s+back|return|answer)|(?:be\s+)?back\s+(?:on|in|at)"
+    r"|returning|return(?:s)?\s+on|limited\s+access|urgent|in\s+my\s+absence|contact|reach|regards|thank(?:s|\s+you))\b"
+    r"|" + AUTO_REPLY_RE.pattern,
+    re.IGNORECASE)
+SENTENCE_END_RE = re.compile(r"(?<=[.!])\s+|\n+")
+
+def _only(phrases):
+    """Matches normalized text made only of `phrases` and FILLER, with at least one of `phrases`."""
+    words = _alternation(phrases + FILLER)
+    return re.compile(rf"^(?=.*\b(?:{_alternation(phrases)})\b)(?:(?:{words})(?:\s+|$))+$")
+
+STOP_RE = _only(["stop", "unsubscribe"]) # a bare "STOP" / "Stop please"
+AGREEMENT_RE = _only(AGREEMENT_PHRASES)
+THANKS_RE = _only(THANKS_PHRASES)
+
+# Headers auto-responders set (RFC 3834 Auto-Submitted and the common vendor ones)
+AUTO_REPLY_HEADERS = {'x-autoreply', 'x-autorespond', 'x-autoresponder'}
+AUTO_PRECEDENCE = {'auto_reply', 'bulk', 'junk'}
+
+def _normalize(text):
+    """Lower case, apostrophes dropped, punctuation/emoji as spaces: "Okay!! 👍" -> "okay"."""
+    text = text.lower().replace("'", "").replace("’", "")
+    return ' '.join(re.sub(r"[^\w\s]", " ", text).split())
+
+def is_auto_reply(headers, subject, text):
+    for header in headers:
+        name = header.get('name', '').lower()
+        value = header.get('value', '').strip().lower()
+        if name == 'auto-submitted' and value != 'no':
+            return True
+        if name in AUTO_REPLY_HEADERS:
+            return True
+        if name == 'precedence' and value in AUTO_PRECEDENCE:
+            return True
+    if AUTO_REPLY_RE.search(subject or ''):
+        return True
+    # Body alone: it must open like a notice and say nothing else. "I am on leave until Monday.
+    # Yes, let's proceed." or "I'm on leave next week, what's the price?" are real replies.
+    if '?' in text or not AUTO_REPLY_OPENING_RE.search(text):
+        return False
+    sentences = [s for s in SENTENCE_END_RE.split(text.strip()) if s.strip()]
+    return all(AUTO_REPLY_FOLLOW_RE.search(s) for s in sentences[1:])
+
+def classify(body, headers=(), subject=''):
+    """One of OPT_OUT, AUTO_REPLY, AGREEMENT, THANKS or LLM for an inbound reply."""
+    text = strip_quoted(body)
+    short = _normalize(text)
+    is_short = bool(short) and len(short.split()) <= MAX_SHORT_WORDS
+    if OPT_OUT_RE.search(short) or (is_short and (STOP_RE.match(short) or (DECLINE_RE.search(short) and '?' not in text))):
+        return OPT_OUT
+    if is_auto_reply(headers, subject, text):
+        return AUTO_REPLY
+    if is_short:
+        # Thanks first: "ok thanks" is an acknowledgement, "yes thanks" an agreement
+        if THANKS_RE.match(short):
+            return THANKS
+        if AGREEMENT_RE.match(short):
+            return AGREEMENT
+    return LLM
@@ -0,0 +1,139 @@
+"""
+Daemon mode (`python main.py --daemon`): one long-running process instead
+of a cold start every 5 minutes.
+
+Sessions, the Gemini pool, caches and the sheet snapshot stay warm between
+ticks. Each stage runs on its own interval through `schedule`, and the
+snapshot is re-read periodically so edits made on the sheet are picked up.
+Access tokens google-auth refreshed along the way are written back to
+tokens/ every TOKEN_SAVE_INTERVAL seconds and at shutdown.
+Stages run one at a time on this thread (the Gmail clients are shared and
+not thread-safe), so none of them may sleep: paced sends (outreach,
+follow-ups, payment requests) go out only when their account's window is
+open, and the rest are left for later. A check every PACED_TICK seconds
+reruns a stage as soon as one of those sends is due, so a 10-email outreach
+wave is spread over many short runs and the replier keeps its interval.
+SIGTERM/SIGINT stop a wave at its next send, let the running stage
+finish, flush the sheet and exit.
+"""
+import os
+import signal
+import threading
+import schedule
+from modules.sheet import load_sheet_snapshot
+from modules.services import warm_sessions, save_refreshed_tokens
+from modules import metrics, pacing
+
+# Seconds between runs of each stage
+REPLIER_INTERVAL = int(os.getenv("REPLIER_INTERVAL", "60"))
+OUTREACH_INTERVAL = int(os.getenv("OUTREACH_INTERVAL", "300"))
+FOLLOWUP_INTERVAL = int(os.getenv("FOLLOWUP_INTERVAL", "1800"))
+DELIVERY_INTERVAL = int(os.getenv("DELIVERY_INTERVAL", "300"))
+# Seconds between fresh reads of the sheet
+SHEET_REFRESH_INTERVAL = int(os.getenv("SHEET_REFRESH_INTERVAL", "300"))
+# Seconds between metrics summaries (totals since the daemon started)
+METRICS_SUMMARY_INTERVAL = int(os.getenv("METRICS_SUMMARY_INTERVAL", "3600"))
+# Seconds between writes of refreshed access tokens to tokens/
+TOKEN_SAVE_INTERVAL = int(os.getenv("TOKEN_SAVE_INTERVAL", "600"))
+# Seconds between checks for paced sends that have come due
+PACED_TICK = 2
+
+_stop = threading.Event()
+
+def _request_stop(signum, frame):
+    print(f"🛑 {signal.Signals(signum).name} received. Finishing the current stage, then shutting down...")
+    _stop.set()
+    pacing.stop() # a send wave in progress ends at its next send
+
+def _outreach(sheet):
+    from modules.outreach import send_outreach_emails
+    send_outreach_emails(sheet)
+
+def _followup(sheet):
+    from modules.followup import run_followup
+    run_followup(sheet)
+
+def _replier(sheet):
+    from modules.replier import process_replies
+    process_replies(sheet)
+
+def _delivery(sheet):
+    from modules.delivery import run_delivery
+    run_delivery(sheet)
+
+def _refresh(sheet):
+    sheet.reload()
+    warm_sessions(sheet.account_emails()) # accounts added on the sheet since the last read
+
+def _job(title, run, sheet):
+    def job():
+        if _stop.is_set():
+            return
+        print(f'--- {title} ---')
+        try:
+            with metrics.stage(run.__name__.lstrip('_')):
+                run(sheet)
+            print(f'✅ {title} Finished')
+        except Exception as e:
+            print(f'❌ {title} Error: {e}')
+    return job
+
+def _paced_catch_up(jobs):
+    """Reruns a stage ({stage name: job}) once a send it left for later is due."""
+    def job():
+        for pacer in pacing.pacers():
+            if pacer.stage in jobs and pacer.due():
+                pacer.take_deferred()
+                jobs[pacer.stage]()
+    return job
+
+def run_daemon():
+    """Runs until SIGTERM/SIGINT. Returns the process exit code."""
+    signal.signal(signal.SIGTERM, _request_stop)
+    signal.signal(signal.SIGINT, _request_stop)
+
+    print('🟢 BOT STARTING: Daemon Mode')
+    sheet = load_sheet_snapshot()
+    if sheet is None:
+        return 1
+    try:
+        warm_sessions(sheet.account_emails())
+    except Exception as e:
+        print(f'❌ Session warm-up Error: {e}') # each job loads its accounts again
+    pacing.set_blocking(False)
+
+    scheduler = schedule.Scheduler()
+    jobs = {
+        'outreach': _job('Outreach', _outreach, sheet),
+        'followup': _job('Follow-up Bot', _followup, sheet),
+        'replier': _job('Replier', _replier, sheet),
+        'delivery': _job('Delivery', _delivery, sheet),
+    }
+    # Same order as a one-shot run
+    stages = [
+        scheduler.every(OUTREACH_INTERVAL).seconds.do(jobs['outreach']),
+        scheduler.every(FOLLOWUP_INTERVAL).seconds.do(jobs['followup']),
+        scheduler.every(REPLIER_INTERVAL).seconds.do(jobs['replier']),
+        scheduler.every(DELIVERY_INTERVAL).seconds.do(jobs['delivery']),
+    ]
+    scheduler.every(PACED_TICK).seconds.do(_paced_catch_up(jobs))
+    scheduler.every(SHEET_REFRESH_INTERVAL).seconds.do(_job('Sheet Refresh', _refresh, sheet))
+    scheduler.every(METRICS_SUMMARY_INTERVAL).seconds.do(metrics.write_summary)
+    scheduler.every(TOKEN_SAVE_INTERVAL).seconds.do(save_refreshed_tokens)
+    metrics.start_live_report()
+    print(f"⏱️ Intervals (s): replier {REPLIER_INTERVAL}, outreach {OUTREACH_INTERVAL}, "
+          f"follow-up {FOLLOWUP_INTERVAL}, delivery {DELIVERY_INTERVAL}, sheet refresh {SHEET_REFRESH_INTERVAL}")
+
+    for job in stages:
+        job.run() # first tick: every stage once, right away (reschedules it too)
+
+    while not _stop.is_set():
+        scheduler.run_pending()
+        idle = scheduler.idle_seconds
+        _stop.wait(1.0 if idle is None else min(max(idle, 0.0), 1.0))
+
+    sheet.flush()
+    save_refreshed_tokens()
+    metrics.write_summary()
+    print('🔴 Daemon stopped.')
+    return 0
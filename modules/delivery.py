@@ -1,35 +1,55 @@
 import os
 from modules.outreach import send_email
-from modules.services import get_gspread_client, get_gmail_service
+from modules.messages import DELIVERY
+from modules.services import get_gmail_service
+from modules.sheet import load_sheet_snapshot
+from modules.lease import run_lease
+from modules import journal
 
-def run_delivery():
+# Delivery sends from the default account
+DELIVERY_ACCOUNT = 'default'
+
+def run_delivery(sheet=None):
     print("Running Delivery...")
-    gc = get_gspread_client()
-    SHEET_ID = '1N3_jJkYNCtp1MQXEObtDH9FC_VzPyL2RLBW_MdfvfCM'
-    try:
-        sh = gc.open_by_key(SHEET_ID)
-        worksheet = sh.sheet1
-    except Exception as e:
-        print(f"Error accessing sheet: {e}")
+    if sheet is None:
+        sheet = load_sheet_snapshot()
+        if sheet is None:
+            return
+
+    rows = sheet.rows
+    if not rows:
+        print("No data found.")
         return
 
-    rows = worksheet.get_all_values()
-    headers = rows[0]
+    leads = sheet.leads
+    schema = sheet.schema
     
     try:
         # Correct Column Names
-        final_link_idx = headers.index('Final Drive Link') # Was Final Work Link
-        payment_status_idx = headers.index('Payment Status') # Was Payment Verification
-        status_col_idx = headers.index('Status')
-        email_col_idx = headers.index('Email')
-        name_col_idx = headers.index('Client Name')
+        final_link_idx = schema.index('Final Drive Link') # Was Final Work Link
+        payment_status_idx = schema.index('Payment Status') # Was Payment Verification
+        status_col_idx = schema.index('Status')
+        email_col_idx = schema.index('Email')
+        name_col_idx = schema.index('Client Name')
     except ValueError as e:
         print(f"Missing columns for delivery: {e}")
         return
 
+    # One delivery pass at a time: an overlapping run skips it
+    with run_lease('delivery') as held:
+        if not held:
+            print("⏭️ Another run is already delivering. Skipping.")
+            return
+        deliver_done_rows(sheet, leads, final_link_idx, payment_status_idx, status_col_idx, email_col_idx, name_col_idx)
+
+    sheet.flush()
+
+def deliver_done_rows(sheet, leads, final_link_idx, payment_status_idx, status_col_idx, email_col_idx, name_col_idx):
     gmail_service = get_gmail_service()
 
-    for i, row in enumerate(rows[1:], start=2):
+    # Fix Logic: ONLY send if Status is exactly 'Done'
+    for i in leads.find(status="Done"):
+        row = leads.row(i)
         if len(row) <= max(final_link_idx, payment_status_idx, status_col_idx):
             continue 
 
@@ -39,22 +59,20 @@ def run_delivery():
         client_email = row[email_col_idx]
         client_name = row[name_col_idx]
 
-        # Fix Logic: ONLY send if Status is exactly 'Done'
         if status == "Done" and final_link:
+            # Delivered already (journal) but the status cell never landed: fix it, don't resend
+            if journal.already_sent(DELIVERY_ACCOUNT, client_email, 'delivery'):
+                print(f"↩️ {client_name} was already delivered to today (journal). Marking as Delivered.")
+                sheet.update_cell(i, status_col_idx + 1, "Delivered")
+                continue
+
             # Professional Email Body
-            subject = "Your Project is Ready! 🚀"
-            body = (
-                f"Hi {client_name},\n\n"
-                f"We are happy to deliver your project! Here is the link: {final_link}.\n\n"
-                "Please review it. If you need changes, just reply. If you like it, let us know so we can verify payment.\n\n"
-                "By the way, we offer 20+ other skills like AI automation & Design. Let us know if you need anything else!\n\n"
-                "Best regards,\n"
-                "SA Innovation Lab"
-            )
+            subject, body = DELIVERY.render(client_name=client_name, final_link=final_link)
             
             print(f"Attempting to deliver to {client_name} ({client_email})...")
             if send_email(gmail_service, client_email, subject, body):
-                worksheet.update_cell(i, status_col_idx + 1, "Delivered")
+                journal.record(DELIVERY_ACCOUNT, client_email, 'delivery')
+                sheet.update_cell(i, status_col_idx + 1, "Delivered")
                 print(f"✅ Delivered work to {client_email}")
 
 if __name__ == "__main__":
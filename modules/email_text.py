@@ -0,0 +1,104 @@
+"""
+Inbound email text, reduced to what the sender wrote this time.
+
+body_text() reads the text/plain part (or, when a message only has HTML,
+its visible text). reply_text() then drops the quoted thread ("On ...
+wrote:", "> ..." lines, Outlook "From:/Sent:" headers), forwarded
+blocks and the signature. That way a prompt carries the latest message,
+not the whole negotiation so far. clip() holds the result to a token
+budget.
+"""
+import re
+import base64
+from modules.gmail_batch import iter_parts
+
+# Where quoted or forwarded history starts; everything from there on is dropped
+QUOTE_START_RE = re.compile(
+    r"^\s*>"
+    r"|^\s*On\s[^\n]{0,200}?(?:\n[^\n]{0,200}?)?\bwrote:\s*$" # "On Mon, 12 Oct 2026, X <x@y.com> wrote:" (may wrap)
+    r"|^\s*-{2,}\s*(?:Original Message|Forwarded message)\s*-{2,}"
+    r"|^\s*_{10,}\s*$" # Outlook's separator line
+    r"|^\s*From:\s[^\n]+\n(?:[^\n]*\n){0,2}?\s*(?:Sent|Date):\s", # Outlook header block
+    re.IGNORECASE | re.MULTILINE)
+# Where a signature starts: the "-- " delimiter, mobile footers, or a sign-off close to the end
+SIGNATURE_DELIMITER_RE = re.compile(r"^(?:--\s*|Sent from my [^\n]+|Get Outlook for [^\n]+)$", re.IGNORECASE | re.MULTILINE)
+SIGN_OFF_RE = re.compile(r"^\s*(?:best(?: regards)?|kind regards|regards|warm regards|thanks(?: and regards)?|thank you|cheers|sincerely|br)\s*[,!.]?\s*$",
+                         re.IGNORECASE | re.MULTILINE)
+SIGNATURE_MAX_LINES = 4 # lines under a sign-off that still count as the signature
+SIGNATURE_LINE_CHARS = 60
+CHARS_PER_TOKEN = 4 # same rough measure as llm.estimate_tokens
+
+def _decode(data):
+    return base64.urlsafe_b64decode(data).decode('utf-8', errors='replace')
+
+def html_to_text(html):
+    """Visible text of an HTML body (scripts and styles dropped), one block per line."""
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(html, 'html.parser')
+    for tag in soup(['script', 'style', 'head']):
+        tag.decompose()
+    # Gmail's and Outlook's quoted history lives in these; the text rules catch what's left
+    for tag in soup.select('blockquote, div.gmail_quote, div#appendonsend, div#divRplyFwdMsg'):
+        tag.decompose()
+    text = soup.get_text('\n')
+    return '\n'.join(line.strip() for line in text.splitlines() if line.strip())
+
+def body_text(payload):
+    """The message's text/plain part; failing that, the text of its text/html part; else ''."""
+    html = None
+    for part in iter_parts(payload):
+        data = (part.get('body') or {}).get('data')
+        if not data:
+            continue
+        mime_type = part.get('mimeType', '')
+        if mime_type == 'text/plain':
+            return _decode(data)
+        if mime_type == 'text/html' and html is None:
+            html = data
+    # Single-part messages without a mimeType of their own are treated as plain text
+    if html is None:
+        data = (payload.get('body') or {}).get('data')
+        if data and not payload.get('parts') and payload.get('mimeType', 'text/plain') == 'text/plain':
+            return _decode(data)
+        return ""
+    return html_to_text(_decode(html))
+
+def strip_quoted(text):
+    """Text above the quoted or forwarded history."""
+    match = QUOTE_START_RE.search(text)
+    return (text[:match.start()] if match else text).strip()
+
+def strip_signature(text):
+    """Text above the signature: a "-- " line or mobile footer, or a sign-off followed by a few short lines."""
+    match = SIGNATURE_DELIMITER_RE.search(text)
+    if match and text[:match.start()].strip():
+        text = text[:match.start()]
+    lines = text.rstrip().splitlines()
+    for i in range(len(lines) - 1, max(-1, len(lines) - 2 - SIGNATURE_MAX_LINES), -1):
+        if SIGN_OFF_RE.match(lines[i]):
+            tail = lines[i + 1:]
+            if i > 0 and all(len(line.strip()) <= SIGNATURE_LINE_CHARS for line in tail):
+                return '\n'.join(lines[:i]).strip()
+            break
+    return text.strip()
+
+def reply_text(text):
+    """What the sender wrote this time: no quoted thread, forwarded block or signature."""
+    return strip_signature(strip_quoted(text))
+
+def clip(text, max_tokens, keep_end=False):
+    """`text` cut (at a word boundary, marked with …) to about `max_tokens` tokens; keep_end keeps its last part instead."""
+    max_chars = max(0, max_tokens) * CHARS_PER_TOKEN
+    if len(text) <= max_chars:
+        return text
+    if keep_end:
+        cut = text[len(text) - max_chars:]
+        space = cut.find(' ')
+        if -1 < space < max_chars // 2:
+            cut = cut[space + 1:]
+        return "… " + cut.lstrip()
+    cut = text[:max_chars]
+    space = cut.rfind(' ')
+    if space > max_chars // 2:
+        cut = cut[:space]
+    return cut.rstrip() + " …"
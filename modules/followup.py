@@ -1,11 +1,17 @@
-import time
-import random
 from datetime import datetime
 import pytz
-from modules.services import get_gspread_client, get_service_for_email
+from modules.services import get_service_for_email, verify_account
 from modules.outreach import send_email
+from modules.messages import FOLLOWUP
+from modules.sheet import load_sheet_snapshot
+from modules.workers import run_per_account
+from modules.pacing import SendPacer
+from modules.lease import leased
+from modules import journal
 
-def run_followup():
+FOLLOWUP_PACING = SendPacer(5, 15, stage='followup')
+
+def run_followup(sheet=None):
     print("Running Universal Follow-up Bot (Multi-Account Safe)...")
     
     # Set Timezone to India (IST)
@@ -13,125 +19,106 @@ def run_followup():
     today = datetime.now(ist)
     today_date = today.date()
     
-    # 1. Connect to Sheet
-    gc = get_gspread_client()
-    SHEET_ID = '1N3_jJkYNCtp1MQXEObtDH9FC_VzPyL2RLBW_MdfvfCM'
-    
-    try:
-        sh = gc.open_by_key(SHEET_ID)
-        worksheet = sh.sheet1
-    except Exception as e:
-        print(f"❌ Error connecting to Sheet: {e}")
-        return
+    # 1. Connect to Sheet (reuse the run's snapshot when given one)
+    if sheet is None:
+        sheet = load_sheet_snapshot()
+        if sheet is None:
+            return
 
-    rows = worksheet.get_all_values()
+    rows = sheet.rows
     if not rows:
         print("❌ Sheet is empty.")
         return
 
-    headers = rows[0]
+    leads = sheet.leads
+    schema = sheet.schema
 
     try:
-        status_col_idx = headers.index('Status')
-        email_col_idx = headers.index('Email')
-        name_col_idx = headers.index('Client Name')
-        date_col_idx = headers.index('Date')
-        gmail_col_idx = headers.index('Gmail Account')
+        status_col_idx = schema.index('Status')
+        email_col_idx = schema.index('Email')
+        name_col_idx = schema.index('Client Name')
+        date_col_idx = schema.index('Date')
+        gmail_col_idx = schema.index('Gmail Account')
     except ValueError as e:
         print(f"❌ Missing required columns: {e}")
         return
 
     # 2. Identify Unique Accounts
-    unique_accounts = set()
-    for row in rows[1:]:
-        if len(row) > gmail_col_idx:
-            acc = row[gmail_col_idx].strip().lower()
-            if acc:
-                unique_accounts.add(acc)
+    unique_accounts = leads.accounts()
     
     print(f"📋 Found {len(unique_accounts)} unique Gmail accounts for follow-ups.")
 
-    # 3. Loop by Account
-    for current_account in unique_accounts:
+    # 3. One worker per Account
+    def handle_account(current_account):
         print(f"\n🔄 Switching to account: {current_account}")
         
         # Login
         gmail_service = get_service_for_email(current_account)
         if not gmail_service:
             print(f"⚠️ Token not found for {current_account}. Skipping.")
-            continue
+            return
             
-        # Verify Identity (Safety Check)
-        try:
-             profile = gmail_service.users().getProfile(userId='me').execute()
-             logged_in_email = profile.get('emailAddress').lower()
-             if logged_in_email != current_account:
-                 print(f"❌ Mismatch! Logged in as {logged_in_email}, but expected {current_account}. Skipping safely.")
-                 continue
-        except Exception as e:
-            print(f"❌ Error verifying identity for {current_account}: {e}")
-            continue
-
-        # 4. Scan Rows for THIS Account
-        for i, row in enumerate(rows[1:], start=2):
+        # Verify Identity (Safety Check; done once per process and reused)
+        if not verify_account(current_account):
+            return
+
+        # 4. 'Sent' Rows for THIS Account (index lookup, no sheet scan)
+        for i in leads.find(account=current_account, status="Sent"):
+            row = leads.row(i)
             # Basic validation
             if len(row) <= max(status_col_idx, date_col_idx, gmail_col_idx): 
                 continue
 
-            # STRICT ACCOUNT CHECK
-            target_account = row[gmail_col_idx].strip().lower()
-            if target_account != current_account:
-                continue
-
-            status = row[status_col_idx].strip()
             client_email = row[email_col_idx].strip()
             client_name = row[name_col_idx].strip()
             date_str = row[date_col_idx].strip()
 
             # 5. Target Logic: 'Sent' Status + 3 Days Passed
-            if status == "Sent":
+            # Date Check
+            try:
+                sent_date = datetime.strptime(date_str, "%d/%m/%Y").date()
+                days_passed = (today_date - sent_date).days
                 
-                # Date Check
-                try:
-                    sent_date = datetime.strptime(date_str, "%d/%m/%Y").date()
-                    days_passed = (today_date - sent_date).days
-                    
-                    if days_passed < 3:
-                        # Too early
-                        continue
-                        
-                except ValueError:
-                    print(f"⚠️ Invalid Date for {client_name}: '{date_str}'. Skipping.")
+                if days_passed < 3:
+                    # Too early
                     continue
-
-                # If we reached here, it's been >= 3 days
-                print(f"👀 Ready to Nudge: {client_name} ({client_email}) via {current_account}")
-                
-                # 6. Content (Signature based on account)
-                # Simple signature logic or pull from helper if imported
-                if "solanki" in current_account:
-                    sender_sig = "Solanki Art"
-                elif "royal" in current_account:
-                    sender_sig = "Royal NXS" # Example fallback
-                else:
-                    sender_sig = "Titan Bot"
-
-                subject = "Quick check-in regarding your project"
-                body = (
-                    f"Hi {client_name},\n\n"
-                    "I just wanted to quickly bump this up in your inbox. Did you get a chance to review my previous email?\n\n"
-                    "We are ready to start your design/automation work immediately.\n\n"
-                    "Best regards,\n"
-                    f"{sender_sig}"
-                )
-
-                # 7. Send & Update
-                if send_email(gmail_service, client_email, subject, body):
-                    worksheet.update_cell(i, status_col_idx + 1, "Followed Up")
-                    print(f"✅ Nudge sent to {client_name}. Status updated to 'Followed Up'.")
                     
-                    # Safety Sleep
-                    time.sleep(random.randint(5, 15))
+            except ValueError:
+                print(f"⚠️ Invalid Date for {client_name}: '{date_str}'. Skipping.")
+                continue
+
+            # Nudged already (journal) but the status cell never landed: fix it, don't resend
+            if journal.already_sent(current_account, client_email, 'followup'):
+                print(f"↩️ {client_name} was already nudged today (journal). Marking as Followed Up.")
+                sheet.update_cell(i, status_col_idx + 1, "Followed Up")
+                continue
+
+            # If we reached here, it's been >= 3 days
+            print(f"👀 Ready to Nudge: {client_name} ({client_email}) via {current_account}")
+            
+            # 6. Content (Signature based on account)
+            # Simple signature logic or pull from helper if imported
+            if "solanki" in current_account:
+                sender_sig = "Solanki Art"
+            elif "royal" in current_account:
+                sender_sig = "Royal NXS" # Example fallback
+            else:
+                sender_sig = "Titan Bot"
+
+            subject, body = FOLLOWUP.render(client_name=client_name, signature=sender_sig)
+
+            # 7. Send & Update (Safety Sleep: this account's own 5-15s window)
+            if not FOLLOWUP_PACING.wait(current_account):
+                break # not due yet (daemon) or shutting down: the rest go out on a later run
+            if send_email(gmail_service, client_email, subject, body):
+                journal.record(current_account, client_email, 'followup')
+                sheet.update_cell(i, status_col_idx + 1, "Followed Up")
+                print(f"✅ Nudge sent to {client_name}. Status updated to 'Followed Up'.")
+                FOLLOWUP_PACING.mark_sent(current_account)
+
+    # Checkpoint after each account: its sheet updates are flushed as soon as it is done.
+    # Each account is leased, so an overlapping run can't nudge the same leads.
+    run_per_account(unique_accounts, leased('followup', handle_account), checkpoint=sheet.flush)
 
 if __name__ == "__main__":
     run_followup()
@@ -0,0 +1,220 @@
+"""
+Gmail batch HTTP helpers: many reads per round-trip, results kept in a
+per-run cache so later lookups don't touch the network again.
+"""
+import time
+from modules import metrics, retry
+
+# Gmail recommends no more than 50 calls per batch request.
+GMAIL_BATCH_SIZE = 50
+# messages.batchModify takes at most 1000 message IDs per call.
+BATCH_MODIFY_SIZE = 1000
+# All the triage step needs before deciding whether a message is worth a full download.
+METADATA_HEADERS = ['From', 'Subject']
+
+def batch_execute(service, requests):
+    """
+    Runs {key: HttpRequest} through new_batch_http_request in chunks.
+    Returns ({key: response}, {key: exception}); keys must be strings.
+    Calls that fail with a rate limit or server error (individually, or
+    the whole round trip) are retried in a later batch, see modules.retry.
+    """
+    results, errors = {}, {}
+    account = getattr(next(iter(requests.values()), None), 'account', None)
+
+    def callback(request_id, response, exception):
+        # Each call in the batch costs its own quota; only the round trip as a whole is timed
+        request = requests[request_id]
+        metrics.record('gmail', metrics.gmail_method(getattr(request, 'methodId', None)),
+                       getattr(request, 'account', None), error=exception)
+        if exception is not None:
+            errors[request_id] = exception
+        else:
+            results[request_id] = response
+
+    pending = list(requests)
+    for attempt in range(1, retry.RETRY_ATTEMPTS + 1):
+        for start in range(0, len(pending), GMAIL_BATCH_SIZE):
+            chunk = pending[start:start + GMAIL_BATCH_SIZE]
+            batch = service.new_batch_http_request(callback=callback)
+            for key in chunk:
+                batch.add(requests[key], request_id=key)
+            try:
+                retry.call(batch.execute, 'gmail', 'batch', account, attempts=1)
+            except Exception as e:
+                for key in chunk:
+                    errors.setdefault(key, e)
+
+        # Only reads go through here, so server errors are as safe to retry as rate limits
+        failed = [key for key in pending if key in errors and retry.classify(errors[key]) != retry.FATAL]
+        if not failed or attempt == retry.RETRY_ATTEMPTS:
+            break
+        delays = [retry.retry_after(errors[key]) for key in failed]
+        delay = max([d for d in delays if d is not None] or [retry.backoff(attempt)])
+        if any(retry.classify(errors[key]) == retry.RATE_LIMITED for key in failed):
+            retry.breakers.pause(account, delay)
+        for key in failed:
+            del errors[key]
+            metrics.record_retry('gmail', metrics.gmail_method(getattr(requests[key], 'methodId', None)), account)
+        print(f"   ↻ Gmail batch: {len(failed)} call(s) rate-limited or failed. Retrying in {delay:.1f}s.")
+        time.sleep(delay)
+        pending = failed
+    return results, errors
+
+def iter_parts(payload):
+    """Yields the payload itself (if it has no parts) or every leaf part below it."""
+    parts = payload.get('parts')
+    if not parts:
+        yield payload
+        return
+    for part in parts:
+        if part.get('parts'):
+            yield from iter_parts(part)
+        else:
+            yield part
+
+class MessageCache:
+    """
+    Per-run cache of messages, threads and attachments for one Gmail account.
+    `metadata` holds headers-only copies (format=metadata) used for triage;
+    `messages` holds full payloads, fetched only for messages that passed it.
+    Threads are cached headers-only: only the last sender is ever read.
+    """
+    def __init__(self, service, user_id='me'):
+        self.service = service
+        self.user_id = user_id
+        self.metadata = {}
+        self.messages = {}
+        self.threads = {}
+        self.attachments = {} # {(msg_id, att_id): data}
+        self.replied_threads = {} # {thread_id: internalDate of the newest message our reply answered}
+
+    def prefetch_metadata(self, msg_ids):
+        msgs = self.service.users().messages()
+        wanted = {m: msgs.get(userId=self.user_id, id=m, format='metadata', metadataHeaders=METADATA_HEADERS)
+                  for m in msg_ids if m not in self.metadata}
+        if wanted:
+            results, errors = batch_execute(self.service, wanted)
+            self.metadata.update(results)
+            _report(errors, "message metadata")
+
+    def prefetch_messages(self, msg_ids):
+        msgs = self.service.users().messages()
+        wanted = {m: msgs.get(userId=self.user_id, id=m) for m in msg_ids if m not in self.messages}
+        if wanted:
+            results, errors = batch_execute(self.service, wanted)
+            self.messages.update(results)
+            _report(errors, "message")
+
+    def prefetch_threads(self, thread_ids):
+        threads = self.service.users().threads()
+        wanted = {t: threads.get(userId=self.user_id, id=t, format='metadata', metadataHeaders=['From'])
+                  for t in thread_ids if t not in self.threads}
+        if wanted:
+            results, errors = batch_execute(self.service, wanted)
+            self.threads.update(results)
+            _report(errors, "thread")
+
+    def prefetch_attachments(self, keys):
+        """Fetches the given (msg_id, attachment_id) attachments."""
+        attachments = self.service.users().messages().attachments()
+        wanted = {f"{msg_id}:{att_id}": attachments.get(userId=self.user_id, messageId=msg_id, id=att_id)
+                  for msg_id, att_id in keys if (msg_id, att_id) not in self.attachments}
+        if wanted:
+            results, errors = batch_execute(self.service, wanted)
+            for key, att in results.items():
+                msg_id, att_id = key.split(':', 1)
+                self.attachments[(msg_id, att_id)] = att.get('data')
+            _report(errors, "attachment")
+
+    def message_metadata(self, msg_id):
+        if msg_id not in self.metadata:
+            self.metadata[msg_id] = self.service.users().messages().get(
+                userId=self.user_id, id=msg_id, format='metadata', metadataHeaders=METADATA_HEADERS).execute()
+        return self.metadata[msg_id]
+
+    def message(self, msg_id):
+        if msg_id not in self.messages:
+            self.messages[msg_id] = self.service.users().messages().get(userId=self.user_id, id=msg_id).execute()
+        return self.messages[msg_id]
+
+    def thread(self, thread_id):
+        if thread_id not in self.threads:
+            self.threads[thread_id] = self.service.users().threads().get(
+                userId=self.user_id, id=thread_id, format='metadata', metadataHeaders=['From']).execute()
+        return self.threads[thread_id]
+
+    def attachment(self, msg_id, att_id):
+        key = (msg_id, att_id)
+        if key not in self.attachments:
+            att = self.service.users().messages().attachments().get(userId=self.user_id, messageId=msg_id, id=att_id).execute()
+            self.attachments[key] = att.get('data')
+        return self.attachments[key]
+
+    def pop_attachment(self, msg_id, att_id):
+        """Like attachment(), but drops the cached copy: attachments are read once."""
+        data = self.attachment(msg_id, att_id)
+        self.attachments.pop((msg_id, att_id), None)
+        return data
+
+    def release(self):
+        """Drops cached payloads once a chunk is done; keeps which threads we replied to."""
+        self.metadata.clear()
+        self.messages.clear()
+        self.threads.clear()
+        self.attachments.clear()
+
+    def note_reply(self, thread_id, answered_at=0):
+        """The cached copy of this thread is now stale: our reply is its last message."""
+        self.replied_threads[thread_id] = max(answered_at, self.replied_threads.get(thread_id, 0))
+
+class LabelQueue:
+    """
+    Label changes for one account, queued while a pass runs and applied at
+    checkpoints with messages.batchModify: one call per distinct change and
+    BATCH_MODIFY_SIZE messages, instead of a modify (and a round trip) each.
+    Queue a change only once everything else the message needed is done;
+    whatever never gets flushed is simply seen again next run.
+    """
+    def __init__(self, service, user_id='me'):
+        self.service = service
+        self.user_id = user_id
+        self.pending = {} # {(add_labels, remove_labels): {msg_id: None}} (ordered sets)
+
+    def __len__(self):
+        return sum(len(ids) for ids in self.pending.values())
+
+    def modify(self, msg_ids, add=(), remove=()):
+        self.pending.setdefault((tuple(add), tuple(remove)), {}).update(dict.fromkeys(msg_ids))
+
+    def mark_read(self, msg_ids):
+        self.modify(msg_ids, remove=['UNREAD'])
+
+    def queued(self):
+        """IDs of every message with a change still waiting."""
+        return {msg_id for ids in self.pending.values() for msg_id in ids}
+
+    def flush(self):
+        """Applies everything queued. On a failed call the rest stays queued and False is returned."""
+        msgs = self.service.users().messages()
+        for (add, remove), queued in list(self.pending.items()):
+            while queued:
+                chunk = list(queued)[:BATCH_MODIFY_SIZE]
+                body = {'ids': chunk}
+                if add:
+                    body['addLabelIds'] = list(add)
+                if remove:
+                    body['removeLabelIds'] = list(remove)
+                try:
+                    msgs.batchModify(userId=self.user_id, body=body).execute()
+                except Exception as e:
+                    print(f"   ⚠️ Could not update labels on {len(queued)} message(s): {e}")
+                    return False
+                for msg_id in chunk:
+                    del queued[msg_id]
+            del self.pending[(add, remove)]
+        return True
+
+def _report(errors, kind):
+    for key, error in errors.items():
+        print(f"   ⚠️ Batch fetch failed for {kind} {key}: {error}")
@@ -0,0 +1,100 @@
+"""
+Image attachments for the payment check.
+
+find_images() only describes a message's image parts (ImageRef); nothing
+is downloaded until the vision path asks for it. Parts over the byte cap
+are never fetched. Decoding and downscaling run on a small worker pool, so
+the replier can fetch attachments in one batch and keep triaging while
+the pictures are prepared, and Gemini receives a bounded-size image
+instead of a multi-MB phone screenshot.
+"""
+import io
+import os
+import base64
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from modules.gmail_batch import iter_parts
+from modules.vision_cache import sha256_of
+
+# Attachments bigger than this are not downloaded (bytes)
+MAX_ATTACHMENT_BYTES = int(os.getenv("VISION_MAX_IMAGE_BYTES", str(10 * 1024 * 1024)))
+# Longest side of the picture sent to Gemini (pixels)
+MAX_IMAGE_SIDE = 1536
+IMAGE_WORKERS = 2
+
+_lock = threading.Lock()
+_pool = None
+
+def _get_pool():
+    global _pool
+    with _lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=IMAGE_WORKERS, thread_name_prefix="images")
+        return _pool
+
+class ImageRef:
+    """An image part of a message: enough to decide on it and fetch it later."""
+    __slots__ = ('msg_id', 'part')
+
+    def __init__(self, msg_id, part):
+        self.msg_id = msg_id
+        self.part = part
+
+    @property
+    def attachment_id(self):
+        return self.part.get('body', {}).get('attachmentId')
+
+    @property
+    def key(self):
+        """MessageCache key of the attachment (None for inline data)."""
+        return (self.msg_id, self.attachment_id) if self.attachment_id else None
+
+    @property
+    def size(self):
+        return self.part.get('body', {}).get('size', 0)
+
+    @property
+    def too_large(self):
+        return MAX_ATTACHMENT_BYTES and self.size > MAX_ATTACHMENT_BYTES
+
+    def read(self, service, cache=None, user_id='me'):
+        """The raw file bytes (downloads unless the cache already has them)."""
+        if self.attachment_id:
+            if cache:
+                data = cache.pop_attachment(self.msg_id, self.attachment_id)
+            else:
+                att = service.users().messages().attachments().get(
+                    userId=user_id, messageId=self.msg_id, id=self.attachment_id).execute()
+                data = att.get('data')
+        else:
+            data = self.part.get('body', {}).get('data')
+        if not data:
+            return None
+        return base64.urlsafe_b64decode(data.encode('UTF-8'))
+
+    def load(self, service, cache=None):
+        """
+        Reads the bytes here (Gmail clients are not thread-safe) and returns a
+        Future of prepare_image(bytes) run on the image pool.
+        """
+        file_data = self.read(service, cache)
+        if file_data is None:
+            raise ValueError(f"Image part of message {self.msg_id} has no data.")
+        return _get_pool().submit(prepare_image, file_data)
+
+def find_images(msg_id, payload):
+    """ImageRefs for every image part of the message (nothing is downloaded)."""
+    return [ImageRef(msg_id, part) for part in iter_parts(payload)
+            if part.get('mimeType', '').startswith('image/')]
+
+def prepare_image(file_data, max_side=MAX_IMAGE_SIDE):
+    """Decodes and downscales to fit max_side; the file's sha256 is kept in image.info."""
+    from PIL import Image # only needed once a screenshot actually has to be checked
+    img = Image.open(io.BytesIO(file_data))
+    img.draft('RGB', (max_side, max_side)) # JPEG: decode straight at a reduced scale
+    if img.mode not in ('RGB', 'L'):
+        img = img.convert('RGB')
+    img.thumbnail((max_side, max_side))
+    img.load()
+    img.info['sha256'] = sha256_of(file_data) # content key for the verdict cache
+    return img
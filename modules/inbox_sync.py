@@ -0,0 +1,211 @@
+"""
+Incremental inbox sync for the replier.
+
+Instead of re-listing every UNREAD message on each tick, we remember the
+mailbox historyId per account (state/inbox_checkpoints.json) and ask
+users.history.list only for messages added since then. If there is no
+checkpoint yet, or Gmail has expired it (404), we fall back to a full list.
+
+Messages a pass failed to handle don't hold the checkpoint back: their IDs
+are kept in the account's entry and offered again on the next runs, up to
+MAX_MESSAGE_ATTEMPTS times, while the checkpoint itself moves on.
+
+Full lists are walked page by page (UnreadPager) and capped per run; when
+the cap is hit the page token is saved and the next run resumes there, so
+a large backlog drains steadily instead of being re-read from the top.
+Page tokens are offsets into a listing that shrinks as messages are marked
+read, so a resumed scan can step over older unread mail. Once a resumed
+scan reaches the end, the next run therefore lists every unread message
+once more, uncapped and from the top, before switching to history mode.
+"""
+import os
+from itertools import islice
+from googleapiclient.errors import HttpError
+from modules.state import load_json, update_json
+
+# 'history' = incremental via users.history.list, 'full' = list all UNREAD every run
+INBOX_SYNC_MODE = os.getenv("INBOX_SYNC_MODE", "history")
+# Most unread messages looked at per account per run on a full scan (0 = no cap)
+MAX_MESSAGES_PER_RUN = int(os.getenv("REPLIER_MAX_MESSAGES_PER_RUN", "500"))
+LIST_PAGE_SIZE = 100
+# Runs a failed message is offered again before it is left for a human
+MAX_MESSAGE_ATTEMPTS = int(os.getenv("REPLIER_MAX_MESSAGE_ATTEMPTS", "3"))
+INBOX_QUERY = '-category:promotions -category:social'
+CHECKPOINT_FILE = 'inbox_checkpoints.json'
+SKIPPED_LABELS = {'CATEGORY_PROMOTIONS', 'CATEGORY_SOCIAL'}
+
+def load_checkpoint(account):
+    return load_json(CHECKPOINT_FILE, {}).get(account, {})
+
+def save_checkpoint(account, history_id, scan=None, retry=None):
+    """
+    Call only once the messages returned with this checkpoint have been dealt with.
+    `scan` ({'pageToken': ...}) marks a capped full scan that the next run resumes,
+    ({'final': True}) one that is drained but still needs its uncapped re-list.
+    `retry` ({msg_id: attempts}) lists messages that failed and are offered again.
+    """
+    def apply(data):
+        entry = {'historyId': str(history_id)}
+        if scan is not None:
+            entry['scan'] = scan
+        if retry:
+            entry['retry'] = retry
+        data[account] = entry
+        return data
+    update_json(CHECKPOINT_FILE, apply, {})
+
+def chunked(iterable, size):
+    """Yields lists of up to `size` items, pulling lazily from `iterable`."""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+class UnreadPager:
+    """
+    Lazily yields UNREAD message refs page by page, following nextPageToken.
+    The cap is applied at page boundaries; after iteration `done` tells
+    whether the listing was walked to the end, and if not, `resume_token`
+    is the page the next run should start from.
+    """
+    def __init__(self, service, page_token=None, limit=MAX_MESSAGES_PER_RUN, query=INBOX_QUERY):
+        self.service = service
+        self.start_token = page_token
+        self.limit = limit
+        self.query = query
+        self.page_size = min(LIST_PAGE_SIZE, limit) if limit else LIST_PAGE_SIZE
+        self.resume_token = page_token
+        self.done = False
+
+    def _list(self, token):
+        kwargs = {'userId': 'me', 'labelIds': ['UNREAD'], 'q': self.query, 'maxResults': self.page_size}
+        if token:
+            kwargs['pageToken'] = token
+        try:
+            return self.service.users().messages().list(**kwargs).execute()
+        except HttpError as e:
+            if not token or e.resp.status != 400:
+                raise
+            # A stale resume token: start the listing over.
+            print("   ⚠️ Saved page token rejected. Restarting inbox listing from the top.")
+            kwargs.pop('pageToken')
+            return self.service.users().messages().list(**kwargs).execute()
+
+    def __iter__(self):
+        token = self.start_token
+        count = 0
+        while True:
+            response = self._list(token)
+            for msg in response.get('messages', []):
+                count += 1
+                yield msg
+            token = response.get('nextPageToken')
+            if not token:
+                self.done = True
+                return
+            self.resume_token = token
+            if self.limit and count >= self.limit:
+                # Cap reached: the next run picks up from the following page.
+                return
+
+def list_unread_since(service, start_history_id):
+    """
+    Messages added since start_history_id that are still unread (and not
+    promotions/social). Returns (messages, latest historyId).
+    Raises HttpError 404 if the checkpoint is too old.
+    """
+    messages = {}
+    latest = start_history_id
+    page_token = None
+    while True:
+        kwargs = {'userId': 'me', 'startHistoryId': start_history_id, 'historyTypes': ['messageAdded']}
+        if page_token:
+            kwargs['pageToken'] = page_token
+        response = service.users().history().list(**kwargs).execute()
+        latest = response.get('historyId', latest)
+        for record in response.get('history', []):
+            for added in record.get('messagesAdded', []):
+                msg = added['message']
+                labels = set(msg.get('labelIds', []))
+                if 'UNREAD' in labels and not labels & SKIPPED_LABELS:
+                    messages[msg['id']] = {'id': msg['id'], 'threadId': msg.get('threadId')}
+        page_token = response.get('nextPageToken')
+        if not page_token:
+            break
+    return list(messages.values()), latest
+
+class InboxPass:
+    """
+    The unread messages one replier pass should look at: earlier failures
+    first, then what is new. Iterate it (lazily), then call commit() with
+    the IDs that could not be handled to move the account's checkpoint forward.
+    """
+    def __init__(self, account, messages, history_id, pager=None, retry=None):
+        self.account = account
+        self.messages = messages
+        self.history_id = history_id
+        self.pager = pager
+        self.retry = dict(retry or {}) # {msg_id: attempts so far}
+
+    def __iter__(self):
+        for msg_id in self.retry:
+            yield {'id': msg_id}
+        for msg in self.messages:
+            if msg['id'] not in self.retry:
+                yield msg
+
+    @property
+    def paged(self):
+        """True for a full scan walked by page token: don't change labels mid-listing."""
+        return self.pager is not None
+
+    def commit(self, failed=()):
+        """Saves the checkpoint; `failed` messages are kept for the next run until they run out of attempts."""
+        scan = None
+        if self.pager and not self.pager.done:
+            scan = {'pageToken': self.pager.resume_token}
+        elif self.pager and self.pager.start_token:
+            # A resumed scan may have skipped mail: re-list everything once before trusting history
+            scan = {'final': True}
+        retry = {}
+        for msg_id in failed:
+            attempts = self.retry.get(msg_id, 0) + 1
+            if attempts >= MAX_MESSAGE_ATTEMPTS:
+                print(f"   ⚠️ Giving up on message {msg_id} after {attempts} failed attempts. It is left unread for a manual look.")
+                continue
+            retry[msg_id] = attempts
+        save_checkpoint(self.account, self.history_id, scan, retry)
+
+def open_inbox_pass(service, account):
+    checkpoint = load_checkpoint(account)
+    history_id = checkpoint.get('historyId')
+    scan = checkpoint.get('scan')
+    retry = checkpoint.get('retry')
+
+    if INBOX_SYNC_MODE == 'history' and history_id and scan is None:
+        try:
+            messages, latest = list_unread_since(service, history_id)
+            return InboxPass(account, messages, latest, retry=retry)
+        except HttpError as e:
+            if e.resp.status != 404:
+                raise
+            print(f"   ⚠️ History checkpoint for {account} expired. Falling back to a full inbox scan.")
+
+    limit = MAX_MESSAGES_PER_RUN
+    if scan is not None and history_id and scan.get('final'):
+        # The capped scan is drained; one uncapped listing from the top catches what it skipped.
+        print(f"   ↪ Inbox backlog for {account} drained. Re-listing all unread mail once before history sync.")
+        page_token, limit = None, 0
+    elif scan is not None and history_id:
+        # Still draining a capped full scan; keep the historyId from when it started.
+        print(f"   ↪ Resuming inbox scan for {account} from the saved page.")
+        page_token = scan.get('pageToken')
+    else:
+        # New full scan. Take the historyId first so nothing arriving during the scan is missed later.
+        history_id = service.users().getProfile(userId='me').execute().get('historyId')
+        page_token = None
+
+    pager = UnreadPager(service, page_token, limit)
+    return InboxPass(account, pager, history_id, pager, retry)
@@ -0,0 +1,68 @@
+"""
+Append-only send journal (state/send_journal.jsonl).
+
+Every email is recorded right after Gmail accepts it, keyed by
+(account, client, stage, date). Stages check the journal before sending,
+so a retried or overlapping run skips what is already done even if the
+matching sheet update never landed, without any Gmail or Sheets call.
+Lines appended by other processes are picked up on the next check.
+"""
+import os
+import json
+import threading
+from datetime import datetime
+import pytz
+from modules.state import state_path
+
+JOURNAL_FILE = 'send_journal.jsonl'
+TIMEZONE = pytz.timezone('Asia/Kolkata') # same calendar as the sheet's dates
+
+_lock = threading.Lock()
+_sent = set() # {(account, client, stage, date)}
+_offset = 0 # how far into the file we have read
+
+def today():
+    return datetime.now(TIMEZONE).strftime('%Y-%m-%d')
+
+def _key(account, client, stage, date):
+    return (account.strip().lower(), client.strip().lower(), stage, date or today())
+
+def _catch_up():
+    """Reads lines appended since the last call (by us or another process)."""
+    global _offset
+    try:
+        with open(state_path(JOURNAL_FILE), 'r', encoding='utf-8') as f:
+            f.seek(_offset)
+            for line in f:
+                if not line.endswith('\n'):
+                    break # another process is mid-write; read it next time
+                _offset += len(line.encode('utf-8'))
+                try:
+                    entry = json.loads(line)
+                    _sent.add((entry['account'], entry['client'], entry['stage'], entry['date']))
+                except (ValueError, KeyError):
+                    continue
+    except FileNotFoundError:
+        pass
+
+def already_sent(account, client, stage, date=None):
+    """True if this email was already sent (today, unless `date` is given)."""
+    key = _key(account, client, stage, date)
+    with _lock:
+        if key in _sent:
+            return True
+        _catch_up()
+        return key in _sent
+
+def record(account, client, stage, date=None):
+    """Call right after the send succeeds."""
+    key = _key(account, client, stage, date)
+    line = json.dumps({'account': key[0], 'client': key[1], 'stage': key[2], 'date': key[3],
+                       'at': datetime.now(TIMEZONE).isoformat(timespec='seconds')})
+    with _lock:
+        # One write() per line in append mode: concurrent writers never interleave within a line
+        with open(state_path(JOURNAL_FILE), 'a', encoding='utf-8') as f:
+            f.write(line + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        _sent.add(key)
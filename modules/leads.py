@@ -0,0 +1,255 @@
+"""
+In-memory lead table: the sheet rows plus a header schema compiled once
+and secondary indexes (by Gmail account, status and payment status) that are kept in sync on every write. "Rows for account X with
+status Sent" becomes a dictionary lookup instead of a full sheet scan.
+
+Cells are stored by column, not as a list per row. Columns that repeat a
+few values (account, status, dates, prices, skill) hold an array of small
+codes into their distinct values; the rest (names, emails, links) a plain
+list. Rows are read through LeadRow views that index like the old lists.
+"""
+import threading
+from array import array
+from bisect import bisect_left, insort
+from collections.abc import Sequence
+
+# Where these columns sit on the sheet (U, V, W) if the header cell is missing.
+DEFAULT_COLUMNS = {
+    'Payment Status': 20,
+    'Delivery Date': 21,
+    'Delivery Status': 22,
+}
+
+class SheetSchema:
+    """The header row compiled into {column name: 0-based index}."""
+    __slots__ = ('headers', 'positions')
+
+    def __init__(self, headers):
+        self.headers = list(headers)
+        self.positions = {}
+        for i, name in enumerate(self.headers):
+            self.positions.setdefault(name, i)
+
+    def __contains__(self, name):
+        return name in self.positions
+
+    def index(self, name):
+        """Like headers.index(name): raises ValueError if the column is missing."""
+        try:
+            return self.positions[name]
+        except KeyError:
+            raise ValueError(f"'{name}' is not in list") from None
+
+    def get(self, name):
+        """Column index, else its DEFAULT_COLUMNS position, else None."""
+        return self.positions.get(name, DEFAULT_COLUMNS.get(name))
+
+# A column is dictionary-encoded when it has at most one distinct value per this many rows
+ENCODE_RATIO = 4
+
+class _Column:
+    """
+    One sheet column, top to bottom. Encoded: `cells` is an array('I') of
+    codes into `values` (4 bytes a cell, one copy of each value). Plain:
+    `cells` is the list of values itself.
+    """
+    __slots__ = ('cells', 'values', 'codes')
+
+    def __init__(self, cells):
+        cells = list(cells)
+        if len(set(cells)) * ENCODE_RATIO <= len(cells):
+            self.values = []
+            self.codes = {}
+            self.cells = array('I', map(self._code, cells))
+        else:
+            self.values = self.codes = None
+            self.cells = cells
+
+    def _code(self, value):
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+    def __getitem__(self, i):
+        if self.codes is None:
+            return self.cells[i]
+        return self.values[self.cells[i]]
+
+    def __setitem__(self, i, value):
+        self.cells[i] = value if self.codes is None else self._code(value)
+
+def _add(index, key, row_num):
+    rows = index.get(key)
+    if rows is None:
+        rows = index[key] = array('I')
+    if not rows or rows[-1] < row_num:
+        rows.append(row_num) # loading goes in sheet order
+    else:
+        insort(rows, row_num)
+
+def _remove(index, key, row_num):
+    rows = index.get(key, ())
+    if _contains(rows, row_num):
+        del rows[bisect_left(rows, row_num)]
+
+def _contains(rows, row_num):
+    i = bisect_left(rows, row_num)
+    return i < len(rows) and rows[i] == row_num
+
+class LeadRow(Sequence):
+    """Read-only view of one sheet row; indexes, slices and len()s like its list of cells."""
+    __slots__ = ('table', 'index')
+
+    def __init__(self, table, index):
+        self.table = table
+        self.index = index
+
+    def __len__(self):
+        return self.table.lengths[self.index]
+
+    def __getitem__(self, col):
+        if isinstance(col, slice):
+            return [self[c] for c in range(*col.indices(len(self)))]
+        length = len(self)
+        if col < 0:
+            col += length
+        if not 0 <= col < length:
+            raise IndexError('row index out of range')
+        return self.table.columns[col][self.index]
+
+    def __eq__(self, other):
+        return isinstance(other, (list, LeadRow)) and list(self) == list(other)
+
+    def __repr__(self):
+        return repr(list(self))
+
+class LeadTable(Sequence):
+    """
+    Sheet rows with secondary indexes. Indexing the table (0-based, like the
+    list of rows it replaces) or row() (1-based sheet row numbers, as used
+    by update_cell; the header is row 1) gives LeadRow views.
+    Index keys: accounts are stripped and lower-cased, statuses are
+    stripped; a row too short to have the cell has no key (it gets an
+    empty one once a write makes the row long enough).
+    Writes and index lookups are locked so account workers can share it.
+    """
+    def __init__(self, rows):
+        self.lock = threading.RLock()
+        width = max((len(row) for row in rows), default=0)
+        self.lengths = array('H', (len(row) for row in rows)) # cells each row really has
+        self.columns = [_Column(row[col] if len(row) > col else '' for row in rows) for col in range(width)]
+        self.schema = SheetSchema(self[0] if rows else [])
+        self.account_col = self.schema.get('Gmail Account')
+        self.status_col = self.schema.get('Status')
+        self.payment_col = self.schema.get('Payment Status')
+        self.indexed_cols = {col for col in (self.account_col, self.status_col, self.payment_col) if col is not None}
+
+        # Row numbers per key, as sorted array('I')s (4 bytes a row)
+        self.by_account = {} # {account: rows}
+        self.by_status = {} # {status: rows}
+        self.by_payment = {} # {payment status: rows}
+        for row_num in range(2, len(self) + 1):
+            self._index(row_num)
+
+    def __len__(self):
+        return len(self.lengths)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [LeadRow(self, i) for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('table index out of range')
+        return LeadRow(self, index)
+
+    def _key(self, row_num, col, lower=False):
+        if col is None or self.lengths[row_num - 1] <= col:
+            return None
+        value = str(self.columns[col][row_num - 1]).strip()
+        if lower:
+            lowered = value.lower()
+            if lowered != value:
+                return lowered
+        # Unchanged values keep the stored object, so index keys share it instead of copying
+        return value
+
+    def _keys(self, row_num):
+        return (self._key(row_num, self.account_col, lower=True),
+                self._key(row_num, self.status_col),
+                self._key(row_num, self.payment_col))
+
+    def _index(self, row_num):
+        account, status, payment = self._keys(row_num)
+        if account:
+            _add(self.by_account, account, row_num)
+        if status is not None:
+            _add(self.by_status, status, row_num)
+        if payment is not None:
+            _add(self.by_payment, payment, row_num)
+
+    def _unindex(self, row_num):
+        account, status, payment = self._keys(row_num)
+        if account:
+            _remove(self.by_account, account, row_num)
+        if status is not None:
+            _remove(self.by_status, status, row_num)
+        if payment is not None:
+            _remove(self.by_payment, payment, row_num)
+
+    def set(self, row_num, col, value):
+        """Writes one cell (1-based row and col) and updates the indexes."""
+        with self.lock:
+            self._set(row_num, col, value)
+
+    def _set(self, row_num, col, value):
+        col_idx = col - 1
+        length = self.lengths[row_num - 1]
+        # Growing the row gives it (empty) cells in any indexed column it now reaches
+        indexed = any(col_idx == c or length <= c < col for c in self.indexed_cols)
+        if indexed:
+            self._unindex(row_num)
+        while len(self.columns) < col:
+            self.columns.append(_Column([''] * len(self)))
+        if length < col:
+            self.lengths[row_num - 1] = col
+        self.columns[col_idx][row_num - 1] = value
+        if indexed:
+            self._index(row_num)
+
+    def row(self, row_num):
+        return LeadRow(self, row_num - 1)
+
+    def cell(self, row_num, col_idx, default=''):
+        """Cell by 0-based column index; `default` if the row is too short."""
+        if col_idx is None or self.lengths[row_num - 1] <= col_idx:
+            return default
+        return self.columns[col_idx][row_num - 1]
+
+    def accounts(self):
+        with self.lock:
+            return {account for account, rows in self.by_account.items() if rows}
+
+    def find(self, account=None, status=None, payment=None):
+        """Row numbers (sheet order) matching every given key."""
+        with self.lock:
+            return self._find(account, status, payment)
+
+    def _find(self, account, status, payment):
+        candidates = []
+        if account is not None:
+            candidates.append(self.by_account.get(account.strip().lower(), ()))
+        if status is not None:
+            candidates.append(self.by_status.get(status, ()))
+        if payment is not None:
+            candidates.append(self.by_payment.get(payment, ()))
+        if not candidates:
+            return list(range(2, len(self) + 1))
+        # Walk the shortest list, binary-searching the others (all are sorted)
+        candidates.sort(key=len)
+        result = list(candidates[0])
+        for other in candidates[1:]:
+            result = [row_num for row_num in result if _contains(other, row_num)]
+        return result
@@ -0,0 +1,61 @@
+"""
+Run leases: only one process at a time works a given stage (or stage and
+account). A lease is an exclusive, non-blocking flock on a file in the
+state directory; the OS drops it when the holder exits, crash included,
+so there is nothing to clean up. Overlapping runs skip what is leased.
+
+Without fcntl (Windows) every lease is granted.
+"""
+from contextlib import contextmanager
+from modules.state import state_path
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+class Lease:
+    def __init__(self, name):
+        self.name = name
+        self.path = state_path(f"lease-{name}.lock")
+        self._file = None
+
+    def acquire(self):
+        """True if we now hold the lease, False if another run does."""
+        if fcntl is None:
+            return True
+        f = open(self.path, 'a')
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            f.close()
+            return False
+        self._file = f
+        return True
+
+    def release(self):
+        if self._file is not None:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
+
+@contextmanager
+def run_lease(name):
+    """with run_lease('delivery') as held: ... (held is False if another run has it)"""
+    lease = Lease(name)
+    held = lease.acquire()
+    try:
+        yield held
+    finally:
+        if held:
+            lease.release()
+
+def leased(stage, worker):
+    """Wraps a per-account worker so it only runs while holding the (stage, account) lease."""
+    def run(account):
+        with run_lease(f"{stage}-{account}") as held:
+            if not held:
+                print(f"⏭️ Another run is already on {stage} for {account}. Skipping.")
+                return
+            worker(account)
+    return run
@@ -0,0 +1,194 @@
+"""
+Gemini generation for the replier, off the main loop.
+
+Calls run on a bounded thread pool: the replier queues every prompt of a
+batch at once and collects the results in order when it sends, so a burst
+of replies costs about as long as the slowest few calls rather than all of
+them back to back. The pool is shared by all account workers.
+
+Every key in GEMINI_API_KEY (comma-separated) gets its own client. A
+KeyPool tracks requests and tokens per key over the last minute, hands
+each call the least-loaded key that still has room (when per-key caps are
+set), benches a key for a while after a 429 and retries the call on
+another key.
+
+google.generativeai takes about a second to import, so it is only loaded
+(and the keys only read) when the first call is actually made.
+"""
+import os
+import time
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from modules import metrics
+
+MODEL_NAME = 'gemini-2.5-flash'
+# Optional per-key limits (requests / tokens per minute; 0 = no local cap, a 429 benches
+# the key instead). On the free tier of MODEL_NAME set them to 10 and 250000.
+KEY_RPM = int(os.getenv("GEMINI_KEY_RPM", "0"))
+KEY_TPM = int(os.getenv("GEMINI_KEY_TPM", "0"))
+# How long a key is benched after a 429 (seconds)
+KEY_COOLDOWN = float(os.getenv("GEMINI_KEY_COOLDOWN", "60"))
+# Calls in flight per configured key; GEMINI_CONCURRENCY sets the total instead
+CALLS_PER_KEY = 4
+IMAGE_TOKENS = 258 # what Gemini bills for one image
+
+WINDOW = 60.0
+
+def parse_keys(value):
+    return [k.strip() for k in (value or '').split(',') if k.strip()]
+
+def estimate_tokens(prompt):
+    """Rough input size: ~4 characters per token, plus a flat cost per image."""
+    parts = prompt if isinstance(prompt, (list, tuple)) else [prompt]
+    return sum(len(p) // 4 + 1 if isinstance(p, str) else IMAGE_TOKENS for p in parts)
+
+class GeminiKey:
+    """One API key: its own client and model, and its usage over the last minute."""
+    def __init__(self, api_key, label):
+        self.api_key = api_key
+        self.label = label # safe to print
+        self.usage = deque() # [timestamp, tokens] per call in the window
+        self.cooldown_until = 0.0
+        self.disabled = False
+        self._model = None
+
+    @property
+    def model(self):
+        if self._model is None:
+            import google.generativeai as genai
+            # The public API has one process-wide key (genai.configure), and swapping it under a
+            # lock would serialize every call. A private client manager per key gives each model
+            # its own key instead, which relies on _ClientManager and GenerativeModel._client:
+            # requirements.txt pins the library to the release this was written against (the
+            # package is end-of-life, so no fixes are lost).
+            from google.generativeai.client import _ClientManager
+            manager = _ClientManager()
+            manager.configure(api_key=self.api_key)
+            model = genai.GenerativeModel(MODEL_NAME)
+            model._client = manager.make_client("generative")
+            self._model = model
+        return self._model
+
+    def _expire(self, now):
+        while self.usage and now - self.usage[0][0] >= WINDOW:
+            self.usage.popleft()
+
+    def ready_in(self, now, tokens):
+        """Seconds until this key can take a call of `tokens` (0 = now)."""
+        self._expire(now)
+        waits = [self.cooldown_until - now]
+        if KEY_RPM and len(self.usage) >= KEY_RPM:
+            waits.append(self.usage[-KEY_RPM][0] + WINDOW - now)
+        if KEY_TPM:
+            used = sum(t for _, t in self.usage)
+            for ts, t in self.usage:
+                if used + tokens <= KEY_TPM:
+                    break
+                used -= t
+                waits.append(ts + WINDOW - now)
+        return max(0.0, max(waits))
+
+class KeyPool:
+    def __init__(self, api_keys):
+        self.keys = [GeminiKey(k, f"key#{i}") for i, k in enumerate(api_keys, start=1)]
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.keys)
+
+    def acquire(self, tokens):
+        """
+        Blocks until a key has room for the call, books the call on it and
+        returns (key, usage entry). Raises RuntimeError if no key is usable.
+        """
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                usable = [k for k in self.keys if not k.disabled]
+                if not usable:
+                    raise RuntimeError("No usable Gemini API key configured.")
+                waits = {k: k.ready_in(now, tokens) for k in usable}
+                ready = [k for k in usable if waits[k] == 0]
+                if ready:
+                    key = min(ready, key=lambda k: len(k.usage))
+                    entry = [now, tokens]
+                    key.usage.append(entry)
+                    return key, entry
+                delay = min(waits.values())
+            time.sleep(min(delay, WINDOW))
+
+    def cooldown(self, key, seconds=KEY_COOLDOWN):
+        with self.lock:
+            key.cooldown_until = max(key.cooldown_until, time.monotonic() + seconds)
+        print(f"      ⏳ Gemini {key.label} rate-limited. Cooling down for {int(seconds)}s.")
+
+    def disable(self, key, error):
+        with self.lock:
+            key.disabled = True
+        print(f"      ❌ Gemini {key.label} rejected ({error}). Not using it again this run.")
+
+_lock = threading.Lock()
+_key_pool = None
+_pool = None
+
+def get_key_pool():
+    global _key_pool
+    with _lock:
+        if _key_pool is None:
+            keys = parse_keys(os.getenv("GEMINI_API_KEY"))
+            if keys:
+                print(f"🔑 Gemini key pool ready with {len(keys)} key(s).")
+            else:
+                print("❌ Error: GEMINI_API_KEY not found in environment.")
+            _key_pool = KeyPool(keys)
+        return _key_pool
+
+def _get_pool():
+    global _pool
+    # Most Gemini calls in flight at once (across all accounts)
+    workers = int(os.getenv("GEMINI_CONCURRENCY", "0")) or CALLS_PER_KEY * max(1, len(get_key_pool()))
+    with _lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="gemini")
+        return _pool
+
+def generate(prompt):
+    """
+    Blocking call: the stripped response text. A rate-limited or failing key
+    is benched and the call retried on another one; raises once every
+    attempt has failed (or right away for a request Gemini rejects as invalid).
+    """
+    from google.api_core import exceptions as api_exceptions
+    rate_limited = (api_exceptions.TooManyRequests, api_exceptions.ResourceExhausted)
+    bad_key = (api_exceptions.PermissionDenied, api_exceptions.Unauthenticated)
+
+    key_pool = get_key_pool()
+    tokens = estimate_tokens(prompt)
+    attempts = max(2, len(key_pool))
+    for attempt in range(1, attempts + 1):
+        key, entry = key_pool.acquire(tokens)
+        if attempt > 1:
+            metrics.record_retry('gemini', 'generate_content', key.label)
+        try:
+            with metrics.timed('gemini', 'generate_content', key.label):
+                response = key.model.generate_content(prompt)
+        except bad_key as e:
+            key_pool.disable(key, e.__class__.__name__)
+            if attempt == attempts:
+                raise
+            continue
+        except rate_limited + (api_exceptions.ServerError,) as e:
+            if isinstance(e, rate_limited):
+                key_pool.cooldown(key)
+            if attempt == attempts:
+                raise
+            continue
+        usage = getattr(response, 'usage_metadata', None)
+        if usage is not None and getattr(usage, 'total_token_count', 0):
+            entry[1] = usage.total_token_count # book the real cost
+        return response.text.strip()
+
+def submit(prompt):
+    """Queues generate(prompt) on the shared pool and returns its Future."""
+    return _get_pool().submit(generate, prompt)
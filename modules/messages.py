@@ -0,0 +1,135 @@
+"""
+Message factory: the bot's email templates, parsed once, and the static
+attachments (e.g. the payment QR code) read and base64-encoded once per
+process. render_email() turns them into a ready-to-send Gmail payload
+({'raw': ...}), cheap enough to prepare a whole batch before its send slot.
+"""
+import os
+import base64
+import threading
+from string import Formatter
+from email.mime.text import MIMEText
+from email.mime.multipart import MIMEMultipart
+from email.mime.base import MIMEBase
+from email import encoders
+
+PAYMENT_QR_PATH = 'payment.png'
+
+def _compile(text):
+    # [(literal text, field name or None), ...]
+    return tuple((literal, field) for literal, field, _, _ in Formatter().parse(text))
+
+def _render(parts, fields):
+    out = []
+    for literal, field in parts:
+        out.append(literal)
+        if field is not None:
+            out.append(str(fields[field]))
+    return ''.join(out)
+
+class EmailTemplate:
+    """Subject and body with {field} placeholders, parsed once."""
+    def __init__(self, subject, body):
+        self.subject = _compile(subject)
+        self.body = _compile(body)
+
+    def render(self, **fields):
+        """(subject, body) with the fields filled in."""
+        return _render(self.subject, fields), _render(self.body, fields)
+
+OUTREACH = EmailTemplate(
+    "Quick idea for {client_name}",
+    """Hi {client_name},
+
+I’ve been following {client_name} for a while and I genuinely love the work you are doing in the {skill} space. Your recent posts really caught my eye! 🔥
+
+I noticed a small opportunity to help you stand out even more.
+
+I am currently building a few premium case studies for my portfolio, and I’d love to include your brand.
+
+Usually, for a project like this, I charge around {first_price}, but since I really want to add your logo to my portfolio, I can offer you a generic "Case Study" partner price of just {offer_price}.
+
+This would include: ✅ Premium {skill} ✅ {free_gift} (My treat!) ✅ Unlimited Revisions
+
+You can check my best work here: {portfolio}
+
+No pressure at all—just thought it would be a great fit. Are you open to a quick 5-min chat to discuss?
+
+Best regards, {signature}""")
+
+FOLLOWUP = EmailTemplate(
+    "Quick check-in regarding your project",
+    "Hi {client_name},\n\n"
+    "I just wanted to quickly bump this up in your inbox. Did you get a chance to review my previous email?\n\n"
+    "We are ready to start your design/automation work immediately.\n\n"
+    "Best regards,\n"
+    "{signature}")
+
+DELIVERY = EmailTemplate(
+    "Your Project is Ready! 🚀",
+    "Hi {client_name},\n\n"
+    "We are happy to deliver your project! Here is the link: {final_link}.\n\n"
+    "Please review it. If you need changes, just reply. If you like it, let us know so we can verify payment.\n\n"
+    "By the way, we offer 20+ other skills like AI automation & Design. Let us know if you need anything else!\n\n"
+    "Best regards,\n"
+    "SA Innovation Lab")
+
+PAYMENT_REQUEST = EmailTemplate(
+    "Your Order is Ready! (Payment Required)",
+    "Hi {client_name},\n\n"
+    "Great news! Your design is completely ready and it looks fantastic.\n\n"
+    "To get the final editable files and drive link, please complete the pending payment of $279.\n\n"
+    "UPI ID: solankiart218@okaxis\n"
+    "(Please scan the attached QR Code)\n\n"
+    "IMPORTANT: Please reply to this email with a Screenshot of your payment so we can release the files immediately.\n\n"
+    "Best regards,\n"
+    "{signature}")
+
+# What the closer says when a lead agrees (the sales prompt asks Gemini for exactly this too)
+AGREEMENT_REPLY = ("Fantastic decision! To get started on your Premium Logo immediately, I just need a few details: "
+                   "What is the exact Brand Name you want? Do you have any specific Color Preferences or Slogans? "
+                   "Once you reply with this, I will hand over your file to our Delivery Agent to finalize the order.")
+
+_lock = threading.Lock()
+_attachments = {} # {path: MIMEBase or None if the file is missing}
+
+def static_attachment(path):
+    """
+    The MIME part for a file shipped with the bot, read and encoded once per
+    process and shared by every message that attaches it. None if missing.
+    """
+    with _lock:
+        if path not in _attachments:
+            part = None
+            if os.path.exists(path):
+                with open(path, 'rb') as fp:
+                    part = MIMEBase('application', 'octet-stream')
+                    part.set_payload(fp.read())
+                encoders.encode_base64(part)
+                part.add_header('Content-Disposition', 'attachment', filename=os.path.basename(path))
+            _attachments[path] = part
+        return _attachments[path]
+
+def render_email(to, subject, body, sender=None, thread_id=None, attachments=()):
+    """
+    A ready-to-send Gmail payload. Mail with a sender or `attachments` (paths
+    of static files, see static_attachment; missing ones are skipped) is
+    multipart, as the replier has always sent it; otherwise a single text part.
+    """
+    parts = [part for part in map(static_attachment, attachments) if part is not None]
+    if parts or sender:
+        message = MIMEMultipart()
+        message.attach(MIMEText(body))
+        for part in parts:
+            message.attach(part)
+    else:
+        message = MIMEText(body)
+    message['to'] = to
+    if sender:
+        message['from'] = sender
+    message['subject'] = subject
+    if thread_id:
+        message['threadId'] = thread_id
+
+    raw = base64.urlsafe_b64encode(message.as_bytes()).decode()
+    return {'raw': raw, 'threadId': thread_id} if thread_id else {'raw': raw}
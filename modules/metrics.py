@@ -0,0 +1,235 @@
+"""
+Per-call instrumentation for the Gmail, Sheets and Gemini APIs.
+
+Every call is recorded under (api, method, stage, account): count,
+latency histogram, errors by type, retries and, for Gmail, quota units
+(messages.send = 100, messages.get = 5, ...). Gmail calls are timed at
+the HTTP layer (a request builder on the built service, plus the batch
+helper, see modules.retry), Sheets calls in sheet.py and Gemini calls in
+llm.py, so stage code needs no changes. Each retry attempt is a call.
+
+At the end of a run write_summary() saves the totals as JSON under
+state/metrics/. With METRICS_LIVE=1 a one-line report per stage goes to
+stderr every METRICS_LIVE_INTERVAL seconds while the run is going.
+"""
+import os
+import sys
+import json
+import time
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from modules.state import state_path
+
+METRICS_DIR = 'metrics'
+LIVE_REPORT = os.getenv("METRICS_LIVE", "") not in ("", "0")
+LIVE_INTERVAL = float(os.getenv("METRICS_LIVE_INTERVAL", "10"))
+
+# Gmail API quota units per method (per-user limit: 250 units/second)
+GMAIL_QUOTA_UNITS = {
+    'getProfile': 1,
+    'history.list': 2,
+    'labels.list': 1,
+    'messages.attachments.get': 5,
+    'messages.batchModify': 50,
+    'messages.get': 5,
+    'messages.list': 5,
+    'messages.modify': 5,
+    'messages.send': 100,
+    'threads.get': 10,
+    'threads.list': 10,
+}
+# Latency histogram bucket upper bounds (ms); the last bucket is open-ended
+BUCKETS_MS = (25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+class CallStats:
+    def __init__(self):
+        self.count = 0
+        self.errors = {} # {error type: count}
+        self.retries = 0
+        self.quota_units = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.buckets = [0] * (len(BUCKETS_MS) + 1)
+
+    def add(self, ms, units, error):
+        self.count += 1
+        self.quota_units += units
+        if ms is not None:
+            self.total_ms += ms
+            self.max_ms = max(self.max_ms, ms)
+            self.buckets[next((i for i, bound in enumerate(BUCKETS_MS) if ms <= bound), len(BUCKETS_MS))] += 1
+        if error:
+            self.errors[error] = self.errors.get(error, 0) + 1
+
+    def percentile(self, p):
+        """Upper bound (ms) of the bucket holding the p-th percentile."""
+        timed = sum(self.buckets)
+        if not timed:
+            return None
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if seen >= timed * p / 100:
+                return BUCKETS_MS[i] if i < len(BUCKETS_MS) else round(self.max_ms)
+
+    def as_dict(self):
+        timed = sum(self.buckets)
+        labels = [f"<={b}" for b in BUCKETS_MS] + [f">{BUCKETS_MS[-1]}"]
+        return {
+            'count': self.count,
+            'errors': dict(self.errors),
+            'retries': self.retries,
+            'quota_units': self.quota_units,
+            'latency_ms': {
+                'mean': round(self.total_ms / timed, 1) if timed else None,
+                'p50': self.percentile(50),
+                'p95': self.percentile(95),
+                'max': round(self.max_ms, 1),
+                'histogram': {label: n for label, n in zip(labels, self.buckets) if n},
+            },
+        }
+
+_lock = threading.Lock()
+_stats = {} # {(api, method, stage, account): CallStats}
+_stage_times = {} # {stage: seconds}
+_current_stage = 'startup'
+_started = time.time()
+_live = None
+
+def _entry(api, method, account):
+    key = (api, method, _current_stage, (account or 'default').lower())
+    stats = _stats.get(key)
+    if stats is None:
+        stats = _stats[key] = CallStats()
+    return stats
+
+def error_name(error):
+    """'HttpError 429', 'ResourceExhausted', ..."""
+    status = getattr(getattr(error, 'resp', None), 'status', None) or getattr(getattr(error, 'response', None), 'status_code', None)
+    name = error.__class__.__name__
+    return f"{name} {status}" if status else name
+
+def record(api, method, account=None, seconds=None, error=None, units=None):
+    """One finished call; `error` is the exception it raised, if any."""
+    if units is None:
+        units = GMAIL_QUOTA_UNITS.get(method, 0) if api == 'gmail' else 0
+    with _lock:
+        _entry(api, method, account).add(None if seconds is None else seconds * 1000, units,
+                                         error_name(error) if error is not None else None)
+
+def record_retry(api, method, account=None):
+    with _lock:
+        _entry(api, method, account).retries += 1
+
+@contextmanager
+def timed(api, method, account=None):
+    """with metrics.timed('sheets', 'batch_update'): worksheet.batch_update(...)"""
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException as e:
+        record(api, method, account, time.perf_counter() - start, error=e)
+        raise
+    record(api, method, account, time.perf_counter() - start)
+
+@contextmanager
+def stage(name):
+    """Attributes calls made inside (by any thread) to this stage. Stages run one at a time."""
+    global _current_stage
+    previous, _current_stage = _current_stage, name
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        with _lock:
+            _stage_times[name] = _stage_times.get(name, 0.0) + time.perf_counter() - start
+        _current_stage = previous
+
+def gmail_method(method_id):
+    """'gmail.users.messages.send' -> 'messages.send'"""
+    return (method_id or 'unknown').replace('gmail.users.', '', 1)
+
+def summary():
+    with _lock:
+        items = [(key, stats.as_dict()) for key, stats in sorted(_stats.items())]
+        stage_times = dict(_stage_times)
+    by_stage, by_account = {}, {}
+    for (api, method, stage_name, account), stats in items:
+        for totals in (by_stage.setdefault(stage_name, {}), by_account.setdefault(account, {})):
+            api_totals = totals.setdefault(api, {'calls': 0, 'errors': 0, 'retries': 0, 'quota_units': 0})
+            api_totals['calls'] += stats['count']
+            api_totals['errors'] += sum(stats['errors'].values())
+            api_totals['retries'] += stats['retries']
+            api_totals['quota_units'] += stats['quota_units']
+    return {
+        'started': datetime.fromtimestamp(_started).isoformat(timespec='seconds'),
+        'finished': datetime.now().isoformat(timespec='seconds'),
+        'stage_seconds': {name: round(seconds, 3) for name, seconds in stage_times.items()},
+        'by_stage': by_stage,
+        'by_account': by_account,
+        'calls': [dict(api=api, method=method, stage=stage_name, account=account, **stats)
+                  for (api, method, stage_name, account), stats in items],
+    }
+
+def write_summary():
+    """Saves summary() as state/metrics/run-<timestamp>.json and returns the path (None on failure)."""
+    data = summary()
+    os.makedirs(state_path(METRICS_DIR), exist_ok=True)
+    path = state_path(os.path.join(METRICS_DIR, f"run-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json"))
+    try:
+        with open(path, 'w') as f:
+            json.dump(data, f, indent=2)
+    except OSError as e:
+        print(f"⚠️ Could not write metrics summary: {e}")
+        return None
+    units = sum(t.get('gmail', {}).get('quota_units', 0) for t in data['by_stage'].values())
+    calls = sum(api['calls'] for t in data['by_stage'].values() for api in t.values())
+    print(f"📈 Metrics: {calls} API calls, {units} Gmail quota units. Summary: {path}")
+    return path
+
+def live_line():
+    """'[replier] gmail 120 calls/3400u p95 250ms | gemini 40 calls p95 2500ms 2 err | ...'"""
+    with _lock:
+        merged = {}
+        for (api, _, stage_name, _), stats in _stats.items():
+            if stage_name != _current_stage:
+                continue
+            total = merged.setdefault(api, CallStats())
+            total.count += stats.count
+            total.quota_units += stats.quota_units
+            total.retries += stats.retries
+            total.max_ms = max(total.max_ms, stats.max_ms)
+            total.buckets = [a + b for a, b in zip(total.buckets, stats.buckets)]
+            for name, n in stats.errors.items():
+                total.errors[name] = total.errors.get(name, 0) + n
+        stage_name = _current_stage
+    parts = []
+    for api, total in sorted(merged.items()):
+        part = f"{api} {total.count} calls"
+        if total.quota_units:
+            part += f"/{total.quota_units}u"
+        p95 = total.percentile(95)
+        if p95 is not None:
+            part += f" p95 {p95}ms"
+        errors = sum(total.errors.values())
+        if errors:
+            part += f" {errors} err"
+        if total.retries:
+            part += f" {total.retries} retries"
+        parts.append(part)
+    return f"[{stage_name}] " + (" | ".join(parts) or "no API calls yet")
+
+def start_live_report(interval=LIVE_INTERVAL):
+    """Prints live_line() to stderr every `interval` seconds (daemon thread). No-op unless METRICS_LIVE is set."""
+    global _live
+    if not LIVE_REPORT or _live is not None:
+        return
+
+    def report():
+        while True:
+            time.sleep(interval)
+            print(f"📈 {live_line()}", file=sys.stderr, flush=True)
+
+    _live = threading.Thread(target=report, name="metrics-live", daemon=True)
+    _live.start()
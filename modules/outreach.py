@@ -1,23 +1,25 @@
 import datetime
-import base64
-import time
-import random
 import re
 import pytz
-from email.mime.text import MIMEText
-from modules.services import get_gspread_client, get_service_for_email
+from modules.services import get_service_for_email
+from modules.sheet import load_sheet_snapshot
+from modules.pacing import SendPacer, interleave
+from modules.messages import OUTREACH, render_email
+from modules.lease import Lease
+from modules import journal
 import os
 
 MAX_EMAILS_PER_ACCOUNT_PER_RUN = 10
+# Rate Limit (45-90s between two sends from the same account)
+OUTREACH_PACING = SendPacer(45, 90, stage='outreach')
 
 def send_email(service, to, subject, body):
-    message = MIMEText(body)
-    message['to'] = to
-    message['subject'] = subject
-    raw = base64.urlsafe_b64encode(message.as_bytes()).decode()
-    body = {'raw': raw}
+    return send_prepared(service, to, render_email(to, subject, body))
+
+def send_prepared(service, to, message):
+    """Sends a payload from messages.render_email."""
     try:
-        service.users().messages().send(userId='me', body=body).execute()
+        service.users().messages().send(userId='me', body=message).execute()
         print(f"Email sent to {to}")
         return True
     except Exception as e:
@@ -35,58 +37,54 @@ def get_sender_signature(email_address):
     except Exception:
         return "Titan Bot"
 
-def send_outreach_emails():
+def send_outreach_emails(sheet=None):
     print("Running Outreach (Batch Mode)...")
     
     ist = pytz.timezone('Asia/Kolkata')
     today_str = datetime.datetime.now(ist).strftime("%d/%m/%Y")
     print(f"🤖 SYSTEM DATE (IST): {today_str}")
 
-    gc = get_gspread_client()
-    SHEET_ID = '1N3_jJkYNCtp1MQXEObtDH9FC_VzPyL2RLBW_MdfvfCM'
-    try:
-        sh = gc.open_by_key(SHEET_ID)
-        worksheet = sh.sheet1
-    except Exception as e:
-        print(f"Error opening sheet {SHEET_ID}: {e}")
-        return
+    if sheet is None:
+        sheet = load_sheet_snapshot()
+        if sheet is None:
+            return
 
-    rows = worksheet.get_all_values()
+    rows = sheet.rows
     if not rows:
         print("No data found.")
         return
 
-    headers = rows[0]
+    leads = sheet.leads
+    schema = sheet.schema
     try:
-        date_col_idx = headers.index('Date')
-        status_col_idx = headers.index('Status')
-        email_col_idx = headers.index('Email')
-        gmail_col_idx = headers.index('Gmail Account')
-        name_col_idx = headers.index('Client Name')
-        skill_col_idx = headers.index('Selected Skill')
-        first_price_col_idx = headers.index('First Price')
-        offer_price_col_idx = headers.index('Offer Price')
-        free_gift_col_idx = headers.index('Free Gift')
-        portfolio_col_idx = headers.index('Portfolio Link')
+        date_col_idx = schema.index('Date')
+        status_col_idx = schema.index('Status')
+        email_col_idx = schema.index('Email')
+        gmail_col_idx = schema.index('Gmail Account')
+        name_col_idx = schema.index('Client Name')
+        skill_col_idx = schema.index('Selected Skill')
+        first_price_col_idx = schema.index('First Price')
+        offer_price_col_idx = schema.index('Offer Price')
+        free_gift_col_idx = schema.index('Free Gift')
+        portfolio_col_idx = schema.index('Portfolio Link')
     except ValueError as e:
         print(f"Missing column: {e}")
         return
 
-    # Pass 1: Group Pending Tasks by Account
+    # Pass 1: Group Pending Tasks by Account (empty Status rows come straight from the index)
     pending_by_account = {} # {account_email: [row_index, ...]}
     
-    for i, row in enumerate(rows[1:], start=2):
-        if len(row) <= status_col_idx: continue
+    for i in leads.find(status=""):
+        row = leads.row(i)
         
         # Validation
         if len(row) > name_col_idx and not row[name_col_idx].strip(): continue
         if len(row) > email_col_idx and not row[email_col_idx].strip(): continue
         
-        date_val = str(row[date_col_idx]).strip()
-        status_val = str(row[status_col_idx]).strip()
+        date_val = str(leads.cell(i, date_col_idx)).strip()
         
-        if date_val == today_str and status_val == "":
-            sender = row[gmail_col_idx].strip().lower() if len(row) > gmail_col_idx else ""
+        if date_val == today_str:
+            sender = leads.cell(i, gmail_col_idx).strip().lower()
             if sender:
                 if sender not in pending_by_account:
                     pending_by_account[sender] = []
@@ -94,57 +92,86 @@ def send_outreach_emails():
 
     print(f"📊 Found pending tasks for {len(pending_by_account)} accounts.")
 
-    # Pass 2: Process by Group
-    for sender_account, row_indices in pending_by_account.items():
-        print(f"\n🔄 Switching to account: {sender_account}")
+    # Pass 2: Prepare each account's batch
+    services = {}
+    batches = {} # {account_email: [row_index, ...]}
+    prepared = {} # {row_index: (client_email, message)}; rendered ahead of the send slots
+    leases = [] # one run at a time per account: overlapping runs would send the same rows
+    try:
+        for sender_account, row_indices in pending_by_account.items():
+            print(f"\n🔄 Preparing account: {sender_account}")
+
+            lease = Lease(f"outreach-{sender_account}")
+            if not lease.acquire():
+                print(f"⏭️ Another run is already sending outreach from {sender_account}. Skipping batch.")
+                continue
+            leases.append(lease)
         
-        current_service = get_service_for_email(sender_account)
-        if not current_service:
-            print(f"⚠️ Token not found for {sender_account}. Skipping batch.")
-            continue
+            current_service = get_service_for_email(sender_account)
+            if not current_service:
+                print(f"⚠️ Token not found for {sender_account}. Skipping batch.")
+                continue
+
+            # Already sent (journal) but the "Sent" cell never landed: fix the cell, don't resend
+            unsent = []
+            for row_idx in row_indices:
+                if journal.already_sent(sender_account, leads.cell(row_idx, email_col_idx), 'outreach'):
+                    print(f"   ↩️ Row {row_idx} already sent today (journal). Marking as Sent.")
+                    sheet.update_cell(row_idx, status_col_idx + 1, "Sent")
+                else:
+                    unsent.append(row_idx)
+            row_indices = unsent
+            if not row_indices:
+                continue
             
-        # Batch Limit
-        batch_indices = row_indices[:MAX_EMAILS_PER_ACCOUNT_PER_RUN]
-        print(f"   Processing {len(batch_indices)} emails (Limit: {MAX_EMAILS_PER_ACCOUNT_PER_RUN}).")
+            # Batch Limit
+            batch_indices = row_indices[:MAX_EMAILS_PER_ACCOUNT_PER_RUN]
+            print(f"   Queued {len(batch_indices)} emails (Limit: {MAX_EMAILS_PER_ACCOUNT_PER_RUN}).")
         
-        sender_signature = get_sender_signature(sender_account)
+            services[sender_account] = current_service
+            batches[sender_account] = batch_indices
 
-        for i, row_idx in enumerate(batch_indices):
-            row = rows[row_idx - 1]
-            client_email = row[email_col_idx]
-            client_name = row[name_col_idx]
-            
             # Construct Content
-            subject = f"Quick idea for {client_name}"
-            body = f"""Hi {client_name},
-
-I’ve been following {client_name} for a while and I genuinely love the work you are doing in the {row[skill_col_idx]} space. Your recent posts really caught my eye! 🔥
-
-I noticed a small opportunity to help you stand out even more.
-
-I am currently building a few premium case studies for my portfolio, and I’d love to include your brand.
-
-Usually, for a project like this, I charge around {row[first_price_col_idx]}, but since I really want to add your logo to my portfolio, I can offer you a generic "Case Study" partner price of just {row[offer_price_col_idx]}.
-
-This would include: ✅ Premium {row[skill_col_idx]} ✅ {row[free_gift_col_idx]} (My treat!) ✅ Unlimited Revisions
-
-You can check my best work here: {row[portfolio_col_idx]}
-
-No pressure at all—just thought it would be a great fit. Are you open to a quick 5-min chat to discuss?
-
-Best regards, {sender_signature}"""
-
-            print(f"   Sending ({i+1}/{len(batch_indices)}) to {client_email}...")
-            if send_email(current_service, client_email, subject, body):
-                worksheet.update_cell(row_idx, status_col_idx + 1, "Sent")
-                
-                # Rate Limit (45-90s)
-                if i < len(batch_indices) - 1:
-                    sleep_time = random.randint(45, 90)
-                    print(f"      Sleeping for {sleep_time}s...")
-                    time.sleep(sleep_time)
-            
-        print(f"   ✅ Finished batch for {sender_account}.")
+            sender_signature = get_sender_signature(sender_account)
+            for row_idx in batch_indices:
+                row = leads.row(row_idx)
+                client_email = row[email_col_idx]
+                subject, body = OUTREACH.render(
+                    client_name=row[name_col_idx],
+                    skill=row[skill_col_idx],
+                    first_price=row[first_price_col_idx],
+                    offer_price=row[offer_price_col_idx],
+                    free_gift=row[free_gift_col_idx],
+                    portfolio=row[portfolio_col_idx],
+                    signature=sender_signature)
+                prepared[row_idx] = (client_email, render_email(client_email, subject, body))
+
+        # Pass 3: Send, interleaved across accounts.
+        # Each account keeps its own 45-90s window, so no mailbox sends faster than before,
+        # but one account's wait is spent sending from the others.
+        remaining = {account: len(indices) for account, indices in batches.items()}
+        for sender_account, row_idx in interleave(batches, OUTREACH_PACING):
+            current_service = services[sender_account]
+            batch_size = len(batches[sender_account])
+            remaining[sender_account] -= 1
+
+            client_email, message = prepared[row_idx]
+
+            print(f"   Sending ({batch_size - remaining[sender_account]}/{batch_size}) from {sender_account} to {client_email}...")
+            if send_prepared(current_service, client_email, message):
+                journal.record(sender_account, client_email, 'outreach')
+                sheet.update_cell(row_idx, status_col_idx + 1, "Sent")
+                OUTREACH_PACING.mark_sent(sender_account)
+
+            if remaining[sender_account] == 0:
+                # Checkpoint: write this account's "Sent" cells in one go
+                sheet.flush()
+                print(f"   ✅ Finished batch for {sender_account}.")
+    finally:
+        # A wave cut short (daemon pacing, shutdown) still writes its "Sent" cells before letting go
+        sheet.flush()
+        for lease in leases:
+            lease.release()
 
 if __name__ == "__main__":
     send_outreach_emails()
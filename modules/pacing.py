@@ -0,0 +1,100 @@
+"""
+Per-account send pacing.
+
+In a one-shot run a stage sleeps until an account's window opens. In
+daemon mode (set_blocking(False)) it never sleeps: a send that isn't due
+yet is left for later, the pacer remembers which accounts have such
+sends (deferred), and the daemon reruns the stage once one is due. Either
+way stop() (SIGTERM) ends a wave at the next send.
+"""
+import time
+import random
+import threading
+from collections import deque
+
+_blocking = True
+stopping = threading.Event()
+_pacers = []
+
+def set_blocking(blocking):
+    global _blocking
+    _blocking = blocking
+
+def stop():
+    """Shutdown: pending and future waits return False right away."""
+    stopping.set()
+
+def pacers():
+    return list(_pacers)
+
+class SendPacer:
+    """
+    Keeps a separate jittered pacing window per Gmail account.
+    After a send from an account, its next send is allowed only after a
+    random gap of min_gap..max_gap seconds; other accounts are not held up.
+    `stage` names the stage whose sends it paces (see modules.daemon).
+    """
+    def __init__(self, min_gap, max_gap, stage=None):
+        self.min_gap = min_gap
+        self.max_gap = max_gap
+        self.stage = stage
+        self.next_slot = {} # {account: monotonic time}
+        self.deferred = set() # accounts with a send left for later (non-blocking mode)
+        self.lock = threading.Lock()
+        _pacers.append(self)
+
+    def ready_in(self, account):
+        """Seconds until this account may send again (0 if it may send now)."""
+        with self.lock:
+            return max(0.0, self.next_slot.get(account, 0.0) - time.monotonic())
+
+    def wait(self, account):
+        """
+        Blocks until this account's window opens and returns True. Returns
+        False if the send should be left for a later run instead: the window
+        isn't open yet in non-blocking mode, or shutdown has started.
+        """
+        delay = self.ready_in(account)
+        if delay > 0:
+            if not _blocking:
+                with self.lock:
+                    self.deferred.add(account)
+                return False
+            print(f"      Sleeping for {delay:.0f}s ({account})...")
+            if stopping.wait(delay):
+                return False
+        return not stopping.is_set()
+
+    def due(self):
+        """True once an account with a deferred send may send again."""
+        now = time.monotonic()
+        with self.lock:
+            return any(self.next_slot.get(account, 0.0) <= now for account in self.deferred)
+
+    def take_deferred(self):
+        """Clears the deferred accounts (the stage is about to run again)."""
+        with self.lock:
+            self.deferred.clear()
+
+    def mark_sent(self, account):
+        gap = random.uniform(self.min_gap, self.max_gap)
+        with self.lock:
+            self.next_slot[account] = time.monotonic() + gap
+
+def interleave(queues, pacer):
+    """
+    Yields (account, item) from {account: [items]} across all accounts,
+    always picking the account whose window opens first, and sleeping only
+    when no account is ready. Call pacer.mark_sent(account) after a
+    successful send to start that account's next window. Stops early when
+    pacer.wait() says to (non-blocking mode, or shutdown).
+    """
+    queues = {account: deque(items) for account, items in queues.items() if items}
+    while queues:
+        account = min(queues, key=pacer.ready_in)
+        if not pacer.wait(account):
+            return
+        item = queues[account].popleft()
+        if not queues[account]:
+            del queues[account]
+        yield account, item
@@ -1,106 +1,50 @@
 import os
-import random
-import json
-import time
-import base64
 import re
-import io
-from PIL import Image
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-from email.mime.base import MIMEBase
-from email import encoders
-from email.utils import parseaddr
-import google.generativeai as genai
-from modules.services import get_gspread_client, get_service_for_email
-
-# Configure Gemini
-gemini_keys_env = os.getenv("GEMINI_API_KEY")
-if gemini_keys_env:
-    keys = [k.strip() for k in gemini_keys_env.split(',') if k.strip()]
-    if keys:
-        selected_key = random.choice(keys)
-        genai.configure(api_key=selected_key)
-        print(f"🔑 Gemini configured with 1 of {len(keys)} keys.")
-    else:
-        print("❌ Error: GEMINI_API_KEY provided but contains no valid keys.")
-else:
-    print("❌ Error: GEMINI_API_KEY not found in environment.")
-
-def get_email_body(payload):
-    """Recursively attempts to find the text/plain part of the email body."""
-    parts = payload.get('parts')
-    if not parts:
-        data = payload.get('body').get('data')
-        if data:
-            return base64.urlsafe_b64decode(data).decode()
-    else:
-        for part in parts:
-            if part['mimeType'] == 'text/plain':
-                data = part.get('body').get('data')
-                if data:
-                    return base64.urlsafe_b64decode(data).decode()
-            elif part.get('parts'):
-                return get_email_body(part)
-    return ""
-
-def get_image_data_from_part(service, user_id, msg_id, part):
-    """Helper to fetch image data from a message part."""
-    if 'body' in part and 'attachmentId' in part['body']:
-        att_id = part['body']['attachmentId']
-        att = service.users().messages().attachments().get(userId=user_id, messageId=msg_id, id=att_id).execute()
-        data = att['data']
-    elif 'body' in part and 'data' in part['body']:
-        data = part['body']['data']
-    else:
-        return None
-    
-    if data:
-        file_data = base64.urlsafe_b64decode(data.encode('UTF-8'))
-        return Image.open(io.BytesIO(file_data))
-    return None
-
-def find_images(service, user_id, msg_id, payload):
-    """Recursively find and fetch images."""
-    found_images = []
-    parts = payload.get('parts')
-    if not parts:
-        if payload.get('mimeType', '').startswith('image/'):
-            img = get_image_data_from_part(service, user_id, msg_id, payload)
-            if img: found_images.append(img)
-    else:
-        for part in parts:
-            if part.get('mimeType', '').startswith('image/'):
-                img = get_image_data_from_part(service, user_id, msg_id, part)
-                if img: found_images.append(img)
-            elif part.get('parts'):
-                found_images.extend(find_images(service, user_id, msg_id, part))
-    return found_images
+from modules.services import get_service_for_email, verify_account
+from modules.sheet import load_sheet_snapshot
+from modules.workers import run_per_account
+from modules.gmail_batch import MessageCache, LabelQueue, iter_parts, GMAIL_BATCH_SIZE, BATCH_MODIFY_SIZE
+from modules.inbox_sync import open_inbox_pass, chunked
+from modules.pacing import SendPacer
+from modules.lease import leased
+from modules import journal
+from modules import llm, vision_cache, classifier, email_text
+from modules.images import find_images
+from modules.messages import PAYMENT_REQUEST, PAYMENT_QR_PATH, AGREEMENT_REPLY, render_email
+
+PAYMENT_REQUEST_PACING = SendPacer(3, 3, stage='replier')
+# Statuses where a plain "yes" means yes to the offer (later on it could be about anything)
+AGREEMENT_STATUSES = {'', 'Sent', 'Followed Up', 'Negotiating'}
+# Most tokens a sales prompt may take; the client's message is clipped to fit
+PROMPT_TOKEN_BUDGET = int(os.getenv("REPLY_PROMPT_TOKEN_BUDGET", "1000"))
+
+def has_image_parts(payload):
+    """True if the message carries an image, without downloading it."""
+    return any(part.get('mimeType', '').startswith('image/') for part in iter_parts(payload))
+
+def sales_prompt(sender_display_name, client_name, skill, offer_price, free_gift, email_body):
+    """The sales closer prompt for one inbound message."""
+    return f"""You are an elite Sales Closer for {sender_display_name}. You do not just 'answer questions' — you overcome objections and close deals. You are speaking to {client_name} about {skill}.
+
+The Deal: Special price of {offer_price} (includes {free_gift}).
+The User Said: "{email_body}"
+
+Strategy:
+1. Language: Reply in the SAME language as the user (DETECT IT).
+2. Negotiation Phase: If they argue price -> Defend value, Sell ROI, Create Urgency.
+3. Closing Phase (CRITICAL): If they AGREE (say 'Yes', 'Okay', 'Agreed', 'Send link') -> DO NOT ask for money. 
+   - Say EXACTLY: "{AGREEMENT_REPLY}"
+4. Handoff Phase: If they send the details (Brand Name, Colors) -> You MUST start your response with the tag: [[ORDER_CONFIRMED]].
+   - Reply Content: "[[ORDER_CONFIRMED]] Perfect! I have locked in your details for the Brand Name. Timeline: You will receive the first draft in exactly 2 Days (48 Hours). One last thing: Is there anything else specific or any new idea you want to add before we start designing?"
+5. Tone: Professional, Enthusiastic, Deal-Closing.
+6. Keep it under 100 words.
+7. Sign-off: "Best regards, {sender_display_name}"
+"""
 
 def create_message(sender, to, subject, message_text, thread_id=None, attachment_path=None):
-    """Create a message for an email."""
-    message = MIMEMultipart()
-    message['to'] = to
-    message['from'] = sender
-    message['subject'] = subject
-    if thread_id:
-        message['threadId'] = thread_id
-
-    message.attach(MIMEText(message_text))
-
-    if attachment_path and os.path.exists(attachment_path):
-        content_type, encoding = 'application/octet-stream', None
-        main_type, sub_type = content_type.split('/', 1)
-        with open(attachment_path, 'rb') as fp:
-            msg = MIMEBase(main_type, sub_type)
-            msg.set_payload(fp.read())
-        encoders.encode_base64(msg)
-        filename = os.path.basename(attachment_path)
-        msg.add_header('Content-Disposition', 'attachment', filename=filename)
-        message.attach(msg)
-        
-    raw = base64.urlsafe_b64encode(message.as_bytes()).decode()
-    return {'raw': raw, 'threadId': thread_id} if thread_id else {'raw': raw}
+    """Create a message for an email (static attachments are encoded once per process)."""
+    return render_email(to, subject, message_text, sender=sender, thread_id=thread_id,
+                        attachments=[attachment_path] if attachment_path else ())
 
 def send_message(service, user_id, message):
     """Send an email message."""
@@ -126,13 +70,21 @@ def get_sender_display_name(email_address):
     except Exception:
         return "Solanki Art"
 
-def check_last_sender_is_me(service, thread_id, my_email):
+def check_last_sender_is_me(service, thread_id, my_email, cache=None):
     """
     Fetches the thread and checks if the very last message is from 'me'.
     Returns True if I was the last sender.
+    With a MessageCache the (batch-prefetched) thread is reused, and a
+    thread we already replied to this run counts as ours (see
+    answered_this_run for messages newer than that reply).
     """
     try:
-        thread = service.users().threads().get(userId='me', id=thread_id).execute()
+        if cache:
+            if thread_id in cache.replied_threads:
+                return True
+            thread = cache.thread(thread_id)
+        else:
+            thread = service.users().threads().get(userId='me', id=thread_id).execute()
         messages = thread.get('messages', [])
         if not messages:
             return False
@@ -157,341 +109,469 @@ def check_last_sender_is_me(service, thread_id, my_email):
         print(f"      ⚠️ Warning: Could not check thread history: {e}")
         return False
 
-def process_replies():
+def answered_this_run(cache, thread_id, msg_ids):
+    """
+    Splits a thread's unread messages into those a reply sent earlier this
+    run already answered and those newer than the newest message it did.
+    An earlier chunk may hold part of a thread (history mode lists oldest
+    first): the later messages still need an answer, even though our reply
+    is now the thread's last message. (None, msg_ids) if we haven't replied.
+    """
+    answered_at = cache.replied_threads.get(thread_id)
+    if answered_at is None:
+        return None, msg_ids
+    newer = [m for m in msg_ids if int(cache.metadata[m].get('internalDate', 0)) > answered_at]
+    return [m for m in msg_ids if m not in newer], newer
+
+def is_unread(msg):
+    return 'UNREAD' in msg.get('labelIds', ['UNREAD'])
+
+def get_sender_email(payload):
+    """Lower-cased address from the From header, or None."""
+    headers_list = payload.get('headers', [])
+    sender_header = next((h['value'] for h in headers_list if h['name'] == 'From'), None)
+    if not sender_header:
+        return None
+    if '<' in sender_header:
+        sender_header = sender_header.split('<')[1].split('>')[0]
+    return sender_header.strip().lower()
+
+def process_replies(sheet=None):
     print("Running Replier Bot (Aggressive Sales & Continuous Loop)...")
     
-    # 1. Connect to Sheet
-    gc = get_gspread_client()
-    SHEET_ID = '1N3_jJkYNCtp1MQXEObtDH9FC_VzPyL2RLBW_MdfvfCM'
-    
-    try:
-        sh = gc.open_by_key(SHEET_ID)
-        worksheet = sh.sheet1
-    except Exception as e:
-        print(f"❌ Error connecting to Sheet: {e}")
-        return
+    # 1. Connect to Sheet (reuse the run's snapshot when given one)
+    if sheet is None:
+        sheet = load_sheet_snapshot()
+        if sheet is None:
+            return
 
     # Get Sheet Data
-    rows = worksheet.get_all_values()
+    rows = sheet.rows
     if not rows:
         print("❌ Sheet is empty.")
         return
         
-    headers = rows[0]
+    leads = sheet.leads
+    schema = sheet.schema
     try:
-        email_col_idx = headers.index('Email')
-        status_col_idx = headers.index('Status')
-        name_col_idx = headers.index('Client Name')
-        gmail_col_idx = headers.index('Gmail Account')
-        skill_col_idx = headers.index('Selected Skill')
-        offer_price_col_idx = headers.index('Offer Price')
-        final_price_col_idx = headers.index('Final Price') 
-        portfolio_col_idx = headers.index('Portfolio Link')
-        free_gift_col_idx = headers.index('Free Gift')
-        
-        try:
-            payment_status_col_idx = headers.index('Payment Status')
-        except ValueError:
-             payment_status_col_idx = 20 # Fallback
-             
+        email_col_idx = schema.index('Email')
+        status_col_idx = schema.index('Status')
+        name_col_idx = schema.index('Client Name')
+        skill_col_idx = schema.index('Selected Skill')
+        offer_price_col_idx = schema.index('Offer Price')
+        final_price_col_idx = schema.index('Final Price') 
+        portfolio_col_idx = schema.index('Portfolio Link')
+        free_gift_col_idx = schema.index('Free Gift')
     except ValueError as e:
         print(f"❌ Missing column in sheet: {e}")
         return
 
+    # Optional columns (fall back to their usual sheet position, see leads.DEFAULT_COLUMNS)
+    payment_status_col_idx = schema.get('Payment Status')
+    delivery_status_col_idx = schema.get('Delivery Status')
+    delivery_date_col_idx = schema.get('Delivery Date')
+    final_link_col_idx = schema.get('Final Drive Link')
+
     # 2. Identify Unique Accounts (Column B)
-    unique_accounts = set()
-    for row in rows[1:]:
-        if len(row) > gmail_col_idx:
-            acc = row[gmail_col_idx].strip().lower()
-            if acc:
-                unique_accounts.add(acc)
+    unique_accounts = leads.accounts()
     
     print(f"📋 Found {len(unique_accounts)} unique Gmail accounts to process.")
 
-    # 3. Loop by Account
-    for current_account in unique_accounts:
+    # 3. One worker per Account
+    def handle_account(current_account):
         print(f"\n🔄 Switching to account: {current_account}")
         
         # Login
         gmail_service = get_service_for_email(current_account)
         if not gmail_service:
             print(f"⚠️ Token not found for {current_account}. Skipping.")
-            continue
+            return
             
-        # Verify Identity (Safety Check)
-        try:
-             profile = gmail_service.users().getProfile(userId='me').execute()
-             logged_in_email = profile.get('emailAddress').lower()
-             if logged_in_email != current_account:
-                 print(f"❌ Mismatch! Logged in as {logged_in_email}, but expected {current_account}. Skipping safely.")
-                 continue
-        except Exception as e:
-            print(f"❌ Error verifying identity for {current_account}: {e}")
-            continue
+        # Verify Identity (Safety Check; done once per process and reused)
+        if not verify_account(current_account):
+            return
             
         # 1. Derive Name from Email (Dynamic Signature)
         sender_display_name = get_sender_display_name(current_account)
         print(f"   ✍️  Signature for this batch: '{sender_display_name}'")
 
-        # Build Whitelist for THIS Account (Sent OR Negotiating)
+        # Build Whitelist for THIS Account (Sent OR Negotiating) from the account index
         valid_clients = {} # {client_email: row_index}
-        for i, row in enumerate(rows[1:], start=2):
-            if len(row) > gmail_col_idx and row[gmail_col_idx].strip().lower() == current_account:
-                # Check Status
-                if len(row) > status_col_idx:
-                    current_status = row[status_col_idx].strip()
-                    print(f"Checking emails for {row[email_col_idx]} | Status: {current_status}")
-                    
-                    # "Super Power" Logic: Process EVERYONE unless the deal is closed/stopped.
-                    if current_status not in ['Ordered', 'Opt-out', 'Payment Done']:
-                        # Add to whitelist
-                        if len(row) > email_col_idx:
-                            c_email = str(row[email_col_idx]).strip().lower()
-                            if c_email:
-                                valid_clients[c_email] = i
+        for i in leads.find(account=current_account):
+            row = leads.row(i)
+            # Check Status
+            if len(row) > status_col_idx:
+                current_status = row[status_col_idx].strip()
+                print(f"Checking emails for {row[email_col_idx]} | Status: {current_status}")
+                
+                # "Super Power" Logic: Process EVERYONE unless the deal is closed/stopped.
+                if current_status not in ['Ordered', 'Opt-out', 'Payment Done']:
+                    # Add to whitelist
+                    if len(row) > email_col_idx:
+                        c_email = str(row[email_col_idx]).strip().lower()
+                        if c_email:
+                            valid_clients[c_email] = i
 
         # --- PRIORITY CHECK: PAYMENT REQUEST (Proactive) ---
         # Logic: If 'Design Ready' AND 'Payment Status' is empty -> Send Email with QR Code
-        for i, row in enumerate(rows[1:], start=2):
-            # Account Check (Strict)
-            if len(row) > gmail_col_idx:
-                 row_account = row[gmail_col_idx].strip().lower()
-                 if row_account != current_account:
-                     continue
-            else:
-                 continue
-
-            if len(row) > status_col_idx and len(row) > payment_status_col_idx:
-                p_status = row[status_col_idx].strip()
-                p_payment = row[payment_status_col_idx].strip()
-                
-                # Check for Link (ensure it's generated)
-                try: 
-                    final_link_col_idx = headers.index('Final Drive Link')
-                    final_link = row[final_link_col_idx].strip()
-                except: 
-                    final_link = "Check Sheet" # Fallback if column missing
-
-                if p_status == 'Design Ready' and (not p_payment):
-                    client_email_p = row[email_col_idx].strip()
-                    print(f"💰 Sending Payment Request to {client_email_p}...")
-                    
-                    # Content
-                    subject_p = "Your Order is Ready! (Payment Required)"
-                    body_p = (
-                        f"Hi {row[name_col_idx]},\n\n"
-                        "Great news! Your design is completely ready and it looks fantastic.\n\n"
-                        "To get the final editable files and drive link, please complete the pending payment of $279.\n\n"
-                        "UPI ID: solankiart218@okaxis\n"
-                        "(Please scan the attached QR Code)\n\n"
-                        "IMPORTANT: Please reply to this email with a Screenshot of your payment so we can release the files immediately.\n\n"
-                        "Best regards,\n"
-                        f"{sender_display_name}"
-                    )
-                    
-                    # Attach payment.png
-                    att_path = 'payment.png'
-                    msg_obj_p = create_message(current_account, client_email_p, subject_p, body_p, attachment_path=att_path)
-                    
-                    if send_message(gmail_service, 'me', msg_obj_p):
-                        worksheet.update_cell(i, payment_status_col_idx + 1, "Payment Pending")
-                        print(f"   ✅ Payment Request sent to {client_email_p}. Status: Payment Pending")
-                        # Add short sleep to not hit limits
-                        time.sleep(3)
+        # (Strict account check is part of the index lookup)
+        # Render the whole wave first (QR code is encoded once per process), then send on the pacing slots
+        payment_requests = []
+        for i in leads.find(account=current_account, status='Design Ready', payment=''):
+            row = leads.row(i)
+            client_email_p = row[email_col_idx].strip()
+            # Already sent (journal) but the status cell never landed: fix it, don't resend
+            if journal.already_sent(current_account, client_email_p, 'payment_request'):
+                print(f"↩️ Payment Request to {client_email_p} already sent today (journal). Marking as Payment Pending.")
+                sheet.update_cell(i, payment_status_col_idx + 1, "Payment Pending")
+                continue
+            subject_p, body_p = PAYMENT_REQUEST.render(client_name=row[name_col_idx], signature=sender_display_name)
+            # Attach payment.png
+            msg_obj_p = create_message(current_account, client_email_p, subject_p, body_p, attachment_path=PAYMENT_QR_PATH)
+            payment_requests.append((i, client_email_p, msg_obj_p))
+
+        for i, client_email_p, msg_obj_p in payment_requests:
+            # Short per-account gap to not hit limits
+            if not PAYMENT_REQUEST_PACING.wait(current_account):
+                break # not due yet (daemon) or shutting down: the rest go out on a later run
+            print(f"💰 Sending Payment Request to {client_email_p}...")
+            if send_message(gmail_service, 'me', msg_obj_p):
+                journal.record(current_account, client_email_p, 'payment_request')
+                sheet.update_cell(i, payment_status_col_idx + 1, "Payment Pending")
+                print(f"   ✅ Payment Request sent to {client_email_p}. Status: Payment Pending")
+                PAYMENT_REQUEST_PACING.mark_sent(current_account)
 
         if not valid_clients:
-            continue
+            return
 
-        # Check Inbox
+        def is_payment_pending(client_email):
+            return leads.cell(valid_clients[client_email], payment_status_col_idx) == "Payment Pending"
+
+        # Check Inbox (only what arrived since the last checkpoint, when we have one)
         try:
-            results = gmail_service.users().messages().list(userId='me', labelIds=['UNREAD'], q='-category:promotions -category:social').execute()
-            messages = results.get('messages', [])
+            inbox = open_inbox_pass(gmail_service, current_account)
         except Exception as e:
             print(f"   xxxx Error checking inbox: {e}")
-            continue
-            
-        if not messages:
-            continue
-            
-        print(f"   ↳ Found {len(messages)} unread messages. Processing...")
+            return
 
-        # Process Messages
-        for msg in messages:
-            try:
-                msg_detail = gmail_service.users().messages().get(userId='me', id=msg['id']).execute()
-                payload = msg_detail['payload']
-                headers_list = payload.get('headers', [])
-                thread_id = msg_detail.get('threadId')
-                
-                sender_header = next((h['value'] for h in headers_list if h['name'] == 'From'), None)
-                if not sender_header: continue
-                
-                # Extract Email
-                if '<' in sender_header:
-                    from_email = sender_header.split('<')[1].split('>')[0]
-                else:
-                    from_email = sender_header
-                from_email = from_email.strip().lower()
-
-                # CHECK WHITELIST (Continuous Conversation Logic)
-                if from_email in valid_clients:
-                    print(f"   ✅ MATCH: {from_email}")
-                    
-                    # --- CRITICAL: Thread Check (Prevent Double Reply) ---
-                    if check_last_sender_is_me(gmail_service, thread_id, current_account):
-                        print("      ✋ Last message was from ME. Waiting for client. Skipping.")
-                        # Mark read anyway? No, keep unread if I want to be reminded? 
-                        # Actually, if I sent the last one, why is this unread? 
-                        # Maybe the client sent 2 emails. The first one I replied to. The second one (this one) is later?
-                        # If check_last_sender_is_me returns True, it means my reply is the LATEST.
-                        # So this unread message is BEHIND my reply.
-                        # So I should mark this 'old' unread message as read to clear queue.
-                        gmail_service.users().messages().modify(userId='me', id=msg['id'], body={'removeLabelIds': ['UNREAD']}).execute()
-                        continue
-                    # -----------------------------------------------------
-
-                    row_idx = valid_clients[from_email]
-                    row_data = rows[row_idx - 1]
-                    
-                    # 3. Data Extraction (Know the Product)
-                    client_name = row_data[name_col_idx]
-                    skill = row_data[skill_col_idx]
-                    offer_price = row_data[offer_price_col_idx]
-                    free_gift = row_data[free_gift_col_idx]
-                    
-                    # Get Body
-                    email_body = get_email_body(payload)
-                    lower_body = email_body.lower()
-                    
-                    # 4. Hard-Coded Negative Filter (Stop Logic)
-                    stop_keywords = ["stop", "unsubscribe", "remove", "not interested", "spam", "no thanks"]
-                    if any(keyword in lower_body for keyword in stop_keywords):
-                         print("      ⛔ OPT-OUT DETECTED. Marking as 'Opt-out'.")
-                         worksheet.update_cell(row_idx, status_col_idx + 1, "Opt-out")
-                         # Mark as read
-                         gmail_service.users().messages().modify(userId='me', id=msg['id'], body={'removeLabelIds': ['UNREAD']}).execute()
-                         continue
-                    # -------------------------------
-
-                    images = find_images(gmail_service, 'me', msg['id'], payload)
-                    subject = next((h['value'] for h in headers_list if h['name'] == 'Subject'), "Re: Conversation")
-
-                    print(f"      🧠 Generating AGGRESSIVE Sales Reply for {client_name}...")
-                    model = genai.GenerativeModel('gemini-2.5-flash')
-                    
-                    intent = "Negotiating"
-                    new_status = "Negotiating"
-
-                    # Vision Logic (Payment Check)
-                    # Vision Logic (Payment Verification)
-                    # Condition: Payment Status is 'Payment Pending' AND Image exists
-                    p_status_check = row_data[payment_status_col_idx] if len(row_data) > payment_status_col_idx else ""
-                    
-                    if images and p_status_check == "Payment Pending":
-                        print(f"      🖼️ Analyzing Payment Screenshot for {client_name}...")
-                        prompt = ["Is this a valid payment screenshot for a successful transaction? Answer strictly with YES or NO.", images[0]]
-                        
-                        try:
-                            # Delivery Columns
+        # Messages are pulled lazily and handled one batch-sized chunk at a time.
+        cache = MessageCache(gmail_service)
+        # Read labels are queued and applied in bulk at checkpoints (see flush_labels)
+        labels = LabelQueue(gmail_service)
+        failed = set() # messages this pass could not handle; offered again next run
+
+        def flush_labels():
+            # Sheet first: a message is only marked read once the status it changed has landed
+            sheet.flush()
+            return labels.flush()
+
+        try:
+            for messages in chunked(inbox, GMAIL_BATCH_SIZE):
+                print(f"   ↳ Found {len(messages)} unread messages. Processing...")
+
+                # Two-phase triage (batched):
+                # Phase 1: headers only (From/Subject/thread) for every unread message.
+                # Phase 2: full bodies and thread history for whitelisted senders only,
+                # plus image attachments only where a payment screenshot is expected.
+                cache.prefetch_metadata([m['id'] for m in messages])
+                matched = [m['id'] for m in messages
+                           if m['id'] in cache.metadata and is_unread(cache.metadata[m['id']])
+                           and get_sender_email(cache.metadata[m['id']]['payload']) in valid_clients]
+                cache.prefetch_messages(matched)
+                cache.prefetch_threads({cache.metadata[m]['threadId'] for m in matched})
+
+                # Payment screenshots: only the first image of a payment-pending message is
+                # ever checked. Fetch those in one batch and decode/downscale them in the background.
+                screenshot_refs = {}
+                for m in matched:
+                    if m in cache.messages and is_payment_pending(get_sender_email(cache.metadata[m]['payload'])):
+                        refs = find_images(m, cache.messages[m]['payload'])
+                        for ref in refs:
+                            if ref.too_large:
+                                print(f"   ⚠️ Skipping {ref.size // 1024} KB image in message {m} (over the size cap).")
+                        usable = [ref for ref in refs if not ref.too_large]
+                        if usable:
+                            screenshot_refs[m] = usable[0]
+                cache.prefetch_attachments([ref.key for ref in screenshot_refs.values() if ref.key])
+                screenshots = {}
+                for m, ref in screenshot_refs.items():
+                    try:
+                        screenshots[m] = ref.load(gmail_service, cache)
+                    except Exception as e:
+                        print(f"   ⚠️ Could not read image in message {m}: {e}")
+
+                # Stage 1 (triage): group the chunk's unread messages by thread, decide what
+                # each thread needs and queue its Gemini call on the shared pool, so
+                # generation runs in parallel with the rest. A client who sent three quick
+                # emails gets one look at the thread, one generation and one reply.
+                thread_groups = {} # {thread_id: [msg_id]} unread messages from whitelisted senders
+                for msg in messages:
+                    try:
+                        msg_meta = cache.message_metadata(msg['id'])
+                        if is_unread(msg_meta) and get_sender_email(msg_meta['payload']) in valid_clients:
+                            thread_groups.setdefault(msg_meta['threadId'], []).append(msg['id'])
+                    except Exception as e:
+                        print(f"   Error processing message: {e}")
+                        failed.add(msg['id'])
+
+                jobs = []
+                batch_shots = {} # {sha256: {'client', 'job'}} screenshots sent to the model in this batch
+                for thread_id, msg_ids in thread_groups.items():
+                    try:
+                        # Oldest first; the newest message is the one we answer
+                        msg_ids.sort(key=lambda m: int(cache.metadata[m].get('internalDate', 0)))
+                        from_email = get_sender_email(cache.metadata[msg_ids[-1]]['payload'])
+                        print(f"   ✅ MATCH: {from_email}" + (f" ({len(msg_ids)} unread messages in one thread)" if len(msg_ids) > 1 else ""))
+
+                        # Answered by an earlier run that stopped before marking them as read
+                        journaled = [m for m in msg_ids if journal.already_sent(current_account, from_email, f"reply:{m}")]
+                        if journaled:
+                            print(f"      ✋ Already replied to {len(journaled)} of these (journal). Marking as read.")
+                            labels.mark_read(journaled)
+                            msg_ids = [m for m in msg_ids if m not in journaled]
+                            if not msg_ids:
+                                continue
+
+                        answered, msg_ids = answered_this_run(cache, thread_id, msg_ids)
+                        if answered:
+                            print(f"      ✋ Already answered {len(answered)} of these this run. Marking as read.")
+                            labels.mark_read(answered)
+                        if not msg_ids:
+                            continue
+
+                        # --- CRITICAL: Thread Check (Prevent Double Reply) ---
+                        if answered is None and check_last_sender_is_me(gmail_service, thread_id, current_account, cache):
+                            # My reply is the latest message in the thread, so these unread
+                            # messages are BEHIND it: mark them read to clear the queue.
+                            print("      ✋ Last message was from ME. Waiting for client. Skipping.")
+                            labels.mark_read(msg_ids)
+                            continue
+                        # -----------------------------------------------------
+
+                        row_idx = valid_clients[from_email]
+                        row_data = leads.row(row_idx)
+
+                        # 3. Data Extraction (Know the Product)
+                        client_name = row_data[name_col_idx]
+                        skill = row_data[skill_col_idx]
+                        offer_price = row_data[offer_price_col_idx]
+                        free_gift = row_data[free_gift_col_idx]
+
+                        # 4. Local pre-classifier, per message: the obvious cases never reach Gemini
+                        parts = []
+                        for m in msg_ids:
+                            payload = cache.message(m)['payload']
+                            headers_list = payload.get('headers', [])
+                            subject = next((h['value'] for h in headers_list if h['name'] == 'Subject'), "Re: Conversation")
+                            # Get Body: only what the client wrote this time (no quoted thread or signature)
+                            text = email_text.reply_text(email_text.body_text(payload))
+                            # Attachments are only downloaded for the payment check; elsewhere knowing they exist is enough
+                            parts.append({'msg_id': m, 'subject': subject, 'text': text, 'has_images': has_image_parts(payload),
+                                          'intent': classifier.classify(text, headers_list, subject)})
+
+                        if any(part['intent'] == classifier.OPT_OUT for part in parts):
+                             print("      ⛔ OPT-OUT DETECTED. Marking as 'Opt-out'.")
+                             sheet.update_cell(row_idx, status_col_idx + 1, "Opt-out")
+                             # Mark as read
+                             labels.mark_read(msg_ids)
+                             continue
+                        # Auto-replies and bare thank-yous add nothing to answer
+                        parts = [part for part in parts if part['has_images'] or part['intent'] not in (classifier.AUTO_REPLY, classifier.THANKS)]
+                        if not parts:
+                             print("      💤 Auto-reply or just a thank-you. Nothing to answer; marking as read.")
+                             labels.mark_read(msg_ids)
+                             continue
+                        # -------------------------------
+
+                        email_body = "\n\n".join(part['text'] for part in parts if part['text'])
+                        has_images = any(part['has_images'] for part in parts)
+                        job = {'msg_ids': msg_ids, 'thread_id': thread_id, 'from_email': from_email,
+                               'answered_at': int(cache.metadata[msg_ids[-1]].get('internalDate', 0)),
+                               'subject': parts[-1]['subject'], 'row_idx': row_idx, 'client_name': client_name,
+                               'offer_price': offer_price}
+
+                        # Vision Logic (Payment Check)
+                        # Vision Logic (Payment Verification)
+                        # Condition: Payment Status is 'Payment Pending' AND Image exists (the newest screenshot counts)
+                        p_status_check = row_data[payment_status_col_idx] if len(row_data) > payment_status_col_idx else ""
+                        shot_id = next((part['msg_id'] for part in reversed(parts) if part['msg_id'] in screenshots), None)
+                        images = []
+                        if has_images and p_status_check == "Payment Pending" and shot_id:
                             try:
-                                delivery_status_col_idx = headers.index('Delivery Status')
-                                delivery_date_col_idx = headers.index('Delivery Date')
-                            except:
-                                delivery_status_col_idx = 22
-                                delivery_date_col_idx = 21
-
-                            resp = model.generate_content(prompt)
-                            vision_text = resp.text.strip().upper()
-                            print(f"      🤖 Vision AI says: {vision_text}")
-                            
-                            if "YES" in vision_text:
-                                # SUCCESS: Deliver Files
-                                try: 
-                                    final_link_col_idx = headers.index('Final Drive Link')
-                                    final_link = row_data[final_link_col_idx].strip()
-                                except: 
-                                    final_link = "ERROR: Link not found in sheet."
-
-                                ai_reply_text = f"Payment Received! Thank you for your order. Here is your final drive link:\n{final_link}\n\nBest regards,\n{sender_display_name}"
-                                new_status = "Payment Done" # Should we change Status col too? User said Update Payment Status (Col U). 
-                                # User also said "Update Delivery Status (Col W) to 'Delivered'".
-                                
-                                # Updates
-                                worksheet.update_cell(row_idx, payment_status_col_idx + 1, "Payment Done")
-                                worksheet.update_cell(row_idx, delivery_status_col_idx + 1, "Delivered")
-                                
-                                import datetime
-                                current_date = datetime.datetime.now().strftime("%d/%m/%Y")
-                                worksheet.update_cell(row_idx, delivery_date_col_idx + 1, current_date)
-                                
-                                print("      🚀 FILES DELIVERED!")
-                                
+                                images = [screenshots[shot_id].result()]
+                            except Exception as e:
+                                print(f"      ⚠️ Could not decode the screenshot: {e}")
+
+                        if images and p_status_check == "Payment Pending":
+                            print(f"      🖼️ Analyzing Payment Screenshot for {client_name}...")
+                            job['kind'] = 'vision'
+                            # This exact file seen before? Reuse the verdict / catch reuse without a model call.
+                            fp = vision_cache.fingerprint(images[0])
+                            known = vision_cache.lookup(fp) or batch_shots.get(fp.sha256)
+                            if known is None:
+                                # A look-alike isn't proof: same app, same amount, even a failed payment
+                                # can be a few bits away. It is logged for a manual look and judged anyway.
+                                near = vision_cache.similar(fp)
+                                if near:
+                                    print(f"      🔎 Looks like a screenshot seen before (from {near['client']}, verdict {near['verdict']}). "
+                                          "Asking the model anyway; worth a manual look.")
+                                prompt = ["Is this a valid payment screenshot for a successful transaction? Answer strictly with YES or NO.", images[0]]
+                                job['fingerprint'] = fp
+                                job['future'] = llm.submit(prompt)
+                                batch_shots[fp.sha256] = {'client': from_email, 'job': job}
+                            elif known['client'] != from_email:
+                                print(f"      🚩 Screenshot was already submitted by another client ({known['client']}).")
+                                job['kind'] = 'reused'
+                            elif 'job' in known:
+                                # Sent twice in this batch: wait for the first copy's verdict
+                                job['future'] = known['job']['future']
                             else:
-                                # FAIL
-                                ai_reply_text = "We could not verify the payment from this screenshot. Please upload a clear screenshot of the successful transaction."
+                                print(f"      ♻️ Same screenshot as before. Reusing verdict: {known['verdict']}")
+                                job['verdict'] = known['verdict']
+                        elif has_images and p_status_check == "Payment Pending":
+                            # Screenshot too large or unreadable: leave it for a manual check
+                            job['kind'] = 'unverified'
+                        elif has_images:
+                             # Image sent but not in Payment Pending? Maybe new order reference.
+                             job['kind'] = 'image'
+                        elif all(part['intent'] == classifier.AGREEMENT for part in parts) and row_data[status_col_idx].strip() in AGREEMENT_STATUSES:
+                            # A plain yes: the closing reply is fixed, no model call needed
+                            print(f"      🤝 {client_name} agreed. Sending the closing reply.")
+                            job['kind'] = 'agreement'
+                        else:
+                            print(f"      🧠 Generating AGGRESSIVE Sales Reply for {client_name}...")
+                            # 5. Wolf of Wall Street Persona (Aggressive)
+                            # The client's words get whatever the prompt budget leaves, so long threads don't grow the prompt;
+                            # when several messages don't fit, the newest text is the part kept
+                            room = PROMPT_TOKEN_BUDGET - llm.estimate_tokens(sales_prompt(sender_display_name, client_name, skill, offer_price, free_gift, ""))
+                            prompt = sales_prompt(sender_display_name, client_name, skill, offer_price, free_gift, email_text.clip(email_body, room, keep_end=True))
+                            job['kind'] = 'sales'
+                            job['future'] = llm.submit(prompt)
+
+                        jobs.append(job)
+                    except Exception as e:
+                        print(f"   Error processing message: {e}")
+                        failed.update(msg_ids)
+
+                # Stage 2 (send): collect the generated replies in triage order and send them.
+                for job in jobs:
+                    try:
+                        row_idx = job['row_idx']
+                        client_name = job['client_name']
+
+                        if job['kind'] == 'vision':
+                            try:
+                                if 'verdict' in job:
+                                    vision_text = job['verdict']
+                                else:
+                                    vision_text = job['future'].result().upper()
+                                    print(f"      🤖 Vision AI says: {vision_text}")
+                                    if 'fingerprint' in job:
+                                        vision_cache.record(job['fingerprint'], "YES" if "YES" in vision_text else "NO", job['from_email'])
+                        
+                                if "YES" in vision_text:
+                                    # SUCCESS: Deliver Files
+                                    final_link = leads.cell(row_idx, final_link_col_idx).strip() or "ERROR: Link not found in sheet."
+
+                                    ai_reply_text = f"Payment Received! Thank you for your order. Here is your final drive link:\n{final_link}\n\nBest regards,\n{sender_display_name}"
+                                    new_status = "Payment Done" # Should we change Status col too? User said Update Payment Status (Col U). 
+                                    # User also said "Update Delivery Status (Col W) to 'Delivered'".
+                            
+                                    # Updates
+                                    sheet.update_cell(row_idx, payment_status_col_idx + 1, "Payment Done")
+                                    sheet.update_cell(row_idx, delivery_status_col_idx + 1, "Delivered")
+                            
+                                    import datetime
+                                    current_date = datetime.datetime.now().strftime("%d/%m/%Y")
+                                    sheet.update_cell(row_idx, delivery_date_col_idx + 1, current_date)
+                            
+                                    print("      🚀 FILES DELIVERED!")
+                            
+                                else:
+                                    # FAIL
+                                    ai_reply_text = "We could not verify the payment from this screenshot. Please upload a clear screenshot of the successful transaction."
+                                    new_status = "Payment Pending"
+                                    print("      ❌ Vision rejected the screenshot.")
+                            
+                            except Exception as e:
+                                print(f"      Vision Error: {e}")
+                                ai_reply_text = "I received the image but couldn't verify it automatically. Checking manually."
                                 new_status = "Payment Pending"
-                                print("      ❌ Vision rejected the screenshot.")
-                                
-                        except Exception as e:
-                            print(f"      Vision Error: {e}")
+                        elif job['kind'] == 'unverified':
                             ai_reply_text = "I received the image but couldn't verify it automatically. Checking manually."
                             new_status = "Payment Pending"
-                    elif images:
-                         # Image sent but not in Payment Pending? Maybe new order reference.
-                         ai_reply_text = "I received your image. Is this a reference for the design?"
-                         new_status = current_status # Keep existing
-                    else:
-                        # 5. Wolf of Wall Street Persona (Aggressive)
-                        prompt = f"""You are an elite Sales Closer for {sender_display_name}. You do not just 'answer questions' — you overcome objections and close deals. You are speaking to {client_name} about {skill}.
-
-The Deal: Special price of {offer_price} (includes {free_gift}).
-The User Said: "{email_body}"
+                        elif job['kind'] == 'reused':
+                            ai_reply_text = "This screenshot has already been used for another payment. Please upload a screenshot of your own successful transaction."
+                            new_status = "Payment Pending"
+                        elif job['kind'] == 'agreement':
+                            ai_reply_text = f"{AGREEMENT_REPLY}\n\nBest regards,\n{sender_display_name}"
+                            new_status = "Negotiating"
+                        elif job['kind'] == 'image':
+                             ai_reply_text = "I received your image. Is this a reference for the design?"
+                             new_status = leads.cell(row_idx, status_col_idx).strip() # Keep existing
+                        else:
+                            try:
+                                ai_reply_text = job['future'].result()
+                                if ai_reply_text.startswith("```"): ai_reply_text = ai_reply_text.replace("```","")
+                        
+                                new_status = "Negotiating" # Status Update
+                        
+                                # Secret Tag Logic (Order Confirmation)
+                                if "[[ORDER_CONFIRMED]]" in ai_reply_text:
+                                    print(f"      🎉 Order Confirmed for {client_name}!")
+                                    new_status = "Ordered"
+                                    ai_reply_text = ai_reply_text.replace("[[ORDER_CONFIRMED]]", "").strip()
+
+                            except Exception as e:
+                                print(f"      AI Error: {e}")
+                                ai_reply_text = f"Thanks for your interest, {client_name}. I can offer you a special price of {job['offer_price']}. Shall we proceed?\n\nBest regards,\n{sender_display_name}"
+                                new_status = "Negotiating"
+
+                        # Send Reply
+                        msg_obj = create_message(current_account, job['from_email'], job['subject'], ai_reply_text, thread_id=job['thread_id'])
+                        sent = send_message(gmail_service, 'me', msg_obj)
+                        if sent:
+                            # One reply answers every message in the group
+                            for msg_id in job['msg_ids']:
+                                journal.record(current_account, job['from_email'], f"reply:{msg_id}")
+                            cache.note_reply(job['thread_id'], job['answered_at'])
+                
+                        # Update Sheet
+                        sheet.update_cell(row_idx, status_col_idx + 1, new_status)
+                
+                        # Mark Read: the whole group together, once the reply is out
+                        if sent:
+                            labels.mark_read(job['msg_ids'])
+                        else:
+                            # Left unread for the next run
+                            failed.update(job['msg_ids'])
+                        print(f"      Reply Sent. Status: {new_status}")
+
+                    except Exception as e:
+                        print(f"   Error processing message: {e}")
+                        failed.update(job['msg_ids'])
+
+                # Keep memory flat across chunks (replied threads are remembered)
+                cache.release()
+                # A paged listing shrinks as messages are marked read, which would shift its page
+                # tokens: there the labels wait for the end of the pass
+                if len(labels) >= BATCH_MODIFY_SIZE and not inbox.paged:
+                    flush_labels()
+        finally:
+            # Checkpoint, also when the pass stops early: everything finished so far
+            # is marked read; anything not yet replied to stays unread for next run.
+            try:
+                flush_labels()
+            except Exception as e:
+                print(f"   ⚠️ Checkpoint failed for {current_account}: {e}")
 
-Strategy:
-1. Language: Reply in the SAME language as the user (DETECT IT).
-2. Negotiation Phase: If they argue price -> Defend value, Sell ROI, Create Urgency.
-3. Closing Phase (CRITICAL): If they AGREE (say 'Yes', 'Okay', 'Agreed', 'Send link') -> DO NOT ask for money. 
-   - Say EXACTLY: "Fantastic decision! To get started on your Premium Logo immediately, I just need a few details: What is the exact Brand Name you want? Do you have any specific Color Preferences or Slogans? Once you reply with this, I will hand over your file to our Delivery Agent to finalize the order."
-4. Handoff Phase: If they send the details (Brand Name, Colors) -> You MUST start your response with the tag: [[ORDER_CONFIRMED]].
-   - Reply Content: "[[ORDER_CONFIRMED]] Perfect! I have locked in your details for the Brand Name. Timeline: You will receive the first draft in exactly 2 Days (48 Hours). One last thing: Is there anything else specific or any new idea you want to add before we start designing?"
-5. Tone: Professional, Enthusiastic, Deal-Closing.
-6. Keep it under 100 words.
-7. Sign-off: "Best regards, {sender_display_name}"
-"""
-                        try:
-                            resp = model.generate_content(prompt)
-                            ai_reply_text = resp.text.strip()
-                            if ai_reply_text.startswith("```"): ai_reply_text = ai_reply_text.replace("```","")
-                            
-                            new_status = "Negotiating" # Status Update
-                            
-                            # Secret Tag Logic (Order Confirmation)
-                            if "[[ORDER_CONFIRMED]]" in ai_reply_text:
-                                print(f"      🎉 Order Confirmed for {client_name}!")
-                                new_status = "Ordered"
-                                ai_reply_text = ai_reply_text.replace("[[ORDER_CONFIRMED]]", "").strip()
-
-                        except Exception as e:
-                            print(f"      AI Error: {e}")
-                            ai_reply_text = f"Thanks for your interest, {client_name}. I can offer you a special price of {offer_price}. Shall we proceed?\n\nBest regards,\n{sender_display_name}"
-
-                    # Send Reply
-                    msg_obj = create_message(current_account, from_email, subject, ai_reply_text, thread_id=msg_detail.get('threadId'))
-                    send_message(gmail_service, 'me', msg_obj)
-                    
-                    # Update Sheet
-                    worksheet.update_cell(row_idx, status_col_idx + 1, new_status)
-                    
-                    # Mark Read
-                    gmail_service.users().messages().modify(userId='me', id=msg['id'], body={'removeLabelIds': ['UNREAD']}).execute()
-                    print(f"      Reply Sent. Status: {new_status}")
-
-                else:
-                    # Ignore
-                    pass
+        # Advance the inbox checkpoint; whatever failed (or was never marked read)
+        # is remembered in it and picked up again next run.
+        inbox.commit(failed | labels.queued())
 
-            except Exception as e:
-                print(f"   Error processing message: {e}")
+    # Checkpoint after each account: its sheet updates are flushed as soon as it is done.
+    # Each account is leased, so an overlapping run can't answer the same inbox.
+    run_per_account(unique_accounts, leased('replier', handle_account), checkpoint=sheet.flush)
 
 if __name__ == "__main__":
     process_replies()
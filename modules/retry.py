@@ -0,0 +1,197 @@
+"""
+Retries for Gmail and Sheets calls: rate limits (429, 403 rateLimitExceeded)
+and server/network errors are retried with jittered exponential backoff,
+honouring Retry-After when the API sends one. Anything else is raised
+right away.
+
+Each account (and the sheet, as 'sheets') has its own breaker. A rate
+limit pauses every call for that account until the backoff is over, so
+its other workers don't keep hammering it, while other accounts carry
+on. After BREAKER_THRESHOLD failed calls in a row the breaker opens:
+calls for that account fail fast with CircuitOpenError for
+BREAKER_COOLDOWN seconds, and the work is left for the next run.
+
+Gmail requests get this through gmail_request_builder (every execute()
+on a built service); sheet.py wraps its reads and writes with call().
+"""
+import os
+import time
+import random
+import socket
+import threading
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+from modules import metrics
+
+RETRY_ATTEMPTS = int(os.getenv("API_RETRY_ATTEMPTS", "5"))
+BACKOFF_BASE = float(os.getenv("API_BACKOFF_BASE", "1"))
+BACKOFF_CAP = float(os.getenv("API_BACKOFF_CAP", "32"))
+MAX_RETRY_AFTER = 120.0 # never wait longer than this on a Retry-After
+BREAKER_THRESHOLD = 5
+BREAKER_COOLDOWN = float(os.getenv("API_BREAKER_COOLDOWN", "60"))
+
+RATE_LIMITED = 'rate_limited'
+TRANSIENT = 'transient' # 5xx or a dropped connection
+FATAL = 'fatal'
+
+RATE_LIMIT_REASONS = ('rateLimitExceeded', 'userRateLimitExceeded', 'RESOURCE_EXHAUSTED')
+SERVER_STATUSES = {500, 502, 503, 504}
+NETWORK_ERRORS = {'ServerNotFoundError', 'ConnectionError', 'ConnectTimeout', 'ReadTimeout', 'ChunkedEncodingError'}
+
+class CircuitOpenError(Exception):
+    """The account's breaker is open: it was failing, so calls are refused for a while."""
+
+def _status(error):
+    """HTTP status of a googleapiclient HttpError or gspread APIError, else None."""
+    status = getattr(getattr(error, 'resp', None), 'status', None)
+    if status is None:
+        status = getattr(getattr(error, 'response', None), 'status_code', None)
+    try:
+        return int(status) if status is not None else None
+    except (TypeError, ValueError):
+        return None
+
+def classify(error):
+    status = _status(error)
+    if status == 429:
+        return RATE_LIMITED
+    if status == 403:
+        content = getattr(error, 'content', b'') or b''
+        text = content.decode('utf-8', 'replace') if isinstance(content, bytes) else str(content)
+        return RATE_LIMITED if any(reason in text for reason in RATE_LIMIT_REASONS) else FATAL
+    if status in SERVER_STATUSES:
+        return TRANSIENT
+    # socket.timeout (httplib2 read timeouts) is only a TimeoutError from Python 3.10 on
+    if status is None and (isinstance(error, (ConnectionError, TimeoutError, socket.timeout))
+                           or error.__class__.__name__ in NETWORK_ERRORS):
+        return TRANSIENT
+    return FATAL
+
+def retry_after(error):
+    """Seconds from the response's Retry-After header (delta or HTTP date), or None."""
+    resp = getattr(error, 'resp', None)
+    value = resp.get('retry-after') if resp is not None and hasattr(resp, 'get') else None
+    if value is None:
+        headers = getattr(getattr(error, 'response', None), 'headers', None)
+        value = headers.get('Retry-After') if headers is not None else None
+    if value is None:
+        return None
+    try:
+        return min(MAX_RETRY_AFTER, max(0.0, float(value)))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+        return min(MAX_RETRY_AFTER, max(0.0, (when - datetime.now(timezone.utc)).total_seconds()))
+    except (TypeError, ValueError):
+        return None
+
+def backoff(attempt):
+    """Full jitter: anywhere between 0 and base * 2^(attempt-1), capped."""
+    return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** (attempt - 1)))
+
+class Breaker:
+    def __init__(self):
+        self.paused_until = 0.0 # every call waits until then (rate-limit backoff)
+        self.open_until = 0.0 # calls fail fast until then
+        self.failures = 0 # failed calls in a row
+
+class Breakers:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.breakers = {}
+
+    def _get(self, account):
+        return self.breakers.setdefault((account or 'default').lower(), Breaker())
+
+    def before_call(self, account):
+        """Waits out a pause; raises CircuitOpenError while the breaker is open."""
+        with self.lock:
+            breaker = self._get(account)
+            now = time.monotonic()
+            if breaker.open_until > now:
+                raise CircuitOpenError(f"{account or 'default'} is backing off for another {breaker.open_until - now:.0f}s")
+            delay = breaker.paused_until - now
+        if delay > 0:
+            time.sleep(delay)
+
+    def pause(self, account, seconds):
+        with self.lock:
+            breaker = self._get(account)
+            breaker.paused_until = max(breaker.paused_until, time.monotonic() + seconds)
+
+    def succeeded(self, account):
+        with self.lock:
+            self._get(account).failures = 0
+
+    def failed(self, account):
+        """Counts a call that gave up; opens the breaker at BREAKER_THRESHOLD."""
+        with self.lock:
+            breaker = self._get(account)
+            breaker.failures += 1
+            if breaker.failures < BREAKER_THRESHOLD:
+                return
+            breaker.failures = 0
+            breaker.open_until = time.monotonic() + BREAKER_COOLDOWN
+        print(f"🔌 {account or 'default'}: {BREAKER_THRESHOLD} failed calls in a row. Pausing it for {BREAKER_COOLDOWN:.0f}s.")
+
+breakers = Breakers()
+
+def call(fn, api, method, account=None, idempotent=True, attempts=None):
+    """
+    Runs fn() (one API call), retrying rate limits and, if the call is
+    idempotent, server/network errors. Every attempt is recorded in
+    modules.metrics. Raises the last error once attempts run out.
+    """
+    attempts = attempts or RETRY_ATTEMPTS
+    for attempt in range(1, attempts + 1):
+        breakers.before_call(account)
+        try:
+            with metrics.timed(api, method, account):
+                result = fn()
+        except Exception as e:
+            kind = classify(e)
+            # A send that hit a 5xx or a dropped connection may have gone out: never resend it
+            retriable = kind == RATE_LIMITED or (kind == TRANSIENT and idempotent)
+            if not retriable or attempt == attempts:
+                if kind != FATAL:
+                    breakers.failed(account)
+                raise
+            delay = retry_after(e)
+            if delay is None:
+                delay = backoff(attempt)
+            if kind == RATE_LIMITED:
+                breakers.pause(account, delay) # the whole account waits, not just this call
+            metrics.record_retry(api, method, account)
+            print(f"      ↻ {api} {method} ({account or 'default'}): {metrics.error_name(e)}. Retry {attempt}/{attempts - 1} in {delay:.1f}s.")
+            time.sleep(delay)
+            continue
+        breakers.succeeded(account)
+        return result
+
+# Gmail methods that change something each time they run (retried only on rate limits)
+NOT_IDEMPOTENT = {'messages.send'}
+
+_request_class = None
+
+def gmail_request_builder(account):
+    """A requestBuilder for build_from_document: every request.execute() is recorded and retried for `account`."""
+    global _request_class
+    if _request_class is None:
+        from googleapiclient.http import HttpRequest
+
+        class RetryingHttpRequest(HttpRequest):
+            account = None
+
+            def execute(self, *args, **kwargs):
+                method = metrics.gmail_method(self.methodId)
+                return call(lambda: HttpRequest.execute(self, *args, **kwargs), 'gmail', method, self.account,
+                            idempotent=method not in NOT_IDEMPOTENT)
+
+        _request_class = RetryingHttpRequest
+
+    def build(*args, **kwargs):
+        request = _request_class(*args, **kwargs)
+        request.account = account
+        return request
+    return build
@@ -1,10 +1,12 @@
 import os
+import json
 import pickle
-from google_auth_oauthlib.flow import InstalledAppFlow
-from google.auth.transport.requests import Request
-from googleapiclient.discovery import build
-import gspread
-from google.oauth2.credentials import Credentials
+import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from modules import retry
+# The Google client libraries (auth, googleapiclient, gspread) are imported where
+# they are used: importing this module is free, and a run only pays for what it builds.
 
 # Scopes for Gmail and Sheets
 SCOPES = [
@@ -14,44 +16,197 @@ SCOPES = [
     'https://www.googleapis.com/auth/spreadsheets'
 ]
 
+# Refresh access tokens that expire within this window before handing them out.
+TOKEN_REFRESH_MARGIN = datetime.timedelta(minutes=5)
+SESSION_WARMUP_WORKERS = 8
+
+_lock = threading.Lock() # guards the session dicts (held briefly)
+_default_lock = threading.Lock() # guards the token.pickle credentials and their clients
+_doc_lock = threading.Lock()
+_gmail_doc = None
+_default_creds = None
+_default_gmail = None
+_gspread_client = None
+_sessions = {} # {email: AccountSession}
+_session_locks = {} # {email: Lock}
+
+def _gmail_discovery_doc():
+    """The Gmail discovery document bundled with the client library, parsed once per process."""
+    global _gmail_doc
+    with _doc_lock:
+        if _gmail_doc is None:
+            from googleapiclient.discovery_cache import get_static_doc
+            _gmail_doc = json.loads(get_static_doc('gmail', 'v1'))
+        return _gmail_doc
+
+def build_gmail(creds, account='default'):
+    """Gmail service whose calls are retried (modules.retry) and recorded (modules.metrics) under `account`."""
+    from googleapiclient.discovery import build_from_document
+    return build_from_document(_gmail_discovery_doc(), credentials=creds,
+                               requestBuilder=retry.gmail_request_builder(account))
+
+def _auth_request():
+    from google.auth.transport.requests import Request
+    return Request()
+
+def _needs_refresh(creds):
+    if not creds.valid:
+        return True
+    # google-auth keeps expiry as naive UTC
+    return creds.expiry is not None and creds.expiry - datetime.datetime.utcnow() < TOKEN_REFRESH_MARGIN
+
 def get_creds():
-    creds = None
-    if os.path.exists('token.pickle'):
-        with open('token.pickle', 'rb') as token:
-            creds = pickle.load(token)
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
-        else:
-            flow = InstalledAppFlow.from_client_secrets_file(
-                'credentials.json', SCOPES)
-            creds = flow.run_local_server(port=0)
-        with open('token.pickle', 'wb') as token:
-            pickle.dump(creds, token)
-    return creds
+    global _default_creds
+    with _default_lock:
+        creds = _default_creds
+        if creds is None and os.path.exists('token.pickle'):
+            with open('token.pickle', 'rb') as token:
+                creds = pickle.load(token)
+        if not creds or _needs_refresh(creds):
+            if creds and creds.refresh_token:
+                creds.refresh(_auth_request())
+            else:
+                from google_auth_oauthlib.flow import InstalledAppFlow
+                flow = InstalledAppFlow.from_client_secrets_file(
+                    'credentials.json', SCOPES)
+                creds = flow.run_local_server(port=0)
+            with open('token.pickle', 'wb') as token:
+                pickle.dump(creds, token)
+        _default_creds = creds
+        return creds
 
-def get_service_for_email(email_address):
+class AccountSession:
     """
-    Constructs a Gmail service instance for a specific email address
-    by looking for tokens/token_{email_address}.json
+    A warm, process-wide Gmail session for one account: credentials, the
+    built service and (once checked) the verified mailbox identity.
+    google-auth also refreshes the token on its own inside requests; those
+    tokens reach tokens/ through save_if_refreshed().
     """
-    token_path = f'tokens/token_{email_address}.json'
-    
-    if os.path.exists(token_path):
+    def __init__(self, email, token_path, creds):
+        self.email = email
+        self.token_path = token_path
+        self.creds = creds
+        self.saved_token = creds.token # the access token tokens/ holds
+        self.lock = threading.Lock()
+        self.service = build_gmail(creds, email)
+        self.verified = None # None = not checked yet, else True/False
+
+    def refresh_if_needed(self):
+        """Refreshes an expiring access token and writes it back to tokens/."""
+        if self.creds.refresh_token and _needs_refresh(self.creds):
+            self.creds.refresh(_auth_request())
+        self.save_if_refreshed()
+
+    def save_if_refreshed(self):
+        """Writes the credentials back to tokens/ if the access token changed since the last write."""
+        with self.lock:
+            if self.creds.token == self.saved_token:
+                return
+            with open(self.token_path, 'w') as token_file:
+                token_file.write(self.creds.to_json())
+            self.saved_token = self.creds.token
+
+    def verify_identity(self):
+        """
+        Strict safety check: the token must belong to the account it is filed under.
+        Checked once per process; the result is reused by every later stage.
+        """
+        if self.verified is None:
+            try:
+                profile = self.service.users().getProfile(userId='me').execute()
+                logged_in_email = profile.get('emailAddress').lower()
+                self.verified = logged_in_email == self.email
+                if not self.verified:
+                    print(f"❌ Mismatch! Logged in as {logged_in_email}, but expected {self.email}. Skipping safely.")
+            except Exception as e:
+                # Not cached: a transient failure shouldn't lock the account out for the whole process.
+                print(f"❌ Error verifying identity for {self.email}: {e}")
+                return False
+        return self.verified
+
+def get_session(email_address):
+    """
+    Returns the cached AccountSession for tokens/token_{email_address}.json,
+    creating it on first use. Returns None if the token is missing or broken.
+    """
+    email_address = email_address.strip().lower()
+    with _lock:
+        session = _sessions.get(email_address)
+    if session:
+        try:
+            session.save_if_refreshed()
+        except Exception as e:
+            print(f"⚠️ Could not save the refreshed token for {email_address}: {e}")
+        return session
+    with _lock:
+        session_lock = _session_locks.setdefault(email_address, threading.Lock())
+
+    with session_lock:
+        if email_address in _sessions:
+            return _sessions[email_address]
+
+        token_path = f'tokens/token_{email_address}.json'
+        if not os.path.exists(token_path):
+            print(f"Token file not found for: {email_address}")
+            return None
         try:
+            from google.oauth2.credentials import Credentials
             creds = Credentials.from_authorized_user_file(token_path, SCOPES)
-            return build('gmail', 'v1', credentials=creds)
+            session = AccountSession(email_address, token_path, creds)
+            session.refresh_if_needed()
         except Exception as e:
             print(f"Error loading credentials for {email_address}: {e}")
             return None
-    else:
-        print(f"Token file not found for: {email_address}")
-        return None
+
+        with _lock:
+            _sessions[email_address] = session
+        return session
+
+def save_refreshed_tokens():
+    """Writes every session's token back to tokens/ if google-auth refreshed it (daemon housekeeping)."""
+    with _lock:
+        sessions = list(_sessions.values())
+    for session in sessions:
+        try:
+            session.save_if_refreshed()
+        except Exception as e:
+            print(f"⚠️ Could not save the refreshed token for {session.email}: {e}")
+
+def get_service_for_email(email_address):
+    """
+    Constructs a Gmail service instance for a specific email address
+    by looking for tokens/token_{email_address}.json (cached per process)
+    """
+    session = get_session(email_address)
+    return session.service if session else None
+
+def verify_account(email_address):
+    """True if the account has a working token that really belongs to it."""
+    session = get_session(email_address)
+    return bool(session and session.verify_identity())
+
+def warm_sessions(email_addresses, max_workers=SESSION_WARMUP_WORKERS):
+    """Loads, refreshes and verifies every account's session in parallel at startup."""
+    email_addresses = sorted(set(e.strip().lower() for e in email_addresses if e.strip()))
+    if not email_addresses:
+        return
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(email_addresses)), thread_name_prefix="warmup") as pool:
+        results = list(pool.map(verify_account, email_addresses))
+    print(f"🔐 Sessions ready for {sum(results)}/{len(email_addresses)} accounts.")
 
 def get_gmail_service():
+    global _default_gmail
     creds = get_creds()
-    return build('gmail', 'v1', credentials=creds)
+    with _default_lock:
+        if _default_gmail is None:
+            _default_gmail = build_gmail(creds)
+        return _default_gmail
 
 def get_gspread_client():
+    global _gspread_client
     creds = get_creds()
-    return gspread.authorize(creds)
+    with _default_lock:
+        if _gspread_client is None:
+            import gspread
+            _gspread_client = gspread.authorize(creds)
+        return _gspread_client
@@ -0,0 +1,124 @@
+import atexit
+import threading
+from modules.services import get_gspread_client
+from modules.leads import LeadTable
+from modules import retry
+
+SHEET_ID = '1N3_jJkYNCtp1MQXEObtDH9FC_VzPyL2RLBW_MdfvfCM'
+
+# Flush on our own once this many cells are waiting, even between checkpoints.
+AUTO_FLUSH_CELLS = 200
+# Sheets calls share one rate-limit breaker (see modules.retry), apart from the Gmail accounts'
+SHEETS_ACCOUNT = 'sheets'
+# Ranges per batch_update call (the API accepts far more; this keeps requests small).
+MAX_RANGES_PER_BATCH = 500
+
+class SheetSnapshot:
+    """
+    A single read of the lead sheet, shared by every stage of a run.
+    `leads` is the indexed LeadTable over the rows; `rows` (the table
+    itself, a sequence of rows) and `schema` are shortcuts to it. Writes are mirrored into it right away (so later
+    stages and the indexes see them)
+    and buffered for the worksheet until `flush()`, which sends them in
+    as few batch_update calls as possible. Safe to share between account
+    workers.
+    """
+    def __init__(self, worksheet, rows):
+        self.worksheet = worksheet
+        self.leads = LeadTable(rows)
+        self.rows = self.leads
+        self.schema = self.leads.schema
+        self.pending = {} # {row: {col: value}}
+        self.lock = threading.RLock()
+
+    def reload(self):
+        """Writes what is buffered, then re-reads the worksheet (picks up edits made on the sheet)."""
+        self.flush()
+        rows = retry.call(self.worksheet.get_all_values, 'sheets', 'get_all_values', SHEETS_ACCOUNT)
+        with self.lock:
+            self.leads = LeadTable(rows)
+            self.rows = self.leads
+            self.schema = self.leads.schema
+
+    @property
+    def headers(self):
+        return self.schema.headers
+
+    def account_emails(self):
+        """Every Gmail account named in the 'Gmail Account' column."""
+        return self.leads.accounts()
+
+    def update_cell(self, row, col, value):
+        """Same signature as gspread's update_cell (1-based row and col)."""
+        with self.lock:
+            self.set_local(row, col, value)
+            self.pending.setdefault(row, {})[col] = value
+            full = sum(len(cols) for cols in self.pending.values()) >= AUTO_FLUSH_CELLS
+        if full:
+            self.flush()
+
+    def set_local(self, row, col, value):
+        self.leads.set(row, col, value)
+
+    def flush(self):
+        """Writes buffered cells, merging adjacent columns of a row into one range."""
+        with self.lock:
+            if not self.pending:
+                return
+            pending, self.pending = self.pending, {}
+
+        data = []
+        for row in sorted(pending):
+            cols = pending[row]
+            run = []
+            for col in sorted(cols):
+                if run and col != run[-1] + 1:
+                    data.append(_range_for(row, run, cols))
+                    run = []
+                run.append(col)
+            data.append(_range_for(row, run, cols))
+
+        try:
+            for start in range(0, len(data), MAX_RANGES_PER_BATCH):
+                chunk = data[start:start + MAX_RANGES_PER_BATCH]
+                # gspread rewrites each 'range' in place ("'Sheet1'!B2"): every attempt gets fresh dicts
+                retry.call(lambda: self.worksheet.batch_update([dict(d) for d in chunk], value_input_option='USER_ENTERED'),
+                           'sheets', 'batch_update', SHEETS_ACCOUNT)
+        except Exception:
+            # Put back anything not yet confirmed so a later flush can retry it.
+            with self.lock:
+                for row, cols in pending.items():
+                    merged = dict(cols)
+                    merged.update(self.pending.get(row, {}))
+                    self.pending[row] = merged
+            raise
+        print(f"📝 Sheet: flushed {sum(len(c) for c in pending.values())} cells in {len(data)} ranges.")
+
+def _range_for(row, run, cols):
+    from gspread.utils import rowcol_to_a1
+    a1 = rowcol_to_a1(row, run[0])
+    if len(run) > 1:
+        a1 = f"{a1}:{rowcol_to_a1(row, run[-1])}"
+    return {'range': a1, 'values': [[cols[c] for c in run]]}
+
+def _flush_at_exit(sheet):
+    try:
+        sheet.flush()
+    except Exception as e:
+        print(f"❌ Sheet flush at exit failed: {e}")
+
+def load_sheet_snapshot():
+    """Opens the lead sheet and reads all rows once. Returns None on failure."""
+    try:
+        gc = get_gspread_client()
+        sh = retry.call(lambda: gc.open_by_key(SHEET_ID), 'sheets', 'open_by_key', SHEETS_ACCOUNT)
+        worksheet = sh.sheet1
+        rows = retry.call(worksheet.get_all_values, 'sheets', 'get_all_values', SHEETS_ACCOUNT)
+    except Exception as e:
+        print(f"❌ Error connecting to Sheet {SHEET_ID}: {e}")
+        return None
+
+    sheet = SheetSnapshot(worksheet, rows)
+    # Whatever is still buffered when the process ends (crash included) gets written.
+    atexit.register(_flush_at_exit, sheet)
+    return sheet
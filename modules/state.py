@@ -0,0 +1,41 @@
+import os
+import json
+import threading
+
+# Local state (checkpoints, caches, journals). Not committed; see .gitignore.
+STATE_DIR = os.getenv("BOT_STATE_DIR", "state")
+
+_lock = threading.RLock()
+
+def state_path(name):
+    os.makedirs(STATE_DIR, exist_ok=True)
+    return os.path.join(STATE_DIR, name)
+
+def load_json(name, default=None):
+    """Reads a JSON state file; a missing or corrupt file gives `default`."""
+    path = state_path(name)
+    with _lock:
+        try:
+            with open(path, 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return default
+        except (OSError, ValueError) as e:
+            print(f"⚠️ Ignoring unreadable state file {path}: {e}")
+            return default
+
+def save_json(name, data):
+    """Writes a JSON state file atomically (temp file + rename)."""
+    path = state_path(name)
+    tmp_path = f"{path}.tmp"
+    with _lock:
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, path)
+
+def update_json(name, fn, default=None):
+    """Load, apply fn(data) -> data, save; all under one lock so workers don't clobber each other."""
+    with _lock:
+        data = fn(load_json(name, default))
+        save_json(name, data)
+        return data
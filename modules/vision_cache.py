@@ -0,0 +1,96 @@
+"""
+Persistent cache of payment-screenshot verdicts (state/vision_verdicts.json).
+
+Screenshots are keyed by the SHA-256 of the file. An exact copy the model
+has already judged for the same client reuses the stored YES/NO; one
+already submitted by a different client is flagged as reused, in both
+cases without calling Gemini.
+
+A difference hash (dHash) of the picture is stored too, but a perceptual
+match is only ever a hint for a manual look (similar()): receipts from
+the same payment app for the same amount differ in a few bits at most,
+and a "Payment Failed" screen can be one bit away from a successful one.
+"""
+import hashlib
+import threading
+import time
+from modules.state import load_json, update_json
+
+CACHE_FILE = 'vision_verdicts.json'
+MAX_ENTRIES = 5000
+HASH_SIZE = 16 # 16x16 dHash = 256 bits
+# Most differing dHash bits for similar() to report two screenshots as look-alikes
+MAX_DISTANCE = 4
+
+_lock = threading.Lock()
+_entries = None # {sha256: {'verdict', 'dhash', 'client', 'seen'}}
+
+def sha256_of(file_data):
+    return hashlib.sha256(file_data).hexdigest()
+
+def dhash(image):
+    """Perceptual hash: brightness gradients of a tiny grayscale copy, as hex."""
+    small = image.convert('L').resize((HASH_SIZE + 1, HASH_SIZE))
+    pixels = list(small.getdata())
+    bits = 0
+    for row in range(HASH_SIZE):
+        offset = row * (HASH_SIZE + 1)
+        for col in range(HASH_SIZE):
+            bits = (bits << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return f"{bits:0{HASH_SIZE * HASH_SIZE // 4}x}"
+
+def _distance(a, b):
+    return bin(int(a, 16) ^ int(b, 16)).count('1')
+
+class Fingerprint:
+    __slots__ = ('sha256', 'dhash')
+
+    def __init__(self, sha256, dhash):
+        self.sha256 = sha256
+        self.dhash = dhash
+
+def fingerprint(image):
+    """Fingerprint of an image from images.prepare_image (which keeps the file's sha256)."""
+    sha = image.info.get('sha256')
+    if sha is None:
+        sha = sha256_of(image.tobytes())
+    return Fingerprint(sha, dhash(image))
+
+def _load():
+    global _entries
+    if _entries is None:
+        _entries = load_json(CACHE_FILE, {})
+    return _entries
+
+def lookup(fp):
+    """The stored entry for this exact screenshot file, or None."""
+    with _lock:
+        return _load().get(fp.sha256)
+
+def similar(fp):
+    """The closest stored entry that looks like this screenshot, or None. For logging only, never a verdict."""
+    with _lock:
+        entries = _load()
+        if bin(int(fp.dhash, 16)).count('1') < HASH_SIZE:
+            return None # near-blank picture: too featureless to match by look
+        best = None
+        for candidate in entries.values():
+            distance = _distance(fp.dhash, candidate['dhash'])
+            if distance <= MAX_DISTANCE and (best is None or distance < best[0]):
+                best = (distance, candidate)
+        return best[1] if best else None
+
+def record(fp, verdict, client):
+    """Stores the model's YES/NO for this screenshot and the client who sent it."""
+    global _entries
+    entry = {'verdict': verdict, 'dhash': fp.dhash, 'client': client, 'seen': int(time.time())}
+
+    def apply(data):
+        data[fp.sha256] = entry
+        if len(data) > MAX_ENTRIES:
+            for sha, _ in sorted(data.items(), key=lambda item: item[1].get('seen', 0))[:len(data) - MAX_ENTRIES]:
+                del data[sha]
+        return data
+
+    with _lock:
+        _entries = update_json(CACHE_FILE, apply, {})
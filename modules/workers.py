@@ -0,0 +1,37 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+# How many Gmail accounts are processed at once. 1 = old one-by-one behaviour.
+ACCOUNT_WORKERS = int(os.getenv("ACCOUNT_WORKERS", "4"))
+
+def _run_isolated(worker, account, checkpoint):
+    try:
+        worker(account)
+    except Exception as e:
+        # One broken account must never take the others down with it.
+        print(f"❌ Error processing account {account}: {e}")
+    finally:
+        if checkpoint:
+            try:
+                checkpoint()
+            except Exception as e:
+                print(f"❌ Checkpoint failed after {account}: {e}")
+
+def run_per_account(accounts, worker, checkpoint=None, max_workers=None):
+    """
+    Calls worker(account) for every account on a bounded thread pool.
+    Each account gets its own worker, its errors stay with it, and
+    checkpoint() (e.g. a sheet flush) runs after each account finishes.
+    """
+    accounts = list(accounts)
+    max_workers = min(max_workers or ACCOUNT_WORKERS, len(accounts))
+
+    if max_workers <= 1:
+        for account in accounts:
+            _run_isolated(worker, account, checkpoint)
+        return
+
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="account") as pool:
+        futures = [pool.submit(_run_isolated, worker, account, checkpoint) for account in accounts]
+        for future in futures:
+            future.result()
@@ -0,0 +1,38 @@
+import pytest
+
+from modules.classifier import AGREEMENT, AUTO_REPLY, LLM, OPT_OUT, THANKS, classify
+
+OOO_HEADERS = [{'name': 'Auto-Submitted', 'value': 'auto-replied'}]
+
+@pytest.mark.parametrize("body, headers, subject, expected", [
+    # Opt-outs: phrases, not bare words
+    ("Please remove me from your list", (), "", OPT_OUT),
+    ("Unsubscribe", (), "", OPT_OUT),
+    ("STOP", (), "", OPT_OUT),
+    ("Stop emailing me!", (), "", OPT_OUT),
+    ("Don't contact me again.", (), "", OPT_OUT),
+    ("Sorry, not interested at the moment", (), "", OPT_OUT),
+    ("No thanks", (), "", OPT_OUT),
+    ("Can you remove the background?", (), "", LLM),
+    ("Don't stop, I'm interested", (), "", LLM),
+    ("I'm not interested in the basic one, what about premium?", (), "", LLM),
+    ("I replied yesterday, check your spam folder", (), "", LLM),
+    # Auto-replies: headers or subject, else a body that is only the notice
+    ("Thanks for your email.", OOO_HEADERS, "", AUTO_REPLY),
+    ("I will be back on Monday.", (), "Out of Office: Re: your logo", AUTO_REPLY),
+    ("I am currently out of the office until Monday. I will respond when I get back.\n\nRegards", (), "", AUTO_REPLY),
+    ("This is an automatic reply", (), "", AUTO_REPLY),
+    ("I am on leave until Monday. Yes, let's proceed.", (), "", LLM),
+    ("I'm on leave next week, what's the price?", (), "", LLM),
+    # Short agreement / thanks
+    ("Okay", (), "", AGREEMENT),
+    ("Yes please, send the link", (), "", AGREEMENT),
+    ("Thanks!", (), "", THANKS),
+    ("ok thanks", (), "", THANKS),
+    ("Yes thanks", (), "", AGREEMENT),
+    ("Yes\n\nOn Mon, Jan 1, 2024 at 10:00 AM Bob <b@x.com> wrote:\n> unsubscribe", (), "", AGREEMENT),
+    ("Yes, but can you make it blue?", (), "", LLM),
+    ("", (), "", LLM),
+])
+def test_classify(body, headers, subject, expected):
+    assert classify(body, headers, subject) == expected
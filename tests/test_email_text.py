@@ -0,0 +1,38 @@
+import pytest
+
+from modules.email_text import clip, reply_text, strip_signature
+
+QUOTE = "\n\nOn Mon, Jan 1, 2024 at 10:00 AM Bob <b@x.com> wrote:\n> Would you like a logo?"
+
+@pytest.mark.parametrize("text, expected", [
+    ("Yes please", "Yes please"),
+    ("Yes please\n-- \nJohn\nCEO, Acme", "Yes please"),
+    ("Yes please\n\nSent from my iPhone", "Yes please"),
+    ("Sounds good, send it over.\n\nBest regards,\nJohn Smith\nAcme Ltd", "Sounds good, send it over."),
+    ("Looks great.\n\nThanks", "Looks great."),
+    # A sign-off followed by a long paragraph is still the message
+    ("Thanks\n" + "I would like the logo in blue and a version for dark backgrounds as well, please.",
+     "Thanks\n" + "I would like the logo in blue and a version for dark backgrounds as well, please."),
+    # Nothing above the delimiter: keep the text
+    ("-- \nJohn", "-- \nJohn"),
+])
+def test_strip_signature(text, expected):
+    assert strip_signature(text) == expected
+
+@pytest.mark.parametrize("text, expected", [
+    ("Sounds good" + QUOTE, "Sounds good"),
+    ("Sounds good\n\nRegards,\nJohn" + QUOTE, "Sounds good"),
+    ("  Just the reply  ", "Just the reply"),
+])
+def test_reply_text(text, expected):
+    assert reply_text(text) == expected
+
+@pytest.mark.parametrize("text, max_tokens, keep_end, expected", [
+    ("short", 10, False, "short"),
+    ("a" * 100, 10, False, "a" * 40 + " …"),
+    ("a" * 100, 10, True, "… " + "a" * 40),
+    ("one two three four five six", 4, False, "one two three …"),
+    ("one two three four five six", 4, True, "… four five six"),
+])
+def test_clip(text, max_tokens, keep_end, expected):
+    assert clip(text, max_tokens, keep_end) == expected
@@ -0,0 +1,77 @@
+import pytest
+
+from modules import gmail_batch
+from modules.gmail_batch import LabelQueue
+
+class StubService:
+    """messages().batchModify(...).execute() recorded; fails on the calls listed in `fail_on` (0-based)."""
+    def __init__(self, fail_on=()):
+        self.bodies = []
+        self.fail_on = set(fail_on)
+        self.attempts = 0
+
+    def users(self):
+        return self
+
+    def messages(self):
+        return self
+
+    def batchModify(self, userId, body):
+        return Request(self, body)
+
+class Request:
+    def __init__(self, service, body):
+        self.service = service
+        self.body = body
+
+    def execute(self):
+        attempt = self.service.attempts
+        self.service.attempts += 1
+        if attempt in self.service.fail_on:
+            raise RuntimeError('backend error')
+        self.service.bodies.append(self.body)
+        return {}
+
+@pytest.mark.parametrize("changes, expected", [
+    ([], []),
+    ([('read', ['m1', 'm2'])], [{'ids': ['m1', 'm2'], 'removeLabelIds': ['UNREAD']}]),
+    # Same change, queued twice, overlapping: one call, each ID once, in queue order
+    ([('read', ['m1', 'm2']), ('read', ['m2', 'm3'])], [{'ids': ['m1', 'm2', 'm3'], 'removeLabelIds': ['UNREAD']}]),
+    # Distinct changes get a call each
+    ([('read', ['m1']), (('STARRED', 'UNREAD'), ['m2']), ('read', ['m3'])],
+     [{'ids': ['m1', 'm3'], 'removeLabelIds': ['UNREAD']},
+      {'ids': ['m2'], 'addLabelIds': ['STARRED'], 'removeLabelIds': ['UNREAD']}]),
+])
+def test_flush_groups_changes(changes, expected):
+    service = StubService()
+    labels = LabelQueue(service)
+    for change, ids in changes:
+        if change == 'read':
+            labels.mark_read(ids)
+        else:
+            labels.modify(ids, add=[change[0]], remove=[change[1]])
+    assert labels.flush() is True
+    assert service.bodies == expected
+    assert len(labels) == 0
+
+@pytest.mark.parametrize("count, size, chunks", [(5, 2, [2, 2, 1]), (4, 2, [2, 2]), (1, 2, [1]), (2500, 1000, [1000, 1000, 500])])
+def test_flush_chunks_ids(monkeypatch, count, size, chunks):
+    monkeypatch.setattr(gmail_batch, 'BATCH_MODIFY_SIZE', size)
+    service = StubService()
+    labels = LabelQueue(service)
+    labels.mark_read([f"m{i}" for i in range(count)])
+    labels.flush()
+    assert [len(body['ids']) for body in service.bodies] == chunks
+    assert [msg_id for body in service.bodies for msg_id in body['ids']] == [f"m{i}" for i in range(count)]
+
+def test_failed_flush_keeps_the_rest_queued(monkeypatch):
+    monkeypatch.setattr(gmail_batch, 'BATCH_MODIFY_SIZE', 2)
+    service = StubService(fail_on=[1])
+    labels = LabelQueue(service)
+    labels.mark_read(['m1', 'm2', 'm3', 'm4'])
+    assert labels.flush() is False
+    assert labels.queued() == {'m3', 'm4'}
+    assert len(labels) == 2
+    assert labels.flush() is True
+    assert [body['ids'] for body in service.bodies] == [['m1', 'm2'], ['m3', 'm4']]
+    assert labels.queued() == set()
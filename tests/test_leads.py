@@ -0,0 +1,93 @@
+import random
+
+import pytest
+
+from modules.leads import LeadTable, SheetSchema
+
+HEADERS = ['Name', 'Email', 'Status', 'Gmail Account', 'Notes', 'Payment Status']
+ROWS = [
+    HEADERS,
+    ['Ann', 'ann@x.com', 'Sent', 'A@gmail.com', '', 'Paid'],
+    ['Bob', 'bob@x.com', 'Sent', 'b@gmail.com', '', ''],
+    ['Cid', 'cid@x.com', ' Replied ', 'a@gmail.com '],
+    ['Dee', 'dee@x.com'], # too short for Status or the account
+    ['Eve', 'eve@x.com', '', 'a@gmail.com', '', 'Pending'],
+]
+
+def scan(table, account=None, status=None, payment=None):
+    """find() the slow way: every row, every cell."""
+    schema = table.schema
+    def cell(row, name):
+        col = schema.get(name)
+        return str(row[col]).strip() if col is not None and len(row) > col else None
+    return [row_num for row_num in range(2, len(table) + 1)
+            if (account is None or (cell(table.row(row_num), 'Gmail Account') or '').lower() == account.strip().lower()
+                and cell(table.row(row_num), 'Gmail Account'))
+            and (status is None or cell(table.row(row_num), 'Status') == status)
+            and (payment is None or cell(table.row(row_num), 'Payment Status') == payment)]
+
+@pytest.mark.parametrize("query, expected", [
+    ({}, [2, 3, 4, 5, 6]),
+    ({'account': 'a@gmail.com'}, [2, 4, 6]),
+    ({'account': ' A@GMAIL.COM'}, [2, 4, 6]),
+    ({'status': 'Sent'}, [2, 3]),
+    ({'status': 'Replied'}, [4]),
+    ({'status': ''}, [6]),
+    ({'account': 'a@gmail.com', 'status': 'Sent'}, [2]),
+    ({'account': 'a@gmail.com', 'payment': 'Pending'}, [6]),
+    ({'payment': ''}, [3]),
+    ({'account': 'nobody@gmail.com'}, []),
+])
+def test_find(query, expected):
+    table = LeadTable(ROWS)
+    assert table.find(**query) == expected
+    assert scan(table, **query) == expected
+
+@pytest.mark.parametrize("row_num, col, value, query, expected", [
+    (3, 3, 'Replied', {'status': 'Sent'}, [2]),
+    (3, 3, 'Replied', {'status': 'Replied'}, [3, 4]),
+    (2, 4, 'b@gmail.com', {'account': 'b@gmail.com'}, [2, 3]),
+    (5, 3, 'Sent', {'status': 'Sent'}, [2, 3, 5]),
+    # Growing a short row through unindexed columns gives it empty Status and Payment cells
+    (4, 7, 'note', {'status': ''}, [6]),
+    (4, 7, 'note', {'payment': ''}, [3, 4]),
+    (5, 7, 'note', {'status': ''}, [5, 6]),
+])
+def test_set_updates_indexes(row_num, col, value, query, expected):
+    table = LeadTable(ROWS)
+    table.set(row_num, col, value)
+    assert table.row(row_num)[col - 1] == value
+    assert table.find(**query) == expected
+    assert scan(table, **query) == expected
+
+def test_rows_read_like_lists():
+    table = LeadTable(ROWS)
+    assert table[0] == HEADERS
+    assert list(table.row(5)) == ['Dee', 'dee@x.com']
+    assert len(table.row(5)) == 2
+    assert table.row(5)[-1] == 'dee@x.com'
+    assert table.cell(5, 2, default='-') == '-'
+    assert table.accounts() == {'a@gmail.com', 'b@gmail.com'}
+    with pytest.raises(IndexError):
+        table.row(5)[2]
+
+def test_random_writes_match_a_rescan():
+    rng = random.Random(7)
+    values = {3: ['', 'Sent', 'Replied', 'Done'], 4: ['', 'a@gmail.com', 'B@gmail.com'], 6: ['', 'Paid', 'Pending']}
+    rows = [HEADERS] + [[f'n{i}', f'c{i}@x.com'][:rng.randint(1, 2)] for i in range(40)]
+    table = LeadTable(rows)
+    for _ in range(500):
+        col = rng.choice([3, 4, 5, 6, 7])
+        table.set(rng.randint(2, len(table)), col, rng.choice(values.get(col, ['x'])))
+        query = rng.choice([{'status': rng.choice(values[3])}, {'account': rng.choice(values[4][1:])},
+                            {'payment': rng.choice(values[6])},
+                            {'account': 'a@gmail.com', 'status': rng.choice(values[3])}])
+        assert table.find(**query) == scan(table, **query)
+
+def test_schema():
+    schema = SheetSchema(['Name', 'Status', 'Status'])
+    assert schema.index('Status') == 1
+    assert schema.get('Payment Status') == 20
+    assert schema.get('Missing') is None
+    with pytest.raises(ValueError):
+        schema.index('Missing')
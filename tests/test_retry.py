@@ -0,0 +1,114 @@
+import socket
+
+import pytest
+
+from modules import retry
+
+class HttpError(Exception):
+    """Shaped like googleapiclient's HttpError: resp.status, resp.get() for headers, content bytes."""
+    def __init__(self, status, content=b'', headers=None):
+        super().__init__(status)
+        self.resp = Resp(status, headers or {})
+        self.content = content
+
+class Resp(dict):
+    def __init__(self, status, headers):
+        super().__init__(headers)
+        self.status = status
+
+class APIError(Exception):
+    """Shaped like gspread's APIError: response.status_code and response.headers."""
+    def __init__(self, status, headers=None):
+        super().__init__(status)
+        self.response = type('Response', (), {'status_code': status, 'headers': headers or {}})()
+
+class ServerNotFoundError(Exception):
+    """Named like httplib2's."""
+
+@pytest.mark.parametrize("error, expected", [
+    (HttpError(429), retry.RATE_LIMITED),
+    (APIError(429), retry.RATE_LIMITED),
+    (HttpError(403, b'{"reason": "userRateLimitExceeded"}'), retry.RATE_LIMITED),
+    (HttpError(403, b'{"reason": "insufficientPermissions"}'), retry.FATAL),
+    (HttpError(500), retry.TRANSIENT),
+    (APIError(503), retry.TRANSIENT),
+    (HttpError(400), retry.FATAL),
+    (HttpError(404), retry.FATAL),
+    (socket.timeout('timed out'), retry.TRANSIENT),
+    (TimeoutError(), retry.TRANSIENT),
+    (ConnectionResetError(), retry.TRANSIENT),
+    (ServerNotFoundError(), retry.TRANSIENT),
+    (ValueError('bad'), retry.FATAL),
+])
+def test_classify(error, expected):
+    assert retry.classify(error) == expected
+
+@pytest.mark.parametrize("error, expected", [
+    (HttpError(429, headers={'retry-after': '7'}), 7.0),
+    (APIError(429, headers={'Retry-After': '2.5'}), 2.5),
+    (HttpError(429, headers={'retry-after': '9999'}), retry.MAX_RETRY_AFTER),
+    (HttpError(429, headers={'retry-after': 'Thu, 01 Jan 1970 00:00:00 GMT'}), 0.0),
+    (HttpError(429, headers={'retry-after': 'soon'}), None),
+    (HttpError(429), None),
+    (ValueError(), None),
+])
+def test_retry_after(error, expected):
+    assert retry.retry_after(error) == expected
+
+@pytest.mark.parametrize("attempt, ceiling", [(1, 1), (2, 2), (3, 4), (6, 32), (10, 32)])
+def test_backoff_is_capped(monkeypatch, attempt, ceiling):
+    monkeypatch.setattr(retry, 'BACKOFF_BASE', 1.0)
+    monkeypatch.setattr(retry, 'BACKOFF_CAP', 32.0)
+    assert all(0 <= retry.backoff(attempt) <= ceiling for _ in range(50))
+
+@pytest.fixture
+def calls(monkeypatch):
+    """Runs retry.call() with no real sleeps and fresh breakers; records the sleeps."""
+    sleeps = []
+    monkeypatch.setattr(retry.time, 'sleep', sleeps.append)
+    monkeypatch.setattr(retry, 'breakers', retry.Breakers())
+    return sleeps
+
+def failing(*errors, result='ok'):
+    errors = list(errors)
+    def fn():
+        if errors:
+            raise errors.pop(0)
+        return result
+    return fn
+
+@pytest.mark.parametrize("errors, idempotent, expected", [
+    ([], True, 'ok'),
+    ([HttpError(429), HttpError(503)], True, 'ok'),
+    ([HttpError(503)], False, HttpError), # a send that may have gone out is not resent
+    ([HttpError(429)], False, 'ok'), # a rate limit means it did not
+    ([HttpError(400)], True, HttpError),
+    ([HttpError(500)] * 5, True, HttpError), # out of attempts
+])
+def test_call(calls, errors, idempotent, expected):
+    fn = failing(*errors)
+    if expected is HttpError:
+        with pytest.raises(HttpError):
+            retry.call(fn, 'gmail', 'messages.send', 'a@x.com', idempotent=idempotent)
+    else:
+        assert retry.call(fn, 'gmail', 'messages.send', 'a@x.com', idempotent=idempotent) == expected
+
+def test_call_honours_retry_after(calls):
+    retry.call(failing(HttpError(429, headers={'retry-after': '3'})), 'gmail', 'messages.get', 'a@x.com')
+    assert 3.0 in calls
+
+def test_breaker_opens_after_repeated_failures(calls, monkeypatch):
+    monkeypatch.setattr(retry, 'RETRY_ATTEMPTS', 1)
+    for _ in range(retry.BREAKER_THRESHOLD):
+        with pytest.raises(HttpError):
+            retry.call(failing(HttpError(503)), 'gmail', 'messages.get', 'a@x.com')
+    with pytest.raises(retry.CircuitOpenError):
+        retry.call(failing(), 'gmail', 'messages.get', 'a@x.com')
+    # Other accounts carry on
+    assert retry.call(failing(), 'gmail', 'messages.get', 'b@x.com') == 'ok'
+
+def test_fatal_errors_do_not_open_the_breaker(calls):
+    for _ in range(retry.BREAKER_THRESHOLD + 1):
+        with pytest.raises(HttpError):
+            retry.call(failing(HttpError(404)), 'gmail', 'messages.get', 'a@x.com')
+    assert retry.call(failing(), 'gmail', 'messages.get', 'a@x.com') == 'ok'
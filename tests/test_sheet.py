@@ -0,0 +1,103 @@
+import pytest
+
+from modules import retry, sheet as sheet_module
+from modules.sheet import SheetSnapshot
+
+ROWS = [['Name', 'Email', 'Status', 'Notes'], ['Ann', 'ann@x.com', 'Sent'], ['Bob', 'bob@x.com', '']]
+
+class QuotaError(Exception):
+    """Looks like a gspread APIError for a 429."""
+    class response:
+        status_code = 429
+        headers = {}
+
+class StubWorksheet:
+    """Records batch_update calls; rewrites each range in place the way gspread does."""
+    def __init__(self, failures=0):
+        self.calls = []
+        self.failures = failures
+
+    def batch_update(self, data, **kwargs):
+        for item in data:
+            if '!' in item['range']:
+                raise ValueError(f"range already names a sheet: {item['range']}")
+            item['range'] = f"'Sheet1'!{item['range']}"
+        if self.failures:
+            self.failures -= 1
+            raise QuotaError()
+        self.calls.append([(item['range'], item['values']) for item in data])
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(retry.time, 'sleep', lambda seconds: None)
+    monkeypatch.setattr(retry, 'breakers', retry.Breakers())
+
+@pytest.mark.parametrize("writes, expected", [
+    ([], []),
+    ([(2, 3, 'Replied')], [("'Sheet1'!C2", [['Replied']])]),
+    # Adjacent columns of a row share one range; the last write to a cell wins
+    ([(2, 3, 'x'), (2, 4, 'note'), (2, 3, 'Replied')], [("'Sheet1'!C2:D2", [['Replied', 'note']])]),
+    ([(3, 1, 'Bo'), (3, 3, 'Sent'), (2, 2, 'a@x.com')],
+     [("'Sheet1'!B2", [['a@x.com']]), ("'Sheet1'!A3", [['Bo']]), ("'Sheet1'!C3", [['Sent']])]),
+])
+def test_flush_coalesces_writes(writes, expected):
+    worksheet = StubWorksheet()
+    sheet = SheetSnapshot(worksheet, ROWS)
+    for row, col, value in writes:
+        sheet.update_cell(row, col, value)
+    sheet.flush()
+    assert worksheet.calls == ([expected] if expected else [])
+    assert sheet.pending == {}
+
+def test_writes_are_visible_before_the_flush():
+    sheet = SheetSnapshot(StubWorksheet(), ROWS)
+    sheet.update_cell(3, 3, 'Sent')
+    assert sheet.rows.row(3)[2] == 'Sent'
+    assert sheet.leads.find(status='Sent') == [2, 3]
+
+def test_flush_retries_with_fresh_ranges():
+    worksheet = StubWorksheet(failures=2)
+    sheet = SheetSnapshot(worksheet, ROWS)
+    sheet.update_cell(2, 3, 'Replied')
+    sheet.flush()
+    assert worksheet.calls == [[("'Sheet1'!C2", [['Replied']])]]
+
+def test_failed_flush_requeues_without_overwriting_newer_writes(monkeypatch):
+    monkeypatch.setattr(retry, 'RETRY_ATTEMPTS', 2)
+    worksheet = StubWorksheet(failures=2)
+    sheet = SheetSnapshot(worksheet, ROWS)
+    sheet.update_cell(2, 3, 'Replied')
+    sheet.update_cell(2, 4, 'old note')
+    batch_update = worksheet.batch_update
+
+    def write_during_flush(data, **kwargs):
+        sheet.update_cell(2, 4, 'new note') # another worker, while the flush is failing
+        return batch_update(data, **kwargs)
+
+    monkeypatch.setattr(worksheet, 'batch_update', write_during_flush)
+    with pytest.raises(QuotaError):
+        sheet.flush()
+    assert sheet.pending == {2: {3: 'Replied', 4: 'new note'}}
+    monkeypatch.setattr(worksheet, 'batch_update', batch_update)
+    sheet.flush()
+    assert worksheet.calls == [[("'Sheet1'!C2:D2", [['Replied', 'new note']])]]
+
+def test_chunks_of_ranges(monkeypatch):
+    monkeypatch.setattr(sheet_module, 'MAX_RANGES_PER_BATCH', 2)
+    worksheet = StubWorksheet()
+    sheet = SheetSnapshot(worksheet, ROWS)
+    for row in (2, 3):
+        sheet.update_cell(row, 1, 'a')
+        sheet.update_cell(row, 3, 'c')
+    sheet.flush()
+    assert [len(call) for call in worksheet.calls] == [2, 2]
+
+def test_auto_flush(monkeypatch):
+    monkeypatch.setattr(sheet_module, 'AUTO_FLUSH_CELLS', 3)
+    worksheet = StubWorksheet()
+    sheet = SheetSnapshot(worksheet, ROWS)
+    sheet.update_cell(2, 1, 'a')
+    sheet.update_cell(2, 2, 'b')
+    assert worksheet.calls == []
+    sheet.update_cell(3, 1, 'c')
+    assert len(worksheet.calls) == 1 and sheet.pending == {}